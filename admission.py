@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# Admission control in front of the command handlers. Requests run on a
+# fixed set of worker threads fed from a bounded queue, after per-client-IP
+# and per-user token bucket checks. A request that cannot be admitted is
+# shed at once with a hint of when to retry, rather than queued behind work
+# the server cannot get through, so what is admitted keeps a bounded wait.
+#
+# The queue has one lane per priority class and workers always take from
+# the most important non-empty lane. When it is full, a request displaces
+# the newest queued request of a less important class, or is shed itself
+# if there is none. Requests that waited longer than `max_wait` are shed
+# when they reach a worker: their client has most likely given up.
+#
+# A connection's replies count against it until they are written: a client
+# that pipelines requests without reading the replies is shed once it has
+# `max_pipelined` of them outstanding, before its requests take up the
+# queue or the workers.
+
+# Priority classes, most important first
+CRITICAL, NORMAL, POLL = range(3)
+PRIORITY_NAMES = ("critical", "normal", "poll")
+
+
+class Shed(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Request shed ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# Token buckets keyed by client IP or username: on average `rate` requests
+# a second, in bursts of up to `burst`. A rate of 0 turns the limit off.
+class TokenBuckets:
+    def __init__(self, rate=0, burst=10, max_keys=100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = {}   # key -> [tokens, time of last refill]
+        self.lock = threading.Lock()
+
+    # 0 if a token was taken, else the seconds until one will be there
+    def take(self, key):
+        if not self.rate or key is None:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self._prune(now)
+                bucket = self.buckets[key] = [self.burst, now]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0
+            bucket[0] = tokens
+            return (1 - tokens) / self.rate
+
+    # A bucket that has refilled is no different from a new one. If most
+    # keys are still active, the oldest are forgotten to leave some room.
+    def _prune(self, now):
+        for key, (tokens, last) in list(self.buckets.items()):
+            if tokens + (now - last) * self.rate >= self.burst:
+                del self.buckets[key]
+        while len(self.buckets) >= self.max_keys * 3 // 4:
+            del self.buckets[next(iter(self.buckets))]
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+class AdmissionControl:
+    def __init__(self, workers=8, queue_size=256, max_wait=5.0, ip_rate=0, ip_burst=20,
+                 user_rate=0, user_burst=10, max_pipelined=0, on_shed=None):
+        self.queue_size = queue_size
+        self.max_pipelined = max_pipelined
+        self.max_wait = max_wait
+        self.ip_limits = TokenBuckets(ip_rate, ip_burst)
+        self.user_limits = TokenBuckets(user_rate, user_burst)
+        # on_shed(reason, priority) is called for every shed request
+        self.on_shed = on_shed
+        self.lanes = [deque() for _ in PRIORITY_NAMES]
+        self.queued = 0
+        self.cond = threading.Condition()
+        self.closed = False
+        # Moving average of seconds per request, for retry-after hints
+        self.service_time = 0.01
+        self.workers = [threading.Thread(target=self._work, name=f"request-{i}", daemon=True)
+                        for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    # Run fn(*args) on a worker; returns a Future of its result. `backlog`
+    # is the number of replies the request's connection has yet to write.
+    # Raises Shed if the request is refused; the Future can also fail with
+    # Shed if the request is displaced or waits too long.
+    def submit(self, priority, client_ip, username, fn, *args, backlog=0):
+        if self.max_pipelined and backlog >= self.max_pipelined:
+            raise self._shed("connection_backlog", priority, self._retry_after())
+        wait = self.ip_limits.take(client_ip)
+        if wait:
+            raise self._shed("ip_rate", priority, wait)
+        wait = self.user_limits.take(username)
+        if wait:
+            raise self._shed("user_rate", priority, wait)
+        future = Future()
+        displaced = None
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("Server is shutting down")
+            if self.queued >= self.queue_size:
+                lane = next((lane for lane in reversed(self.lanes[priority + 1:]) if lane), None)
+                if lane is None:
+                    raise self._shed("queue_full", priority, self._retry_after())
+                displaced = lane.pop()
+                self.queued -= 1
+            self.lanes[priority].append((future, fn, args, priority, time.monotonic()))
+            self.queued += 1
+            self.cond.notify()
+        if displaced is not None:
+            self._fail(displaced, "displaced")
+        return future
+
+    def _shed(self, reason, priority, retry_after):
+        if self.on_shed is not None:
+            self.on_shed(reason, PRIORITY_NAMES[priority])
+        return Shed(reason, retry_after)
+
+    def _fail(self, item, reason):
+        future, fn, args, priority, queued_at = item
+        if future.set_running_or_notify_cancel():
+            future.set_exception(self._shed(reason, priority, self._retry_after()))
+
+    # About how long until the queue has room again
+    def _retry_after(self):
+        return max(0.05, (self.queued + 1) * self.service_time / len(self.workers))
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while not self.queued and not self.closed:
+                    self.cond.wait()
+                if not self.queued:
+                    return
+                lane = next(lane for lane in self.lanes if lane)
+                item = lane.popleft()
+                self.queued -= 1
+            future, fn, args, priority, queued_at = item
+            if self.max_wait and time.monotonic() - queued_at > self.max_wait:
+                self._fail(item, "timeout")
+                continue
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            self.service_time += 0.1 * (time.perf_counter() - start - self.service_time)
+
+    # Requests queued per priority class
+    def depths(self):
+        with self.cond:
+            return {name: len(lane) for name, lane in zip(PRIORITY_NAMES, self.lanes)}
+
+    # Workers finish what is queued, then exit
+    def shutdown(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
@@ -0,0 +1,181 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# Password hashing and login sessions.
+#
+# Passwords are stored as "pbkdf2_sha256$<iterations>$<salt>$<hash>". The
+# hash is deliberately slow, so callers run it on a worker pool rather than
+# on a request thread (hashlib releases the GIL while it works). Rows from
+# before hashing hold the plain password; they still verify and are
+# rehashed on the next successful login.
+
+HASH_SCHEME = "pbkdf2_sha256"
+HASH_ITERATIONS = 200_000
+SALT_BYTES = 16
+# Unsigned session tokens are token_urlsafe(TOKEN_BYTES)
+TOKEN_BYTES = 24
+TOKEN_LENGTH = 32
+TOKEN_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_")
+
+
+def hash_password(password, iterations=HASH_ITERATIONS):
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return "$".join((HASH_SCHEME, str(iterations), b64(salt), b64(digest)))
+
+def verify_password(password, stored):
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode(), (stored or "").encode())
+    scheme, iterations, salt, digest = stored.split("$")
+    computed = hashlib.pbkdf2_hmac("sha256", password.encode(), unb64(salt), int(iterations))
+    return hmac.compare_digest(computed, unb64(digest))
+
+def is_hashed(stored):
+    return stored is not None and stored.startswith(HASH_SCHEME + "$")
+
+# Stored passwords that should be replaced after a successful login
+def needs_rehash(stored, iterations=HASH_ITERATIONS):
+    return not is_hashed(stored) or int(stored.split("$")[1]) != iterations
+
+def b64(data):
+    return base64.b64encode(data).decode()
+
+def unb64(text):
+    return base64.b64decode(text.encode())
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def unb64url(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+# Verified against when the username does not exist, so an unknown user
+# takes as long to reject as a wrong password
+DUMMY_HASH = hash_password(secrets.token_hex(8), 1)
+
+def dummy_hash(iterations=HASH_ITERATIONS):
+    return "$".join((HASH_SCHEME, str(iterations)) + tuple(DUMMY_HASH.split("$")[2:]))
+
+
+# Whether `text` has the shape of a session token (signed or not). Such an
+# argument is never taken for a username, so a stale token is refused
+# rather than acted on as a user named after it.
+def looks_like_token(text):
+    if text.count(".") == 4:
+        return True
+    return len(text) == TOKEN_LENGTH and TOKEN_CHARS.issuperset(text)
+
+
+class Session:
+    __slots__ = ("username", "role", "expires_at")
+
+    def __init__(self, username, role, expires_at):
+        self.username = username
+        self.role = role
+        self.expires_at = expires_at
+
+
+# Live sessions keyed by token. Each use pushes a session's expiry out by
+# `ttl` and moves it to the end, so the dict stays ordered by expiry and
+# expired sessions are evicted from the front in O(1) per session.
+#
+# With a `secret` (shared by the processes of one server), tokens are signed
+# "<nonce>.<username>.<role>.<expiry>.<mac>" and a table also accepts tokens
+# another process issued. Sessions then expire `ttl` after login rather than
+# after last use. Revocations have to reach every process through revoke();
+# revoked tokens are remembered until they expire.
+class SessionTable:
+    def __init__(self, ttl=3600, max_sessions=100_000, secret=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.secret = secret
+        self.sessions = OrderedDict()
+        self.revoked = {}   # signed token -> wall-clock expiry
+        self.lock = threading.Lock()
+
+    def create(self, username, role):
+        if self.secret is not None:
+            token = self._sign(username, role, int(time.time() + self.ttl))
+        else:
+            token = secrets.token_urlsafe(TOKEN_BYTES)
+        with self.lock:
+            self._evict(time.monotonic())
+            self.sessions[token] = Session(username, role, time.monotonic() + self.ttl)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        return token
+
+    # The live session for `token`, or None
+    def get(self, token):
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return self._adopt(token, now)
+            if session.expires_at < now:
+                del self.sessions[token]
+                return None
+            if self.secret is None:
+                session.expires_at = now + self.ttl
+                self.sessions.move_to_end(token)
+            return session
+
+    def revoke(self, token):
+        claims = self._verify(token) if self.secret is not None else None
+        with self.lock:
+            revoked = self.sessions.pop(token, None) is not None
+            if claims is not None and claims[2] >= time.time() and token not in self.revoked:
+                self.revoked[token] = claims[2]
+                revoked = True
+            return revoked
+
+    def _sign(self, username, role, expires):
+        payload = ".".join((secrets.token_urlsafe(9), b64url(username.encode()), role, str(expires)))
+        return f"{payload}.{self._mac(payload)}"
+
+    def _mac(self, payload):
+        return b64url(hmac.new(self.secret, payload.encode(), hashlib.sha256).digest()[:18])
+
+    # (username, role, expiry) of a correctly signed token, or None
+    def _verify(self, token):
+        parts = token.split(".")
+        if len(parts) != 5:
+            return None
+        payload, mac = token.rsplit(".", 1)
+        if not hmac.compare_digest(mac.encode(), self._mac(payload).encode()):
+            return None
+        try:
+            return unb64url(parts[1]).decode(), parts[2], int(parts[3])
+        except ValueError:
+            return None
+
+    # Called with the lock held: a signed token issued by another process
+    def _adopt(self, token, now):
+        if self.secret is None:
+            return None
+        claims = self._verify(token)
+        if claims is None or claims[2] < time.time() or token in self.revoked:
+            return None
+        username, role, expires = claims
+        session = self.sessions[token] = Session(username, role, now + expires - time.time())
+        return session
+
+    def _evict(self, now):
+        if self.revoked:
+            wall = time.time()
+            self.revoked = {token: expires for token, expires in self.revoked.items()
+                            if expires >= wall}
+        while self.sessions:
+            token, session = next(iter(self.sessions.items()))
+            if session.expires_at >= now:
+                return
+            del self.sessions[token]
+
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,393 @@
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import client
+import protocol
+
+# Load generator for server.py: starts a server on a throwaway SQLite file
+# with the in-process broker, seeds users, courses and resources, then has
+# many simulated clients send a weighted mix of commands for a fixed time.
+# Each client is one framed connection issuing one request at a time, so
+# the latencies below are what a user would see.
+#
+#   python bench.py --clients 64 --duration 30 --output before.json
+#   python bench.py --clients 64 --duration 30 --compare before.json
+
+DEFAULT_MIX = ("LOGIN=5,GET_COURSES=20,GET_RESOURCES=40,UPLOAD_RESOURCE=5,"
+               "SUBSCRIBE=5,GET_NEW_RESOURCES=25")
+PERCENTILES = (50, 90, 99, 99.9)
+# Seeding requests pipelined at once: below the server's default
+# --request-queue (256), so admission control does not shed them
+SEED_BATCH = 100
+# Rounds in a row the server may answer every remaining seeding request
+# busy before they count as failed
+SEED_ATTEMPTS = 5
+INSTRUCTOR = "bench_instructor"
+PASSWORD = "bench"
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        command, _, weight = item.partition("=")
+        command = command.strip()
+        if command not in COMMAND_BUILDERS:
+            raise argparse.ArgumentTypeError(f"unknown command {command!r}")
+        mix[command] = float(weight or 1)
+    return mix
+
+# Each builder turns a random choice of user and course into a request line
+def build_login(rng, args):
+    return f"LOGIN user{rng.randrange(args.users)} {PASSWORD}"
+
+def build_get_courses(rng, args):
+    return "GET_COURSES"
+
+def build_get_resources(rng, args):
+    return f"GET_RESOURCES course{rng.randrange(args.courses)}"
+
+def build_upload(rng, args):
+    course = rng.randrange(args.courses)
+    return f"UPLOAD_RESOURCE course{course} https://bench.local/{course}/{uuid.uuid4().hex} {INSTRUCTOR}"
+
+def build_subscribe(rng, args):
+    return f"SUBSCRIBE user{rng.randrange(args.users)} course{rng.randrange(args.courses)}"
+
+def build_get_new_resources(rng, args):
+    return f"GET_NEW_RESOURCES user{rng.randrange(args.users)} course{rng.randrange(args.courses)}"
+
+COMMAND_BUILDERS = {
+    "LOGIN": build_login,
+    "GET_COURSES": build_get_courses,
+    "GET_RESOURCES": build_get_resources,
+    "UPLOAD_RESOURCE": build_upload,
+    "SUBSCRIBE": build_subscribe,
+    "GET_NEW_RESOURCES": build_get_new_resources,
+}
+
+
+# Start server.py in a child process so it does not share our GIL
+def start_server(args, workdir):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+               "--host", args.host, "--port", str(args.port), "--mode", args.mode,
+               "--broker", "inprocess", "--db", os.path.join(workdir, "bench.db")]
+    if args.password_iterations:
+        command += ["--password-iterations", str(args.password_iterations)]
+    command += args.server_arg
+    log = open(os.path.join(workdir, "server.log"), "w")
+    # REGISTER only creates students, so the uploading instructor is added
+    # to the database before the server starts
+    subprocess.run(command + ["--add-user", "instructor", INSTRUCTOR], input=PASSWORD + "\n",
+                   text=True, stdout=log, stderr=subprocess.STDOUT, check=True)
+    process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}, "
+                               f"see {log.name}")
+        try:
+            socket.create_connection((args.host, args.port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("server did not start listening within 30s")
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def open_connection(args):
+    return client.Connection(args.host, args.port, binary=not args.text)
+
+# Send requests pipelined in batches, retrying those the server was too
+# busy for after the delay it asks for; returns how many failed
+def send_batched(conn, messages):
+    failed = 0
+    for start in range(0, len(messages), SEED_BATCH):
+        batch = messages[start:start + SEED_BATCH]
+        stalled = 0
+        while batch:
+            futures = [conn.submit(client.encode_message(conn, m)) for m in batch]
+            retry, wait = [], 0
+            for message, future in zip(batch, futures):
+                reply = client.reply_text(message, future.result(client.REQUEST_TIMEOUT))
+                retry_after = protocol.busy_retry_after(reply)
+                if retry_after is not None:
+                    retry.append(message)
+                    wait = max(wait, retry_after)
+                elif reply.startswith("Error"):
+                    failed += 1
+            stalled = stalled + 1 if len(retry) == len(batch) else 0
+            if stalled == SEED_ATTEMPTS:
+                failed += len(retry)
+                break
+            time.sleep(wait)
+            batch = retry
+    return failed
+
+def seed(args):
+    rng = random.Random(args.seed)
+    conn = open_connection(args)
+    try:
+        messages = [f"REGISTER student user{i} {PASSWORD}" for i in range(args.users)]
+        failed = send_batched(conn, messages)
+        failed += send_batched(conn, [f"UPLOAD_RESOURCE course{c} https://bench.local/{c}/seed{r} {INSTRUCTOR}"
+                            for c in range(args.courses) for r in range(args.resources)])
+        failed += send_batched(conn, [f"SUBSCRIBE user{u} course{c}"
+                            for u in range(args.users)
+                            for c in rng.sample(range(args.courses),
+                                                min(args.subscriptions, args.courses))])
+    finally:
+        conn.close()
+    return failed
+
+
+# One simulated client: a closed loop of requests on its own connection.
+# Latencies are recorded in nanoseconds per command once `measure_from`
+# passes. Requests shed by admission control are counted as busy, not as
+# served, and the client waits the delay the server asks for.
+class Worker:
+    def __init__(self, index, args, mix, measure_from, stop_at):
+        self.args = args
+        self.rng = random.Random(args.seed * 1000003 + index)
+        self.commands = list(mix)
+        self.weights = list(mix.values())
+        self.measure_from = measure_from
+        self.stop_at = stop_at
+        self.latencies = {command: [] for command in mix}
+        self.errors = {command: 0 for command in mix}
+        self.busy = {command: 0 for command in mix}
+        self.failure = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        try:
+            conn = open_connection(self.args)
+        except Exception as e:
+            self.failure = e
+            return
+        try:
+            while True:
+                now = time.perf_counter()
+                if now >= self.stop_at:
+                    break
+                command = self.rng.choices(self.commands, self.weights)[0]
+                message = COMMAND_BUILDERS[command](self.rng, self.args)
+                start = time.perf_counter_ns()
+                payload = conn.submit(client.encode_message(conn, message)).result(client.REQUEST_TIMEOUT)
+                elapsed = time.perf_counter_ns() - start
+                status, fields = client.decode_reply(command, payload)
+                if status == protocol.STATUS_BUSY:
+                    if now >= self.measure_from:
+                        self.busy[command] += 1
+                    time.sleep(protocol.busy_retry_after(fields[0]) or 0.01)
+                    continue
+                if now < self.measure_from:
+                    continue
+                self.latencies[command].append(elapsed)
+                if status == protocol.STATUS_ERROR:
+                    self.errors[command] += 1
+        except Exception as e:
+            self.failure = e
+        finally:
+            conn.close()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+    return sorted_values[index]
+
+# Log-scaled histogram: bucket upper bounds double from 50us
+def histogram(sorted_values):
+    buckets = []
+    bound = 50_000
+    i = 0
+    while i < len(sorted_values):
+        count = 0
+        while i < len(sorted_values) and sorted_values[i] <= bound:
+            count += 1
+            i += 1
+        buckets.append([bound / 1e6, count])
+        bound *= 2
+    return buckets
+
+def summarize(latencies, errors, busy, duration):
+    values = sorted(latencies)
+    summary = {
+        "requests": len(values),
+        "errors": errors,
+        "busy": busy,
+        "throughput_rps": round(len(values) / duration, 1),
+        "mean_ms": round(sum(values) / len(values) / 1e6, 3) if values else 0,
+        "max_ms": round(values[-1] / 1e6, 3) if values else 0,
+    }
+    for p in PERCENTILES:
+        summary[f"p{str(p).replace('.', '')}_ms"] = round(percentile(values, p) / 1e6, 3)
+    summary["histogram_ms"] = histogram(values)
+    return summary
+
+def run_benchmark(args, mix):
+    workers = []
+    start = time.perf_counter()
+    measure_from = start + args.warmup
+    stop_at = measure_from + args.duration
+    for i in range(args.clients):
+        workers.append(Worker(i, args, mix, measure_from, stop_at))
+    for worker in workers:
+        worker.thread.start()
+    for worker in workers:
+        worker.thread.join()
+    failures = [w.failure for w in workers if w.failure is not None]
+    if failures:
+        print(f"{len(failures)} clients failed, first error: {failures[0]!r}")
+
+    commands = {}
+    for command in mix:
+        latencies = [ns for w in workers for ns in w.latencies[command]]
+        errors = sum(w.errors[command] for w in workers)
+        busy = sum(w.busy[command] for w in workers)
+        commands[command] = summarize(latencies, errors, busy, args.duration)
+    total = summarize([ns for w in workers for values in w.latencies.values() for ns in values],
+                      sum(c["errors"] for c in commands.values()),
+                      sum(c["busy"] for c in commands.values()), args.duration)
+    total["failed_clients"] = len(failures)
+    return {"total": total, "commands": commands}
+
+# The server's own view of the run (STATS), saved alongside our numbers
+def server_stats(args):
+    try:
+        conn = open_connection(args)
+    except OSError:
+        return None
+    try:
+        payload = conn.submit(client.encode_message(conn, "STATS")).result(client.REQUEST_TIMEOUT)
+        status, fields = client.decode_reply("STATS", payload)
+        return json.loads(fields[0]) if status == protocol.STATUS_OK else None
+    finally:
+        conn.close()
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results):
+    print(f"{'command':<20}{'requests':>10}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'p999 ms':>10}{'max ms':>10}{'errors':>8}{'busy':>8}")
+    rows = list(results["commands"].items()) + [("TOTAL", results["total"])]
+    for command, s in rows:
+        print(f"{command:<20}{s['requests']:>10}{s['throughput_rps']:>10}{s['p50_ms']:>10}"
+              f"{s['p99_ms']:>10}{s['p999_ms']:>10}{s['max_ms']:>10}{s['errors']:>8}"
+              f"{s['busy']:>8}")
+
+# Print the change against a saved run, per command
+def print_comparison(results, baseline):
+    print(f"\ncompared with {baseline.get('revision') or 'baseline'}:")
+    print(f"{'command':<20}{'rps':>12}{'p50':>12}{'p99':>12}{'p999':>12}")
+    rows = list(results["commands"].items()) + [("TOTAL", results["total"])]
+    for command, s in rows:
+        old = baseline["total"] if command == "TOTAL" else baseline["commands"].get(command)
+        if old is None:
+            continue
+        cells = []
+        for key in ("throughput_rps", "p50_ms", "p99_ms", "p999_ms"):
+            cells.append(f"{(s[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else "n/a")
+        print(f"{command:<20}" + "".join(f"{cell:>12}" for cell in cells))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="LMS server load benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5500)
+    parser.add_argument("--mode", choices=["threaded", "async"], default="async",
+                        help="server mode to start")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="extra argument for server.py (repeatable), e.g. --server-arg=--db-workers=16")
+    parser.add_argument("--external", action="store_true",
+                        help="benchmark a server already running on --host/--port "
+                             "instead of starting one (seeding it needs the account "
+                             "server.py --add-user instructor bench_instructor)")
+    parser.add_argument("--password-iterations", type=int,
+                        help="PBKDF2 iterations for the started server (lower it to keep "
+                             "seeding fast; LOGIN latency is dominated by the hash)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--courses", type=int, default=20)
+    parser.add_argument("--resources", type=int, default=50,
+                        help="resources seeded per course")
+    parser.add_argument("--subscriptions", type=int, default=3,
+                        help="courses each seeded user subscribes to")
+    parser.add_argument("--no-seed", action="store_true",
+                        help="skip seeding (reuse the data of an --external server)")
+    parser.add_argument("--clients", type=int, default=32,
+                        help="concurrent simulated clients")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=2,
+                        help="seconds of load before measuring starts")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"weighted command mix (default {DEFAULT_MIX})")
+    parser.add_argument("--text", action="store_true",
+                        help="use text payloads instead of negotiating the binary protocol")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory(prefix="lms-bench-") as workdir:
+        process = None if args.external else start_server(args, workdir)
+        try:
+            if not args.no_seed:
+                started = time.perf_counter()
+                failed = seed(args)
+                print(f"Seeded {args.users} users, {args.courses} courses x "
+                      f"{args.resources} resources in {time.perf_counter() - started:.1f}s"
+                      + (f" ({failed} seed requests failed)" if failed else ""))
+            results = run_benchmark(args, args.mix)
+            results["server_stats"] = server_stats(args)
+        finally:
+            if process is not None:
+                stop_server(process)
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "compare")},
+        **results,
+    }
+    print_report(results)
+    if baseline is not None:
+        print_comparison(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
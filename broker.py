@@ -0,0 +1,397 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+# Message brokers behind the server's publish/subscribe path. Both expose:
+#   publish(topic, message)  -> number of subscribers reached
+#   psubscribe(pattern)      -> Subscription yielding (topic, message)
+#   pipeline()               -> buffered publishes sent by execute()
+# Topics and patterns are ':'-separated, e.g. course:101 and course:*.
+
+
+# Redis pub/sub (the original deployment). redis is only imported when this
+# broker is used, so single-box deployments do not need it installed.
+class RedisBroker:
+    def __init__(self, host="localhost", port=6379, db=0):
+        import redis
+        self.client = redis.Redis(host=host, port=port, db=db)
+
+    def publish(self, topic, message):
+        return self.client.publish(topic, message)
+
+    def pipeline(self):
+        return self.client.pipeline(transaction=False)
+
+    def psubscribe(self, pattern):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(pattern)
+        return RedisSubscription(pubsub)
+
+    def close(self):
+        self.client.close()
+
+
+class RedisSubscription:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get_message(self, timeout=None):
+        message = self.pubsub.get_message(timeout=timeout)
+        if message is None or message["type"] != "pmessage":
+            return None
+        return message["channel"], message["data"]
+
+    def listen(self):
+        for message in self.pubsub.listen():
+            if message["type"] == "pmessage":
+                yield message["channel"], message["data"]
+
+    def close(self):
+        self.pubsub.close()
+
+
+# Fixed-size ring buffer with many producers and a single consumer. It takes
+# no locks: producers claim a slot with next() on an itertools.count and
+# store (seq, item) with one list assignment, both atomic under the GIL.
+# A consumer that falls a full lap behind skips ahead and counts the loss.
+class RingBuffer:
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.write_seq = itertools.count()
+        self.read_seq = 0
+        self.overruns = 0
+        self.ready = threading.Event()
+
+    def put(self, item):
+        seq = next(self.write_seq)
+        self.slots[seq % self.capacity] = (seq, item)
+        self.ready.set()
+
+    def _take(self):
+        slot = self.slots[self.read_seq % self.capacity]
+        while slot is not None and slot[0] > self.read_seq:
+            # Producers lapped us; the oldest surviving item is one lap back
+            skip_to = slot[0] - self.capacity + 1
+            self.overruns += skip_to - self.read_seq
+            self.read_seq = skip_to
+            slot = self.slots[self.read_seq % self.capacity]
+        if slot is None or slot[0] != self.read_seq:
+            return None
+        self.read_seq += 1
+        return slot
+
+    # Next item, or None if nothing arrives within `timeout`
+    def get(self, timeout=None):
+        while True:
+            # Clear before checking so a put() in between is not missed
+            self.ready.clear()
+            slot = self._take()
+            if slot is not None:
+                return slot[1]
+            if not self.ready.wait(timeout) and timeout is not None:
+                return None
+
+
+class TrieNode:
+    __slots__ = ("children", "subscribers")
+
+    def __init__(self):
+        self.children = {}
+        self.subscribers = ()
+
+
+# Topic trie keyed by ':'-separated segments. '*' matches exactly one
+# segment, or one-or-more when it is the last segment of the pattern (so
+# course:* behaves like the Redis glob). Subscriber tuples are replaced,
+# never mutated, so match() runs without taking the lock.
+class TopicTrie:
+    def __init__(self):
+        self.root = TrieNode()
+        self.lock = threading.Lock()
+
+    def add(self, pattern, subscriber):
+        with self.lock:
+            node = self.root
+            for segment in pattern.split(":"):
+                node = node.children.setdefault(segment, TrieNode())
+            node.subscribers = node.subscribers + (subscriber,)
+
+    def remove(self, pattern, subscriber):
+        with self.lock:
+            node = self.root
+            for segment in pattern.split(":"):
+                node = node.children.get(segment)
+                if node is None:
+                    return
+            node.subscribers = tuple(s for s in node.subscribers if s is not subscriber)
+
+    def match(self, topic):
+        segments = topic.split(":")
+        matched = []
+        self._match(self.root, segments, 0, matched)
+        return set(matched)
+
+    def _match(self, node, segments, i, matched):
+        if i == len(segments):
+            matched.extend(node.subscribers)
+            return
+        child = node.children.get(segments[i])
+        if child is not None:
+            self._match(child, segments, i + 1, matched)
+        star = node.children.get("*")
+        if star is not None:
+            self._match(star, segments, i + 1, matched)
+            if i + 1 < len(segments):
+                matched.extend(star.subscribers)
+
+
+# Broker living inside the server process: no network hop per publish and
+# no external service, for single-box deployments, tests and benchmarks
+class InProcessBroker:
+    def __init__(self, buffer_size=1024):
+        self.buffer_size = buffer_size
+        self.trie = TopicTrie()
+
+    def publish(self, topic, message):
+        subscriptions = self.trie.match(topic)
+        for subscription in subscriptions:
+            subscription.buffer.put((topic, message))
+        return len(subscriptions)
+
+    def pipeline(self):
+        return InProcessPipeline(self)
+
+    def psubscribe(self, pattern):
+        subscription = InProcessSubscription(self, pattern)
+        self.trie.add(pattern, subscription)
+        return subscription
+
+    subscribe = psubscribe
+
+    def close(self):
+        pass
+
+
+class InProcessSubscription:
+    def __init__(self, broker, pattern):
+        self.broker = broker
+        self.pattern = pattern
+        self.buffer = RingBuffer(broker.buffer_size)
+        self.closed = False
+
+    def get_message(self, timeout=None):
+        if self.closed:
+            return None
+        message = self.buffer.get(timeout)
+        return None if message is self else message
+
+    def listen(self):
+        while not self.closed:
+            message = self.buffer.get()
+            if message is not self:
+                yield message
+
+    def close(self):
+        self.closed = True
+        self.broker.trie.remove(self.pattern, self)
+        # Wake a consumer blocked in get()/listen()
+        self.buffer.put(self)
+
+    @property
+    def overruns(self):
+        return self.buffer.overruns
+
+
+# Mirrors redis-py's pipeline: publish() buffers, execute() sends them all
+class InProcessPipeline:
+    def __init__(self, broker):
+        self.broker = broker
+        self.commands = []
+
+    def publish(self, topic, message):
+        self.commands.append((topic, message))
+        return self
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [self.broker.publish(topic, message) for topic, message in commands]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.commands = []
+
+
+BROKERS = ("redis", "inprocess")
+
+def create_broker(kind, redis_host="localhost", redis_port=6379, buffer_size=1024):
+    if kind == "redis":
+        return RedisBroker(redis_host, redis_port)
+    if kind == "inprocess":
+        return InProcessBroker(buffer_size)
+    raise ValueError(f"unknown broker {kind!r}")
+
+
+# Subscribe to `pattern` and call handle(topic, message) for every message,
+# resubscribing with backoff if the broker goes away. Meant to run on a
+# daemon thread; each caller gets its own subscription.
+def consume(message_broker, pattern, handle, name="subscriber"):
+    delay = 1
+    while True:
+        try:
+            subscription = message_broker.psubscribe(pattern)
+            delay = 1
+            for topic, message in subscription.listen():
+                handle(topic, message)
+        except Exception as e:
+            print(f"{name} error: {e}, retrying in {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+
+# Asynchronous publish stage between the request path and the broker.
+# publish() only buffers; a background thread sends. Messages for one topic
+# arriving within `window_ms` of its first are merged by merge(topic,
+# messages) into the list of messages actually sent (by default they are
+# sent as they are), and everything due is sent through one pipeline. If
+# the broker fails, what was not sent is retried with backoff, ahead of
+# newer messages and in order. At most `max_buffered` messages are held
+# meanwhile; past that the oldest are dropped and counted.
+class CoalescingPublisher:
+    def __init__(self, message_broker, window_ms=5, max_buffered=10000, merge=None,
+                 publish_timer=None):
+        self.message_broker = message_broker
+        self.window = window_ms / 1000
+        self.max_buffered = max_buffered
+        self.merge = merge or (lambda topic, messages: messages)
+        self.publish_timer = publish_timer
+        # topic -> [time of its first message, messages]; insertion order
+        # is window order, so the topics that are due come first
+        self.pending = {}
+        self.retry = deque()    # merged (topic, message) the broker failed to take
+        self.buffered = 0
+        self.cond = threading.Condition()
+        self.closed = False
+        self.retry_at = 0
+        self.published = 0
+        self.merged = 0
+        self.dropped = 0
+        self.failures = 0
+        self.thread = threading.Thread(target=self._run, name="publisher", daemon=True)
+        self.thread.start()
+
+    def publish(self, topic, message):
+        with self.cond:
+            entry = self.pending.get(topic)
+            if entry is None:
+                self.pending[topic] = [time.monotonic(), [message]]
+                self.cond.notify()
+            else:
+                entry[1].append(message)
+            self.buffered += 1
+            self._trim()
+
+    # Drop the oldest buffered messages beyond max_buffered. Called with
+    # self.cond held.
+    def _trim(self):
+        while self.buffered > self.max_buffered:
+            if self.retry:
+                self.retry.popleft()
+            else:
+                topic = next(iter(self.pending))
+                messages = self.pending[topic][1]
+                messages.pop(0)
+                if not messages:
+                    del self.pending[topic]
+            self.buffered -= 1
+            self.dropped += 1
+
+    # Messages due to be sent, waiting for them if there are none yet;
+    # None once closed and empty
+    def _take(self):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if self.closed:
+                    due = list(self.pending)
+                else:
+                    due = []
+                    for topic, (first, messages) in self.pending.items():
+                        if now - first < self.window:
+                            break
+                        due.append(topic)
+                backing_off = now < self.retry_at and not self.closed
+                if (due or self.retry) and not backing_off:
+                    break
+                if self.closed and not self.retry:
+                    return None
+                if backing_off:
+                    timeout = self.retry_at - now
+                elif self.pending:
+                    timeout = next(iter(self.pending.values()))[0] + self.window - now
+                else:
+                    timeout = None
+                self.cond.wait(timeout)
+            batch = list(self.retry)
+            self.retry.clear()
+            taken = len(batch)
+            for topic in due:
+                first, messages = self.pending.pop(topic)
+                taken += len(messages)
+                try:
+                    sent = self.merge(topic, messages)
+                except Exception as e:
+                    print(f"Error merging {len(messages)} messages for {topic}: {e}")
+                    self.dropped += len(messages)
+                    continue
+                self.merged += len(messages) - len(sent)
+                batch.extend((topic, message) for message in sent)
+            self.buffered -= taken
+            return batch
+
+    def _run(self):
+        delay = 0.1
+        while True:
+            batch = self._take()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                pipe = self.message_broker.pipeline()
+                for topic, message in batch:
+                    pipe.publish(topic, message)
+                pipe.execute()
+            except Exception as e:
+                with self.cond:
+                    self.failures += 1
+                    # Closing gives the broker one last try only
+                    if self.closed:
+                        self.dropped += len(batch)
+                        print(f"Error publishing {len(batch)} notifications: {e}")
+                        continue
+                    self.retry.extendleft(reversed(batch))
+                    self.buffered += len(batch)
+                    self._trim()
+                    self.retry_at = time.monotonic() + delay
+                print(f"Error publishing {len(batch)} notifications: {e}, "
+                      f"retrying in {delay:.1f}s")
+                delay = min(delay * 2, 5)
+                continue
+            delay = 0.1
+            self.published += len(batch)
+            if self.publish_timer is not None:
+                self.publish_timer.observe(time.perf_counter() - start)
+
+    # Messages waiting to be sent
+    def __len__(self):
+        return self.buffered
+
+    # Send what is buffered, without waiting out windows, and stop
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
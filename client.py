@@ -1,15 +1,375 @@
 import socket
+import threading
+import itertools
+import json
+import queue
+from concurrent.futures import Future
+
+import protocol
 
 SERVER_HOST = "127.0.0.1"
 SERVER_PORT = 5000
 
+# Persistent connections kept open to the server, and how long to wait for
+# a response before giving up
+POOL_SIZE = 2
+REQUEST_TIMEOUT = 30
+
+# Offer the binary payload format on new connections (falls back to text
+# when the server does not support it)
+USE_BINARY = True
+
+# Also offer compressed payloads (only with USE_BINARY, as part of the same
+# HELLO), using the server's shared dictionary if ZDICT holds it (the bytes
+# of the server's --zdict file). Requests under COMPRESS_THRESHOLD bytes
+# are sent uncompressed.
+USE_COMPRESSION = True
+ZDICT = None
+COMPRESS_THRESHOLD = 1024
+
+
+# Raised when a request could not be written, so it is safe to retry
+class NotSentError(ConnectionError):
+    pass
+
+
+# One long-lived framed connection. Any number of threads may submit
+# requests on it at once; a reader thread matches responses to requests by id.
+# Responses are delivered as raw payload bytes.
+class Connection:
+    def __init__(self, host, port, on_push=None, binary=None):
+        self.on_push = on_push
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_lock = threading.Lock()
+        self.pending_lock = threading.Lock()
+        self.pending = {}
+        self.streams = {}
+        self.ids = itertools.count(1)
+        self.closed = False
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+        self.binary = False
+        self.compressor = None
+        if USE_BINARY if binary is None else binary:
+            self.binary = self.negotiate()
+
+    # Ask the server for binary (and compressed) payloads; an older server
+    # answers "Invalid request!" and the connection stays on plain text
+    def negotiate(self):
+        offer = [str(v) for v in protocol.SUPPORTED_VERSIONS]
+        compressors = {}
+        if USE_COMPRESSION:
+            compressors = protocol.make_compressors(ZDICT, threshold=COMPRESS_THRESHOLD)
+        try:
+            reply = self.submit(" ".join(["HELLO"] + offer + list(compressors))).result(REQUEST_TIMEOUT)
+        except Exception:
+            self.close()
+            raise
+        reply = reply.decode()
+        if reply.split()[:1] != ["HELLO"]:
+            return False
+        self.compressor = protocol.negotiate_compression(reply, compressors)[1]
+        return True
+
+    def submit(self, message):
+        future = Future()
+        with self.pending_lock:
+            if self.closed:
+                raise NotSentError("connection closed")
+            request_id = next(self.ids)
+            self.pending[request_id] = future
+        try:
+            frame = protocol.encode_frame(request_id, self._compress(message))
+            with self.send_lock:
+                self.sock.sendall(frame)
+        except OSError as e:
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+            self.close()
+            raise NotSentError(str(e))
+        return future
+
+    # Send a STREAM_* command and yield response chunks as they arrive
+    def stream(self, message):
+        chunks = queue.Queue()
+        with self.pending_lock:
+            if self.closed:
+                raise NotSentError("connection closed")
+            request_id = next(self.ids)
+            self.streams[request_id] = chunks
+        try:
+            frame = protocol.encode_frame(request_id, self._compress(message))
+            with self.send_lock:
+                self.sock.sendall(frame)
+        except OSError as e:
+            with self.pending_lock:
+                self.streams.pop(request_id, None)
+            self.close()
+            raise NotSentError(str(e))
+        first = True
+        while True:
+            chunk = chunks.get(timeout=REQUEST_TIMEOUT)
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+            # A refusal is the whole reply; servers that do not end it with
+            # an empty frame would otherwise leave us waiting
+            if first and is_refusal(chunk):
+                with self.pending_lock:
+                    self.streams.pop(request_id, None)
+                return
+            first = False
+
+    def _read_loop(self):
+        error = ConnectionError("connection closed by server")
+        try:
+            while True:
+                frame = protocol.read_frame(self.sock)
+                if frame is None:
+                    break
+                request_id, payload = frame
+                payload = protocol.decompress_payload(self.compressor, payload)
+                if request_id == protocol.PUSH_REQUEST_ID:
+                    if self.on_push is not None:
+                        self.on_push(json.loads(payload))
+                    continue
+                with self.pending_lock:
+                    chunks = self.streams.get(request_id)
+                    if chunks is not None and not payload:
+                        del self.streams[request_id]
+                    future = self.pending.pop(request_id, None) if chunks is None else None
+                if chunks is not None:
+                    chunks.put(payload if payload else None)
+                elif future is not None:
+                    future.set_result(payload)
+        except (OSError, protocol.ProtocolError) as e:
+            error = e
+        self.close(error)
+
+    def _compress(self, message):
+        return self.compressor.compress(message) if self.compressor is not None else message
+
+    def close(self, error=None):
+        with self.pending_lock:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+            streams, self.streams = self.streams, {}
+        error = error or ConnectionError("connection closed")
+        for future in pending.values():
+            future.set_exception(error)
+        for chunks in streams.values():
+            chunks.put(error)
+        # shutdown() first: close() alone does not wake the reader thread
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+# Whether a reply payload is an error or empty reply rather than data
+def is_refusal(payload):
+    if protocol.is_binary(payload):
+        return protocol.decode_response(payload)[0] != protocol.STATUS_OK
+    return protocol.text_status(payload.decode(errors="replace")) != protocol.STATUS_OK
+
+
+# Fixed-size set of persistent connections, handed out round-robin and
+# reopened transparently when the server drops them
+class ConnectionPool:
+    def __init__(self, host, port, size=POOL_SIZE):
+        self.host = host
+        self.port = port
+        self.connections = [None] * size
+        self.next_slot = itertools.count()
+        self.lock = threading.Lock()
+
+    def get(self):
+        slot = next(self.next_slot) % len(self.connections)
+        with self.lock:
+            conn = self.connections[slot]
+            if conn is None or conn.closed:
+                conn = Connection(self.host, self.port)
+                self.connections[slot] = conn
+            return conn
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                if conn is not None:
+                    conn.close()
+            self.connections = [None] * len(self.connections)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(SERVER_HOST, SERVER_PORT)
+        return _pool
+
+# Encode a text command line for `conn`: binary if the connection
+# negotiated it and the verb has an opcode, otherwise sent as it is
+def encode_message(conn, message):
+    parts = message.split()
+    if conn.binary and parts and parts[0] in protocol.OPCODES:
+        return protocol.encode_request(protocol.OPCODES[parts[0]], parts[1:])
+    return message
+
+def encode_call(conn, call):
+    command, args = call
+    if conn.binary:
+        return protocol.encode_request(protocol.OPCODES[command], args)
+    return " ".join((command,) + args)
+
+# Reply payload as (status, fields), whichever format the server used
+def decode_reply(command, payload):
+    if protocol.is_binary(payload):
+        return protocol.decode_response(payload)
+    text = payload.decode()
+    status = protocol.text_status(text)
+    if status == protocol.STATUS_OK and command in protocol.LIST_COMMANDS:
+        return status, text.split("|")
+    return status, [text]
+
+# Reply payload as the text protocol would have sent it
+def reply_text(message, payload):
+    if not protocol.is_binary(payload):
+        return payload.decode()
+    status, fields = protocol.decode_response(payload)
+    if status == protocol.STATUS_OK and message.split()[0] in protocol.LIST_COMMANDS:
+        return "|".join(fields)
+    return fields[0] if fields else ""
+
+# Submit requests on one pooled connection, retrying once on a fresh
+# connection if the pooled one turned out to be dead before sending.
+# `encode(conn, request)` builds each payload for the connection it goes on.
+def _submit(encode, *requests):
+    conn = get_pool().get()
+    futures = []
+    for request in requests:
+        try:
+            futures.append(conn.submit(encode(conn, request)))
+        except NotSentError:
+            conn = get_pool().get()
+            futures.append(conn.submit(encode(conn, request)))
+    return futures
+
 def send_request(message):
     try:
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect((SERVER_HOST, SERVER_PORT))
-        client_socket.send(message.encode())
-        response = client_socket.recv(1024).decode()
-        client_socket.close()
-        return response
+        return reply_text(message, _submit(encode_message, message)[0].result(REQUEST_TIMEOUT))
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+# Structured form of send_request: arguments are sent as separate fields
+# (so they may contain spaces or "|" on a binary connection) and the reply
+# comes back as (status, fields) with a protocol.STATUS_* code
+def call(command, *args):
+    try:
+        payload = _submit(encode_call, (command, args))[0].result(REQUEST_TIMEOUT)
+        return decode_reply(command, payload)
+    except Exception as e:
+        return protocol.STATUS_ERROR, [f"Error: {str(e)}"]
+
+# Pipeline several calls, each a (command, args) pair, on one connection and
+# return their (status, fields) replies in the same order
+def call_many(calls):
+    try:
+        futures = _submit(encode_call, *calls)
     except Exception as e:
-        return f"Error: {str(e)}"
\ No newline at end of file
+        return [(protocol.STATUS_ERROR, [f"Error: {str(e)}"])] * len(calls)
+    replies = []
+    for (command, args), future in zip(calls, futures):
+        try:
+            replies.append(decode_reply(command, future.result(REQUEST_TIMEOUT)))
+        except Exception as e:
+            replies.append((protocol.STATUS_ERROR, [f"Error: {str(e)}"]))
+    return replies
+
+# Pipeline several requests on one connection and return the responses in
+# the same order as the messages
+def send_requests(messages):
+    try:
+        futures = _submit(encode_message, *messages)
+    except Exception as e:
+        return [f"Error: {str(e)}"] * len(messages)
+    responses = []
+    for message, future in zip(messages, futures):
+        try:
+            responses.append(reply_text(message, future.result(REQUEST_TIMEOUT)))
+        except Exception as e:
+            responses.append(f"Error: {str(e)}")
+    return responses
+
+# Stream a STREAM_* command on a pooled connection, yielding each chunk
+# (a "|"-joined group of rows) as the server sends it
+def stream_request(message):
+    try:
+        conn = get_pool().get()
+        chunks = conn.stream(encode_message(conn, message))
+        first = next(chunks, None)
+    except NotSentError:
+        # Nothing was yielded yet, so retrying on a fresh connection is safe
+        conn = get_pool().get()
+        chunks = conn.stream(encode_message(conn, message))
+        first = next(chunks, None)
+    if first is None:
+        return
+    yield reply_text(message, first)
+    for chunk in chunks:
+        yield reply_text(message, chunk)
+
+# Legacy one-shot text protocol: one connection per request. The server
+# closes the socket after replying, so read until EOF instead of a single
+# recv to get the full response.
+def send_oneshot(message):
+    try:
+        with socket.create_connection((SERVER_HOST, SERVER_PORT)) as client_socket:
+            client_socket.sendall(message.encode())
+            chunks = []
+            while True:
+                chunk = client_socket.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return b"".join(chunks).decode()
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+# Keeps a dedicated connection in LISTEN mode and calls `callback` with each
+# notification the server pushes for the user's subscribed courses.
+# `username` may be the session token from LOGIN. The
+# callback runs on the connection's reader thread. Reconnects on drops.
+class NotificationListener:
+    def __init__(self, username, callback, retry_delay=2):
+        self.username = username
+        self.callback = callback
+        self.retry_delay = retry_delay
+        self.conn = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.conn = Connection(SERVER_HOST, SERVER_PORT, on_push=self.callback)
+                self.conn.submit(f"LISTEN {self.username}").result(REQUEST_TIMEOUT)
+                self.conn.reader.join()
+            except Exception:
+                pass
+            self.stopped.wait(self.retry_delay)
+
+    def stop(self):
+        self.stopped.set()
+        if self.conn is not None:
+            self.conn.close()
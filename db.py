@@ -0,0 +1,333 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+DB_PATH = "lms.db"
+
+
+# Pool of SQLite connections. Each handler borrows a connection for the
+# duration of one call, so concurrent requests never share a cursor, and
+# connections are reused across requests instead of reopened. Connections
+# run in WAL mode so readers do not block behind a writer's commit.
+# `synchronous` defaults to FULL: a commit reaches disk before its writes
+# are acknowledged. With group commit that is one fsync per batch rather
+# than per write. NORMAL skips it, and a power loss can then undo the last
+# batches after clients were told they succeeded.
+# `timer`, if set, observes how long each borrow lasted (its observe() takes
+# seconds, e.g. a metrics.Histogram).
+class ConnectionPool:
+    def __init__(self, path=DB_PATH, synchronous="FULL", cache_size_mb=16,
+                 mmap_size_mb=256, busy_timeout_ms=5000, max_idle=32, timer=None):
+        self.path = path
+        self.synchronous = synchronous
+        self.cache_size_mb = cache_size_mb
+        self.mmap_size_mb = mmap_size_mb
+        self.busy_timeout_ms = busy_timeout_ms
+        self.max_idle = max_idle
+        self.timer = timer
+        self.idle = []
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def open(self):
+        # Connections move between worker threads (one at a time), so the
+        # same-thread check is off; the pool guarantees exclusive use
+        conn = sqlite3.connect(self.path, check_same_thread=False,
+                               timeout=self.busy_timeout_ms / 1000)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        # Negative cache_size is in KiB rather than pages
+        conn.execute(f"PRAGMA cache_size=-{self.cache_size_mb * 1024}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size_mb * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        with self.lock:
+            self.opened += 1
+        return conn
+
+    @contextmanager
+    def connection(self):
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        if conn is None:
+            conn = self.open()
+        start = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            if self.timer is not None:
+                self.timer.observe(time.perf_counter() - start)
+            # Never hand a connection with an open transaction to the next caller
+            if conn.in_transaction:
+                conn.rollback()
+            with self.lock:
+                if len(self.idle) < self.max_idle:
+                    self.idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+class WriteJob:
+    __slots__ = ("write", "notifications", "on_commit", "alone", "future")
+
+    def __init__(self, write, notifications, on_commit, alone=False):
+        self.write = write
+        self.notifications = notifications
+        self.on_commit = on_commit
+        self.alone = alone
+        self.future = Future()
+
+
+# Single writer thread that group-commits writes from many requests. Jobs
+# arriving within `window_ms` of the first one (up to `max_batch`) share one
+# transaction and one fsync; each job runs under its own savepoint so a
+# failing job does not roll back the rest. Callers are answered only after
+# the batch commits. The batch's notifications are then handed to
+# `publisher` (a broker.CoalescingPublisher), which sends them in the
+# background, so callers never wait on the broker. `commit_timer` observes
+# the seconds each batch spent in its transaction.
+#
+# A bulk write (many rows in one job) is better off alone: it gets its own
+# transaction with no savepoint, since a savepoint makes SQLite keep a
+# statement journal of every page the job changes.
+class GroupCommitWriter:
+    def __init__(self, pool, publisher=None, window_ms=2, max_batch=256, commit_timer=None):
+        self.pool = pool
+        self.publisher = publisher
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.commit_timer = commit_timer
+        self.jobs = queue.Queue()
+        # A job that must go alone, taken while filling the previous batch
+        self.held = None
+        self.batches = 0
+        self.committed = 0
+        self.thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self.thread.start()
+
+    # `write(cursor)` runs inside the batch transaction; its return value (or
+    # exception) is delivered through the returned Future. `notifications`
+    # is a list of (topic, message) published once the batch is durable.
+    # `on_commit(result)`, if given, runs on the writer thread after the
+    # commit, in commit order, and may return more notifications. `alone`
+    # commits the job in a transaction of its own.
+    def submit(self, write, notifications=(), on_commit=None, alone=False):
+        job = WriteJob(write, notifications, on_commit, alone)
+        self.jobs.put(job)
+        return job.future
+
+    def execute(self, write, notifications=(), on_commit=None, alone=False):
+        return self.submit(write, notifications, on_commit, alone).result()
+
+    def _run(self):
+        while True:
+            job, self.held = self.held or self.jobs.get(), None
+            if job is None:
+                return
+            batch = [job]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch and not job.alone:
+                try:
+                    remaining = deadline - time.monotonic()
+                    job = self.jobs.get(timeout=remaining) if remaining > 0 else self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self.jobs.put(None)
+                    break
+                if job.alone:
+                    self.held = job
+                    break
+                batch.append(job)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        results = []
+        start = time.perf_counter()
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                if batch[0].alone:
+                    # Nothing else in the transaction to keep: if the job
+                    # fails, the pool rolls it all back
+                    results.append((True, batch[0].write(cursor)))
+                else:
+                    for job in batch:
+                        cursor.execute("SAVEPOINT job")
+                        try:
+                            results.append((True, job.write(cursor)))
+                            cursor.execute("RELEASE job")
+                        except Exception as e:
+                            cursor.execute("ROLLBACK TO job")
+                            cursor.execute("RELEASE job")
+                            results.append((False, e))
+                conn.commit()
+        except Exception as e:
+            for job in batch:
+                job.future.set_exception(e)
+            return
+        if self.commit_timer is not None:
+            self.commit_timer.observe(time.perf_counter() - start)
+
+        self.batches += 1
+        self.committed += len(batch)
+        notifications = []
+        for job, (ok, result) in zip(batch, results):
+            if not ok:
+                continue
+            notifications.extend(job.notifications)
+            if job.on_commit is not None:
+                try:
+                    notifications.extend(job.on_commit(result) or ())
+                except Exception as e:
+                    print(f"Error in post-commit hook: {e}")
+        self._publish(notifications)
+        for job, (ok, result) in zip(batch, results):
+            if ok:
+                job.future.set_result(result)
+            else:
+                job.future.set_exception(result)
+
+    # The writes are already durable; the publisher retries a broker
+    # failure rather than reporting it to the callers
+    def _publish(self, notifications):
+        if self.publisher is None:
+            return
+        for topic, message in notifications:
+            self.publisher.publish(topic, message)
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+
+
+# Create tables if they don't exist
+def create_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE,
+        password TEXT,
+        role TEXT
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS courses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        course_id TEXT,
+        resource_url TEXT,
+        poster_username TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # New table for subscriptions
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT,
+        course_id TEXT,
+        last_viewed DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(username, course_id)
+    )
+    """)
+
+    conn.commit()
+
+
+# Versioned schema migrations, applied in order at startup. PRAGMA
+# user_version records how many have been applied to a database file.
+
+# 1: covering indexes for the per-course hot paths. (course_id, id, ...)
+# serves GET_RESOURCES and the dashboard in upload order without touching
+# the table; (course_id, timestamp, ...) serves the new-resources range scan.
+def add_course_indexes(conn):
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_courses_course_id
+    ON courses(course_id, id, resource_url)
+    """)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_courses_course_time
+    ON courses(course_id, timestamp, resource_url)
+    """)
+
+# 2: one row per course, kept up to date by a trigger, so listing courses
+# or checking that one exists does not scan every resource row
+def add_course_catalog(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS course_catalog (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        course_id TEXT UNIQUE NOT NULL,
+        resource_count INTEGER NOT NULL DEFAULT 0,
+        last_posted DATETIME
+    )
+    """)
+    conn.execute("""
+    INSERT OR IGNORE INTO course_catalog (course_id, resource_count, last_posted)
+    SELECT course_id, COUNT(*), MAX(timestamp) FROM courses
+    GROUP BY course_id ORDER BY MIN(id)
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS courses_update_catalog AFTER INSERT ON courses
+    BEGIN
+        INSERT INTO course_catalog (course_id, resource_count, last_posted)
+        VALUES (NEW.course_id, 1, NEW.timestamp)
+        ON CONFLICT(course_id) DO UPDATE
+        SET resource_count = resource_count + 1, last_posted = NEW.timestamp;
+    END
+    """)
+
+# 3: "new resources" are read from the per-course event logs (eventlog.py)
+# from each subscription's committed log offset. Existing rows get NULL and
+# are converted from last_viewed at startup, once the logs exist. The
+# timestamp index only served the old range scan.
+def add_subscription_offsets(conn):
+    conn.execute("ALTER TABLE subscriptions ADD COLUMN last_offset INTEGER")
+    conn.execute("DROP INDEX IF EXISTS idx_courses_course_time")
+
+MIGRATIONS = [
+    add_course_indexes,
+    add_course_catalog,
+    add_subscription_offsets,
+]
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+# Apply pending migrations, each in its own transaction. The version is
+# re-read under the write lock so concurrent servers do not apply one twice.
+def migrate(conn):
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        version = schema_version(conn)
+        if version >= len(MIGRATIONS):
+            conn.rollback()
+            return version
+        try:
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version={version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied schema migration {version + 1}: {MIGRATIONS[version].__name__}")
+
+
+# Query plans that fall back to scanning a whole table. Each plan row is
+# (id, parent, notused, detail); an indexed lookup reads "SEARCH ... USING".
+def full_scans(conn, sql, params=()):
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [row[3] for row in plan
+            if row[3].startswith("SCAN") and "USING" not in row[3]]
@@ -0,0 +1,250 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import deque
+
+# Append-only, memory-mapped log of uploads, one file per course. A record
+# is a 4-byte payload length, a 4-byte CRC32 and a JSON payload:
+#   {"id": courses.id, "resource_url": ..., "poster_username": ..., "timestamp": ...}
+# A record's offset is its byte position in the file, so offsets only grow
+# and reading "everything after offset N" is one sequential slice. Files
+# are preallocated and grown in steps; the head is found on open by
+# scanning up to the first record that is empty or torn.
+#
+# Several server processes may share the logs: appends take an flock on
+# the file, and each process picks up records the others appended by
+# scanning on from its own head before reading. Records are then in append
+# order, which can differ from id order by the writes in flight at once.
+#
+# The courses table stays the source of truth: recover() appends any rows
+# missing from the logs (e.g. after an OS crash lost unsynced pages), so
+# the logs are not fsynced on every append.
+
+RECORD_HEADER = struct.Struct("!II")
+INITIAL_SIZE = 64 * 1024
+MAX_GROWTH = 64 * 1024 * 1024
+# Ids of the latest records kept to find rows missing from a log; appends
+# from concurrent processes are never further than this out of id order
+RECENT_IDS = 4096
+# Compact JSON; one shared encoder rather than a new one per dumps() call
+ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+class CourseLog:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # O_CREAT without truncation: another process may have just created it
+        self.file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+        self.head = 0
+        self.recent_ids = deque(maxlen=RECENT_IDS)
+        with self._file_lock():
+            size = os.fstat(self.file.fileno()).st_size
+            if size < INITIAL_SIZE:
+                self.file.truncate(INITIAL_SIZE)
+                size = INITIAL_SIZE
+            self.mm = mmap.mmap(self.file.fileno(), size)
+            self._refresh()
+            # Clear whatever a torn write left past the head, so a later scan
+            # cannot mistake it for records
+            if self.mm[self.head:self.head + RECORD_HEADER.size].strip(b"\0"):
+                self.mm[self.head:] = bytes(len(self.mm) - self.head)
+
+    # Move the head past records appended since the last look, remapping if
+    # another process grew the file. Called with self.lock held.
+    def _refresh(self):
+        while True:
+            record = self._record_at(self.head, len(self.mm))
+            if record is None:
+                header = self.mm[self.head:self.head + RECORD_HEADER.size]
+                if len(header) == RECORD_HEADER.size and not header.strip(b"\0"):
+                    return
+                size = os.fstat(self.file.fileno()).st_size
+                if size <= len(self.mm):
+                    return
+                self.mm.close()
+                self.mm = mmap.mmap(self.file.fileno(), size)
+                continue
+            self.recent_ids.append(record[0]["id"])
+            self.head = record[1]
+
+    def _file_lock(self):
+        return FileLock(self.file)
+
+    # (record, next position), or None if there is no valid record at pos
+    def _record_at(self, pos, limit):
+        if pos + RECORD_HEADER.size > limit:
+            return None
+        length, crc = RECORD_HEADER.unpack_from(self.mm, pos)
+        end = pos + RECORD_HEADER.size + length
+        if length == 0 or end > limit:
+            return None
+        payload = self.mm[pos + RECORD_HEADER.size:end]
+        if zlib.crc32(payload) != crc:
+            return None
+        try:
+            return json.loads(payload), end
+        except ValueError:
+            return None
+
+    # Append a record; returns (its offset, the new head)
+    def append(self, record):
+        offsets, head = self.append_many([record])
+        return offsets[0], head
+
+    # Append records with one lock, refresh and copy; returns (their
+    # offsets, the new head)
+    def append_many(self, records):
+        chunks = []
+        for record in records:
+            payload = ENCODER.encode(record).encode()
+            chunks.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        data = b"".join(chunks)
+        with self.lock, self._file_lock():
+            self._refresh()
+            if self.head + len(data) > len(self.mm):
+                self._grow(self.head + len(data))
+            offsets = []
+            pos = self.head
+            for chunk in chunks:
+                offsets.append(pos)
+                pos += len(chunk)
+            self.mm[self.head:pos] = data
+            self.head = pos
+            self.recent_ids.extend(record["id"] for record in records)
+            return offsets, self.head
+
+    def _grow(self, needed):
+        size = len(self.mm)
+        while size < needed:
+            size += min(size, MAX_GROWTH)
+        # Never shrink a file another process has grown further
+        size = max(size, os.fstat(self.file.fileno()).st_size)
+        self.mm.close()
+        self.file.truncate(size)
+        self.mm = mmap.mmap(self.file.fileno(), size)
+
+    # Records from `offset` up to the head (at most `limit` of them), each
+    # with its own "offset" added, and the offset after the last one
+    # returned. Raises ValueError if `offset` is not a record boundary.
+    def read(self, offset, limit=None):
+        records = []
+        with self.lock:
+            self._refresh()
+            head = self.head
+            if not 0 <= offset <= head:
+                raise ValueError(f"offset {offset} is outside the log")
+            pos = offset
+            while pos < head and (limit is None or len(records) < limit):
+                record = self._record_at(pos, head)
+                if record is None:
+                    raise ValueError(f"offset {offset} is not a record boundary")
+                record[0]["offset"] = pos
+                records.append(record[0])
+                pos = record[1]
+        return records, pos
+
+    def current_head(self):
+        with self.lock:
+            self._refresh()
+            return self.head
+
+    def flush(self):
+        with self.lock:
+            self.mm.flush()
+
+    def close(self):
+        with self.lock:
+            self.mm.flush()
+            self.mm.close()
+            self.file.close()
+
+
+# The per-course logs under one directory, opened on first use
+class EventLog:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.logs = {}
+        self.lock = threading.Lock()
+
+    def _path(self, course_id):
+        # Course ids are user input; hex keeps them safe as file names
+        return os.path.join(self.directory, course_id.encode().hex() + ".log")
+
+    def _log(self, course_id, create=True):
+        log = self.logs.get(course_id)
+        if log is None:
+            with self.lock:
+                log = self.logs.get(course_id)
+                if log is None:
+                    path = self._path(course_id)
+                    if not create and not os.path.exists(path):
+                        return None
+                    log = self.logs[course_id] = CourseLog(path)
+        return log
+
+    def append(self, course_id, record):
+        return self._log(course_id).append(record)
+
+    def append_many(self, course_id, records):
+        return self._log(course_id).append_many(records)
+
+    def read(self, course_id, offset=0, limit=None):
+        log = self._log(course_id, create=False)
+        if log is None:
+            if offset != 0:
+                raise ValueError(f"offset {offset} is outside the log")
+            return [], 0
+        return log.read(offset, limit)
+
+    def head(self, course_id):
+        log = self._log(course_id, create=False)
+        return log.current_head() if log is not None else 0
+
+    # Append rows of the courses table missing from the logs, in id order.
+    # Only run while no other process is appending. Returns how many were
+    # appended.
+    def recover(self, conn):
+        appended = 0
+        for (course_id,) in conn.execute("SELECT course_id FROM course_catalog").fetchall():
+            log = self._log(course_id)
+            present = set(log.recent_ids)
+            # Older records are all present if these are
+            since = min(present) if len(present) == RECENT_IDS else 0
+            rows = conn.execute("""
+                SELECT id, resource_url, poster_username, timestamp FROM courses
+                WHERE course_id = ? AND id > ? ORDER BY id
+            """, (course_id, since)).fetchall()
+            for row_id, resource_url, poster_username, timestamp in rows:
+                if row_id not in present:
+                    log.append(make_record(row_id, resource_url, poster_username, timestamp))
+                    appended += 1
+        return appended
+
+    def close(self):
+        with self.lock:
+            logs, self.logs = self.logs, {}
+        for log in logs.values():
+            log.close()
+
+
+# Exclusive flock on an open file, for appends shared between processes
+class FileLock:
+    def __init__(self, file):
+        self.file = file
+
+    def __enter__(self):
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+
+def make_record(row_id, resource_url, poster_username, timestamp):
+    return {"id": row_id, "resource_url": resource_url,
+            "poster_username": poster_username, "timestamp": timestamp}
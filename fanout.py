@@ -0,0 +1,161 @@
+import json
+import threading
+from collections import deque
+
+import broker
+
+# What to do when a connected client cannot keep up with its notifications:
+#   drop       - discard the newest notification
+#   coalesce   - merge queued notifications per course into one
+#   disconnect - close the client connection
+SLOW_CONSUMER_POLICIES = ("drop", "coalesce", "disconnect")
+
+
+# Bounded send queue for one long-lived client connection
+class PushSubscriber:
+    def __init__(self, username, maxsize=100, policy="coalesce",
+                 wakeup=None, on_disconnect=None):
+        self.username = username
+        self.maxsize = maxsize
+        self.policy = policy
+        self.wakeup = wakeup
+        self.on_disconnect = on_disconnect
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.coalesced = 0
+
+    def offer(self, notification):
+        disconnect = False
+        with self.cond:
+            if self.closed:
+                return
+            if len(self.queue) < self.maxsize:
+                self.queue.append(notification)
+            elif self.policy == "coalesce":
+                self._coalesce(notification)
+            elif self.policy == "disconnect":
+                self.closed = True
+                disconnect = True
+            else:
+                self.dropped += 1
+            self.cond.notify()
+        if disconnect:
+            if self.on_disconnect:
+                self.on_disconnect()
+        elif self.wakeup:
+            self.wakeup()
+
+    # Fold the queue down to one entry per course; if there are still more
+    # courses than slots, the oldest entry is dropped
+    def _coalesce(self, notification):
+        merged = {}
+        for item in list(self.queue) + [notification]:
+            entry = merged.get(item["course_id"])
+            if entry is None:
+                merged[item["course_id"]] = dict(item, resource_urls=list(item["resource_urls"]))
+            else:
+                entry["resource_urls"].extend(item["resource_urls"])
+                entry["poster_username"] = item["poster_username"]
+                self.coalesced += 1
+        self.queue = deque(merged.values())
+        while len(self.queue) > self.maxsize:
+            self.queue.popleft()
+            self.dropped += 1
+
+    # Take everything queued so far without blocking
+    def drain(self):
+        with self.cond:
+            items = list(self.queue)
+            self.queue.clear()
+            return items
+
+    # Block until something is queued or the subscriber is closed
+    def wait(self, timeout=None):
+        with self.cond:
+            if not self.queue and not self.closed:
+                self.cond.wait(timeout)
+            return bool(self.queue)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.wakeup:
+            self.wakeup()
+
+
+# Routes course notifications to the connected users subscribed to the course
+class FanoutHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listeners = {}      # username -> set of PushSubscriber
+        self.course_users = {}   # course_id -> set of username
+
+    def add_listener(self, subscriber, course_ids):
+        with self.lock:
+            self.listeners.setdefault(subscriber.username, set()).add(subscriber)
+            for course_id in course_ids:
+                self.course_users.setdefault(course_id, set()).add(subscriber.username)
+
+    def remove_listener(self, subscriber):
+        with self.lock:
+            subscribers = self.listeners.get(subscriber.username)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.listeners[subscriber.username]
+                for users in self.course_users.values():
+                    users.discard(subscriber.username)
+        subscriber.close()
+
+    # Called after a SUBSCRIBE so a user who is already listening starts
+    # receiving that course without reconnecting
+    def add_course(self, username, course_id):
+        with self.lock:
+            if username in self.listeners:
+                self.course_users.setdefault(course_id, set()).add(username)
+
+    def deliver(self, course_id, notification):
+        with self.lock:
+            targets = [subscriber
+                       for username in self.course_users.get(course_id, ())
+                       for subscriber in self.listeners.get(username, ())]
+        for subscriber in targets:
+            subscriber.offer(notification)
+        return len(targets)
+
+    def listener_count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.listeners.values())
+
+
+# Turn a message published on course:{course_id} into a push notification.
+# A batch upload publishes one message with all of its "resource_urls".
+def parse_notification(channel, data):
+    if isinstance(channel, bytes):
+        channel = channel.decode()
+    if isinstance(data, bytes):
+        data = data.decode()
+    message = json.loads(data)
+    course_id = message.get("course_id") or channel.split(":", 1)[1]
+    return {
+        "course_id": course_id,
+        "resource_urls": message.get("resource_urls") or [message["resource_url"]],
+        "poster_username": message.get("poster_username"),
+    }
+
+
+# Single PSUBSCRIBE course:* listener feeding the hub; meant to run on a
+# daemon thread
+def run_listener(message_broker, hub, pattern="course:*"):
+    def handle(channel, data):
+        try:
+            notification = parse_notification(channel, data)
+        except (ValueError, KeyError, IndexError):
+            return
+        hub.deliver(notification["course_id"], notification)
+
+    broker.consume(message_broker, pattern, handle, "Notification listener")
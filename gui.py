@@ -1,10 +1,209 @@
 import tkinter as tk
 from tkinter import messagebox, PhotoImage, ttk
+import tkinter.font as tkfont
 import client
+import protocol
 import time
+import json
+import queue
+from concurrent.futures import ThreadPoolExecutor
 
 # Global variable to store current user info
-current_user = {"username": "", "role": ""}
+# "session" is the token LOGIN returned; commands acting as the user send it
+current_user = {"username": "", "role": "", "session": ""}
+
+# Resources fetched per request when scrolling through a course
+RESOURCE_PAGE_SIZE = 50
+
+# Live course notifications pushed by the server. The listener calls back on
+# a network thread, so notifications are queued and drained on the Tk thread.
+notification_listener = None
+pending_notifications = queue.Queue()
+
+
+# Runs client requests on worker threads so the window never waits on the
+# network. Finished requests are queued and their callbacks run on the Tk
+# thread from an after() poll that only runs while requests are out. A
+# request tied to a window is cancelled when that window is closed: it is
+# dropped if it has not started, and its result is thrown away if it has.
+class RequestExecutor:
+    def __init__(self, root, workers=4, poll_ms=25):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gui-request")
+        self.done = queue.Queue()
+        self.outstanding = 0
+        self.polling = False
+        self.by_owner = {}  # window -> futures still out for it
+
+    # Run fn(*args) in the background, then on_done(future) on the Tk thread
+    def submit(self, fn, args, on_done, owner=None):
+        future = self.pool.submit(fn, *args)
+        self.outstanding += 1
+        if owner is not None:
+            if owner not in self.by_owner:
+                self.by_owner[owner] = set()
+                owner.bind("<Destroy>", lambda event: self.cancel(owner)
+                           if event.widget is owner else None, add="+")
+            self.by_owner[owner].add(future)
+        future.add_done_callback(lambda f: self.done.put((f, on_done, owner)))
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_ms, self._poll)
+        return future
+
+    def cancel(self, owner):
+        for future in self.by_owner.pop(owner, ()):
+            future.cancel()
+
+    def _poll(self):
+        while True:
+            try:
+                future, on_done, owner = self.done.get_nowait()
+            except queue.Empty:
+                break
+            self.outstanding -= 1
+            if owner is not None:
+                futures = self.by_owner.get(owner)
+                if futures is None or not owner.winfo_exists():
+                    continue
+                futures.discard(future)
+            if future.cancelled():
+                continue
+            try:
+                on_done(future)
+            except Exception as e:
+                print(f"Error handling a response: {e}")
+        if self.outstanding:
+            self.root.after(self.poll_ms, self._poll)
+        else:
+            self.polling = False
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Images decoded once and kept, plus variants scaled to fit a box. Tk can
+# only scale a PhotoImage by whole factors (zoom/subsample), so a variant is
+# the largest such scaling that fits. Variants sized to the main window are
+# dropped when it is resized; fixed-size ones are kept.
+class AssetCache:
+    def __init__(self, root):
+        self.root = root
+        self.images = {}
+        self.fixed = {}
+        self.window_variants = {}
+        self.window_size = None
+        root.bind("<Configure>", self._on_configure, add="+")
+
+    def image(self, path):
+        image = self.images.get(path)
+        if image is None:
+            image = self.images[path] = tk.PhotoImage(file=path)
+        return image
+
+    # Decode `paths` once the window is up, so the first splash is instant
+    def preload(self, paths):
+        def load():
+            for path in paths:
+                try:
+                    self.image(path)
+                except tk.TclError as e:
+                    print(f"Error loading image {path}: {e}")
+        self.root.after_idle(load)
+
+    def fit(self, path, width, height):
+        key = (path, width, height)
+        variant = self.fixed.get(key)
+        if variant is None:
+            variant = self.fixed[key] = scale_to_fit(self.image(path), width, height)
+        return variant
+
+    # `path` scaled to fit the main window at its current size
+    def for_window(self, path):
+        size = (max(self.root.winfo_width(), 1), max(self.root.winfo_height(), 1))
+        variant = self.window_variants.get((path, size))
+        if variant is None:
+            variant = scale_to_fit(self.image(path), *size)
+            self.window_variants[(path, size)] = variant
+        return variant
+
+    def _on_configure(self, event):
+        # Children's Configure events reach this binding too
+        if event.widget is not self.root:
+            return
+        size = (event.width, event.height)
+        if size != self.window_size:
+            self.window_size = size
+            self.window_variants.clear()
+
+def scale_to_fit(image, width, height):
+    image_width, image_height = image.width(), image.height()
+    if image_width > width or image_height > height:
+        factor = max(-(-image_width // width), -(-image_height // height))
+        return image.subsample(factor)
+    factor = min(width // image_width, height // image_height)
+    return image.zoom(factor) if factor > 1 else image
+
+
+# A scrollable list of text rows that only draws the rows in view: one
+# canvas text item per visible line, refilled as the list scrolls. Showing
+# thousands of resources costs the same as showing a screenful.
+class VirtualList(tk.Frame):
+    def __init__(self, parent, rows=(), height=10, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.font = tkfont.nametofont("TkTextFont")
+        self.row_height = self.font.metrics("linespace") + 2
+        self.rows = []
+        self.first = 0
+        self.items = []
+        self.scrollbar = tk.Scrollbar(self, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas = tk.Canvas(self, height=height * self.row_height, background="white",
+                                highlightthickness=0)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.canvas.bind("<Configure>", lambda event: self.redraw())
+        self.canvas.bind("<MouseWheel>", lambda event: self.scroll(-3 if event.delta > 0 else 3))
+        self.canvas.bind("<Button-4>", lambda event: self.scroll(-3))
+        self.canvas.bind("<Button-5>", lambda event: self.scroll(3))
+        self.set_rows(rows)
+
+    def set_rows(self, rows):
+        self.rows = list(rows)
+        self.first = 0
+        self.redraw()
+
+    def visible_rows(self):
+        return max(1, self.canvas.winfo_height() // self.row_height)
+
+    def redraw(self):
+        visible = self.visible_rows()
+        self.first = max(0, min(self.first, len(self.rows) - visible))
+        while len(self.items) < visible:
+            self.items.append(self.canvas.create_text(
+                4, len(self.items) * self.row_height, anchor=tk.NW, font=self.font))
+        for slot, item in enumerate(self.items):
+            index = self.first + slot
+            text = self.rows[index] if slot < visible and index < len(self.rows) else ""
+            self.canvas.itemconfigure(item, text=text)
+        if self.rows:
+            self.scrollbar.set(self.first / len(self.rows),
+                               min(1.0, (self.first + visible) / len(self.rows)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll(self, rows):
+        self.first += rows
+        self.redraw()
+
+    # Scrollbar command: ("moveto", fraction) or ("scroll", n, "units"|"pages")
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self.first = int(float(args[1]) * len(self.rows))
+            self.redraw()
+        elif args[0] == "scroll":
+            step = self.visible_rows() if args[2] == "pages" else 1
+            self.scroll(int(args[1]) * step)
 
 
 class MarioAnimation:
@@ -13,12 +212,8 @@ class MarioAnimation:
         self.canvas = None
         self.jump_timer = None
         self.current_label = None
-        self.mario_image = tk.PhotoImage(file=image_path)
-        
-        # Scale image down
-        width, height = 30, 30 
-        self.mario_image = self.mario_image.subsample(self.mario_image.width() // width, 
-                                                      self.mario_image.height() // height)
+        # Scaled down once, from the shared asset cache
+        self.mario_image = assets.fit(image_path, 30, 30)
         
     def attach_to_label(self, label):
         # If already attached to this label, do nothing
@@ -96,8 +291,8 @@ def show_splash_image(image_path, duration=2000, callback=None):
     splash_panel.place(x=0, y=0, relwidth=1, relheight=1)  # Cover the entire root window
     
     try:
-        img = tk.PhotoImage(file=image_path)
-        # Calculate scaling factors to fit the root window
+        # Decoded and scaled to this window size once, then reused
+        img = assets.for_window(image_path)
         win_width = root.winfo_width()
         win_height = root.winfo_height()
         
@@ -128,6 +323,29 @@ root.title("Learning Management System")
 root.geometry("500x500")
 root.configure(bg="#FFB347") 
 
+gui_requests = RequestExecutor(root)
+assets = AssetCache(root)
+assets.preload(["welcome1.png", "no_entry2.png"])
+
+# client.call(command, *args) in the background, then on_done(status, fields)
+# on the Tk thread. `owner` is the window the reply is for; `busy` is a
+# button disabled and relabelled until the reply arrives.
+def call_async(on_done, command, *args, owner=None, busy=None):
+    if busy is not None:
+        label = busy.cget("text")
+        busy.config(state=tk.DISABLED, text="Please wait...")
+
+    def done(future):
+        if busy is not None and busy.winfo_exists():
+            busy.config(state=tk.NORMAL, text=label)
+        try:
+            status, fields = future.result()
+        except Exception as e:
+            status, fields = protocol.STATUS_ERROR, [f"Error: {str(e)}"]
+        on_done(status, fields)
+
+    return gui_requests.submit(client.call, (command,) + args, done, owner)
+
 # Create Mario animation controller
 mario = MarioAnimation(root, "mario.png")
 login_frame = tk.Frame(root)
@@ -182,21 +400,28 @@ def handle_login():
         show_splash_image("no_entry2.png", 2000)
         return
         
-    response = client.send_request(f"LOGIN {username} {password}")
-    
-    if "Login successful" in response:
-        current_user["username"] = username
-        current_user["role"] = response.split()[-1]
-        
-        if current_user["role"] == "student":
-            show_splash_image("welcome1.png", 2000, lambda: show_frame(student_frame))
+    def on_login(status, fields):
+        response = fields[0]
+        if status == protocol.STATUS_OK:
+            # "Login successful <role> <token>"; older servers send no token
+            parts = response.split()
+            current_user["username"] = username
+            current_user["role"] = parts[2]
+            current_user["session"] = parts[3] if len(parts) > 3 else username
+
+            if current_user["role"] == "student":
+                start_notifications(current_user["session"])
+                show_splash_image("welcome1.png", 2000, lambda: show_frame(student_frame))
+            else:
+                show_splash_image("welcome1.png", 2000, lambda: show_frame(instructor_frame))
         else:
-            show_splash_image("welcome1.png", 2000, lambda: show_frame(instructor_frame))
-    else:
-        messagebox.showerror("Login Failed", response)
-        show_splash_image("no_entry2.png", 2000)
+            messagebox.showerror("Login Failed", response)
+            show_splash_image("no_entry2.png", 2000)
 
-tk.Button(login_frame, text="Login", command=handle_login).pack(pady=10)
+    call_async(on_login, "LOGIN", username, password, busy=login_button)
+
+login_button = tk.Button(login_frame, text="Login", command=handle_login)
+login_button.pack(pady=10)
 tk.Button(login_frame, text="Sign Up", command=lambda: show_frame(signup_frame)).pack(pady=5)
 
 # SIGNUP SCREEN
@@ -216,28 +441,27 @@ signup_password = tk.Entry(signup_frame, show="*", width=30)
 signup_password.pack(pady=5)
 signup_password.bind("<FocusIn>", lambda event: mario.attach_to_label(signup_password_label))
 
-role_var = tk.StringVar(value="student")
-tk.Label(signup_frame, text="Select Role:").pack(pady=5)
-tk.Radiobutton(signup_frame, text="Student", variable=role_var, value="student").pack()
-tk.Radiobutton(signup_frame, text="Instructor", variable=role_var, value="instructor").pack()
+# Sign-up creates student accounts; instructors are added by an admin
+tk.Label(signup_frame, text="Signing up as a student").pack(pady=5)
 
 def handle_signup():
     username = signup_username.get()
     password = signup_password.get()
-    role = role_var.get()
     
     if not username or not password:
         messagebox.showerror("Error", "Please enter all fields!")
         show_splash_image("no_entry2.png", 2000)
         return
         
-    response = client.send_request(f"REGISTER {role} {username} {password}")
-    messagebox.showinfo("Registration", response)
-    
-    if "Successful" in response:
-        show_frame(login_frame)
+    def on_register(status, fields):
+        messagebox.showinfo("Registration", fields[0])
+        if status == protocol.STATUS_OK:
+            show_frame(login_frame)
+
+    call_async(on_register, "REGISTER", "student", username, password, busy=signup_button)
 
-tk.Button(signup_frame, text="Sign Up", command=handle_signup).pack(pady=10)
+signup_button = tk.Button(signup_frame, text="Sign Up", command=handle_signup)
+signup_button.pack(pady=10)
 tk.Button(signup_frame, text="Back to Login", command=lambda: show_frame(login_frame)).pack(pady=5)
 
 # STUDENT DASHBOARD
@@ -254,20 +478,22 @@ def view_courses():
     courses_window.title("All Courses")
     courses_window.geometry("300x250")
     
-    response = client.send_request("GET_COURSES")
-    
     text_area = tk.Text(courses_window, width=30, height=10)
     text_area.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
-    
-    if "No courses" in response or "Error" in response:
-        text_area.insert(tk.END, response)
-    else:
-        courses = response.split("|")
-        text_area.insert(tk.END, "Available Courses:\n\n")
-        for i, course in enumerate(courses, 1):
-            text_area.insert(tk.END, f"{i}. {course}\n")
-            
+    text_area.insert(tk.END, "Loading courses...")
     text_area.config(state=tk.DISABLED)  # read-only
+
+    def show_courses(status, courses):
+        text_area.config(state=tk.NORMAL)
+        text_area.delete(1.0, tk.END)
+        if status != protocol.STATUS_OK:
+            text_area.insert(tk.END, courses[0])
+        else:
+            text_area.insert(tk.END, "Available Courses:\n\n" + "".join(
+                f"{i}. {course}\n" for i, course in enumerate(courses, 1)))
+        text_area.config(state=tk.DISABLED)
+
+    call_async(show_courses, "GET_COURSES", owner=courses_window)
     mario.detach()
     tk.Button(courses_window, text="Close", command=courses_window.destroy).pack(pady=10)
 
@@ -282,26 +508,70 @@ def get_resources():
     course_id_entry = tk.Entry(resources_window, width=20)
     course_id_entry.pack(pady=5)
     
-    result_text = tk.Text(resources_window, width=30, height=10)
-    result_text.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
+    text_frame = tk.Frame(resources_window)
+    text_frame.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
+    scrollbar = tk.Scrollbar(text_frame)
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    result_text = tk.Text(text_frame, width=30, height=10)
+    result_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    scrollbar.config(command=result_text.yview)
     mario.detach()
     
+    # Resources are fetched a page at a time; the next page is requested
+    # when the user scrolls near the bottom of what is loaded so far. Each
+    # search bumps "search", so pages of an earlier search are ignored.
+    page = {"course_id": None, "next_cursor": None, "count": 0, "loading": False, "search": 0}
+
+    def load_next_page():
+        cursor_arg = (page["next_cursor"],) if page["next_cursor"] else ()
+        search = page["search"]
+        call_async(lambda status, fields: show_page(search, status, fields),
+                   "GET_RESOURCES_PAGE", page["course_id"], str(RESOURCE_PAGE_SIZE), *cursor_arg,
+                   owner=resources_window)
+
+    def show_page(search, status, fields):
+        if search != page["search"]:
+            return
+        page["loading"] = False
+        if page["count"] == 0:
+            result_text.delete(1.0, tk.END)
+        if status != protocol.STATUS_OK:
+            page["next_cursor"] = None
+            result_text.insert(tk.END, fields[0])
+            return
+        result = json.loads(fields[0])
+        page["next_cursor"] = result["next_cursor"]
+        if not result["resources"] and page["count"] == 0:
+            result_text.insert(tk.END, "Error: No resources found for this course!")
+            return
+        if page["count"] == 0:
+            result_text.insert(tk.END, f"Resources for Course {page['course_id']}:\n\n")
+        lines = []
+        for resource in result["resources"]:
+            page["count"] += 1
+            lines.append(f"{page['count']}. {resource}\n")
+        result_text.insert(tk.END, "".join(lines))
+
+    def on_scroll(first, last):
+        scrollbar.set(first, last)
+        if float(last) > 0.9 and page["next_cursor"] and not page["loading"]:
+            page["loading"] = True
+            # Not from inside the scroll callback, which runs mid-redraw
+            result_text.after_idle(load_next_page)
+
+    result_text.config(yscrollcommand=on_scroll)
+    
     def search_resources():
         course_id = course_id_entry.get()
         if not course_id:
             messagebox.showerror("Error", "Please enter a Course ID!")
             return
             
-        response = client.send_request(f"GET_RESOURCES {course_id}")
-        
         result_text.delete(1.0, tk.END)
-        if "Error" in response:
-            result_text.insert(tk.END, response)
-        else:
-            resources = response.split("|")
-            result_text.insert(tk.END, f"Resources for Course {course_id}:\n\n")
-            for i, resource in enumerate(resources, 1):
-                result_text.insert(tk.END, f"{i}. {resource}\n")
+        result_text.insert(tk.END, "Loading...")
+        page.update(course_id=course_id, next_cursor=None, count=0, loading=True,
+                    search=page["search"] + 1)
+        load_next_page()
     
     tk.Button(resources_window, text="Search", command=search_resources).pack(pady=5)
     tk.Button(resources_window, text="Close", command=resources_window.destroy).pack(pady=5)
@@ -323,21 +593,30 @@ def subscribe_to_course():
             messagebox.showerror("Error", "Please enter a Course ID!")
             return
             
-        response = client.send_request(f"SUBSCRIBE {current_user['username']} {course_id}")
-        messagebox.showinfo("Subscription", response)
-        
-        if "Successfully" in response:
-            subscription_window.destroy()
-    
-    tk.Button(subscription_window, text="Subscribe", command=handle_subscription).pack(pady=10)
+        def on_subscribed(status, fields):
+            messagebox.showinfo("Subscription", fields[0])
+            if status == protocol.STATUS_OK:
+                subscription_window.destroy()
+
+        call_async(on_subscribed, "SUBSCRIBE", current_user["session"], course_id,
+                   owner=subscription_window, busy=subscribe_button)
+
+    subscribe_button = tk.Button(subscription_window, text="Subscribe", command=handle_subscription)
+    subscribe_button.pack(pady=10)
     tk.Button(subscription_window, text="Cancel", command=subscription_window.destroy).pack(pady=5)
 
 def view_subscriptions():
+    # Only the course list up front; each tab fetches its course when shown
+    call_async(show_subscriptions, "GET_SUBSCRIBED_COURSES", current_user["session"],
+               busy=view_subscriptions_button)
 
-    response = client.send_request(f"GET_SUBSCRIBED_COURSES {current_user['username']}")
-    if "No subscribed" in response:
+def show_subscriptions(status, courses):
+    if status == protocol.STATUS_EMPTY:
         messagebox.showinfo("Subscriptions", "You haven't subscribed to any courses yet.")
         return
+    if status != protocol.STATUS_OK:
+        messagebox.showerror("Subscriptions", courses[0])
+        return
     subscription_view = tk.Toplevel(root)
     subscription_view.title("Your Subscriptions")
     subscription_view.geometry("500x400")
@@ -346,61 +625,107 @@ def view_subscriptions():
     notebook = ttk.Notebook(subscription_view)
     notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
     
-    courses = response.split("|")
-    
-    # Create a tab for each course
+    # Tabs start as a placeholder and are filled in the first time they are
+    # selected. Replies are kept per course, so reselecting a tab does not
+    # fetch again (and new resources are only marked seen once viewed).
+    tabs = {}
+    results = {}
     for course_id in courses:
-        # Create a frame for this course
         course_frame = tk.Frame(notebook)
         notebook.add(course_frame, text=f"Course {course_id}")
-        
-        # Create sections for new and all resources
-        tk.Label(course_frame, text=f"Resources for Course {course_id}", 
-                font=("Arial", 12, "bold")).pack(pady=10)
-        
-        # New resources section
-        tk.Label(course_frame, text="Resources Uploaded While You Were Gone:", 
-                font=("Arial", 10, "bold")).pack(pady=5)
-        
-        new_resources_text = tk.Text(course_frame, width=40, height=5)
-        new_resources_text.pack(pady=5, padx=10, fill=tk.X)
-        
-        # Get new resources
-        new_res_response = client.send_request(f"GET_NEW_RESOURCES {current_user['username']} {course_id}")
-        
-        if "No new resources" in new_res_response:
-            new_resources_text.insert(tk.END, "No new resources since your last visit.")
-        else:
-            resources = new_res_response.split("|")
-            for i, resource in enumerate(resources, 1):
-                new_resources_text.insert(tk.END, f"{i}. {resource}\n")
-        
-        new_resources_text.config(state=tk.DISABLED)
-        
-        # All resources section
-        tk.Label(course_frame, text="All Course Resources:", 
-                font=("Arial", 10, "bold")).pack(pady=5)
-        
-        all_resources_text = tk.Text(course_frame, width=40, height=10)
-        all_resources_text.pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
-        
-        # Get all resources
-        all_res_response = client.send_request(f"GET_RESOURCES {course_id}")
-        
-        if "Error" in all_res_response:
-            all_resources_text.insert(tk.END, all_res_response)
-        else:
-            resources = all_res_response.split("|")
-            for i, resource in enumerate(resources, 1):
-                all_resources_text.insert(tk.END, f"{i}. {resource}\n")
-        
-        all_resources_text.config(state=tk.DISABLED)
+        tabs[str(course_frame)] = course_id
+
+    def load_tab(event=None):
+        selected = str(notebook.select())
+        course_id = tabs.get(selected)
+        if course_id is None or course_id in results:
+            return
+        course_frame = notebook.nametowidget(selected)
+        results[course_id] = {}
+        loading = tk.Label(course_frame, text="Loading resources...")
+        loading.pack(pady=20)
+
+        def on_reply(key, status, fields):
+            results[course_id][key] = (status, fields)
+            if len(results[course_id]) == 2:
+                loading.destroy()
+                render_course(course_frame, course_id, results[course_id])
+
+        call_async(lambda status, fields: on_reply("new", status, fields),
+                   "GET_NEW_RESOURCES", current_user["session"], course_id,
+                   owner=subscription_view)
+        call_async(lambda status, fields: on_reply("all", status, fields),
+                   "GET_RESOURCES", course_id, owner=subscription_view)
+
+    notebook.bind("<<NotebookTabChanged>>", load_tab)
+    load_tab()
+
+def render_course(course_frame, course_id, replies):
+    # Create sections for new and all resources
+    tk.Label(course_frame, text=f"Resources for Course {course_id}", 
+            font=("Arial", 12, "bold")).pack(pady=10)
+    
+    # New resources section
+    tk.Label(course_frame, text="Resources Uploaded While You Were Gone:", 
+            font=("Arial", 10, "bold")).pack(pady=5)
+    
+    status, new_resources = replies["new"]
+    if status == protocol.STATUS_EMPTY:
+        new_resources = ["No new resources since your last visit."]
+    elif status == protocol.STATUS_OK:
+        new_resources = [f"{i}. {resource}" for i, resource in enumerate(new_resources, 1)]
+    VirtualList(course_frame, new_resources, height=5).pack(pady=5, padx=10, fill=tk.X)
+    
+    # All resources section
+    tk.Label(course_frame, text="All Course Resources:", 
+            font=("Arial", 10, "bold")).pack(pady=5)
+    
+    status, resources = replies["all"]
+    if status == protocol.STATUS_OK:
+        resources = [f"{i}. {resource}" for i, resource in enumerate(resources, 1)]
+    VirtualList(course_frame, resources, height=10).pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
 
 tk.Button(student_frame, text="View All Courses", command=view_courses).pack(pady=10)
 tk.Button(student_frame, text="Get Course Resources", command=get_resources).pack(pady=10)
 tk.Button(student_frame, text="Subscribe to Course", command=subscribe_to_course).pack(pady=10)
-tk.Button(student_frame, text="View My Subscriptions", command=view_subscriptions).pack(pady=10)
-tk.Button(student_frame, text="Logout", command=lambda: show_frame(login_frame)).pack(pady=10)
+view_subscriptions_button = tk.Button(student_frame, text="View My Subscriptions",
+                                      command=view_subscriptions)
+view_subscriptions_button.pack(pady=10)
+tk.Button(student_frame, text="Logout", command=lambda: logout()).pack(pady=10)
+
+tk.Label(student_frame, text="Live Notifications:", font=("Arial", 10, "bold")).pack(pady=(10, 0))
+notifications_list = tk.Listbox(student_frame, height=5)
+notifications_list.pack(fill=tk.X, padx=10, pady=5)
+
+def start_notifications(session):
+    global notification_listener
+    stop_notifications()
+    notifications_list.delete(0, tk.END)
+    notification_listener = client.NotificationListener(session, pending_notifications.put).start()
+
+def stop_notifications():
+    global notification_listener
+    if notification_listener is not None:
+        notification_listener.stop()
+        notification_listener = None
+
+def show_notifications():
+    while True:
+        try:
+            notification = pending_notifications.get_nowait()
+        except queue.Empty:
+            break
+        for resource_url in notification["resource_urls"]:
+            notifications_list.insert(0, f"Course {notification['course_id']}: {resource_url}")
+    root.after(500, show_notifications)
+
+def logout():
+    stop_notifications()
+    if current_user["session"] != current_user["username"]:
+        call_async(lambda status, fields: None, "LOGOUT", current_user["session"])
+    current_user["session"] = ""
+    show_frame(login_frame)
+
 
 # INSTRUCTOR DASHBOARD
 def instructor_welcome_label():
@@ -437,21 +762,27 @@ def upload_resource():
             show_splash_image("no_entry2.png", 2000)
             return
             
-        response = client.send_request(f"UPLOAD_RESOURCE {course_id} {resource_url} {current_user['username']}")
-        messagebox.showinfo("Upload Resource", response)
-        
-        if "Added" in response:
-            upload_window.destroy()
-        else:
-            show_splash_image("no_entry2.png", 2000)
-    
-    tk.Button(upload_window, text="Upload", command=handle_upload).pack(pady=10)
+        def on_uploaded(status, fields):
+            messagebox.showinfo("Upload Resource", fields[0])
+            if status == protocol.STATUS_OK:
+                upload_window.destroy()
+            else:
+                show_splash_image("no_entry2.png", 2000)
+
+        call_async(on_uploaded, "UPLOAD_RESOURCE", course_id, resource_url,
+                   current_user["session"], owner=upload_window, busy=upload_button)
+
+    upload_button = tk.Button(upload_window, text="Upload", command=handle_upload)
+    upload_button.pack(pady=10)
     tk.Button(upload_window, text="Cancel", command=upload_window.destroy).pack(pady=5)
 
 tk.Button(instructor_frame, text="Upload Course Resources", command=upload_resource).pack(pady=10)
 tk.Button(instructor_frame, text="View All Courses", command=view_courses).pack(pady=10)
-tk.Button(instructor_frame, text="Logout", command=lambda: show_frame(login_frame)).pack(pady=10)
+tk.Button(instructor_frame, text="Logout", command=logout).pack(pady=10)
 
 show_frame(login_frame)
+show_notifications()
 
-root.mainloop()
\ No newline at end of file
+root.mainloop()
+stop_notifications()
+gui_requests.shutdown()
\ No newline at end of file
@@ -0,0 +1,160 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import client
+import protocol
+
+# Bulk import of course resources, e.g. to set up a term. Streams a CSV file
+# (course_id,resource_url[,poster] rows, with an optional header row) or a
+# JSONL file ({"course_id": ..., "resource_url": ..., "poster": ...} per
+# line) to the server as UPLOAD_RESOURCES_BATCH requests. Each batch is one
+# executemany in one transaction on the server, with one notification per
+# course, and several batches are pipelined on the connection at a time.
+#
+#   python importer.py term.csv --poster <session token or username>
+#   python importer.py term.jsonl --batch-size 5000 --in-flight 4
+
+# Attempts at a batch the server keeps answering busy
+MAX_ATTEMPTS = 5
+
+
+# A row or line that cannot be imported
+class BadInput(Exception):
+    pass
+
+
+def read_csv(f):
+    for line_number, row in enumerate(csv.reader(f), 1):
+        if line_number == 1 and [value.strip().lower() for value in row[:2]] == ["course_id", "resource_url"]:
+            continue
+        yield line_number, row
+
+def read_jsonl(f):
+    for line_number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise BadInput(f"line {line_number}: {e}")
+        yield line_number, [record.get("course_id"), record.get("resource_url"),
+                            record.get("poster") or record.get("poster_username")]
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl}
+
+# (course_id, resource_url, poster) for each row; rows without a poster
+# are posted by `default_poster`
+def read_rows(f, file_format, default_poster):
+    for line_number, row in READERS[file_format](f):
+        row = [str(value).strip() if value is not None else "" for value in row]
+        if not any(row):
+            continue
+        course_id, resource_url = (row + ["", ""])[:2]
+        poster = (row[2] if len(row) > 2 else "") or default_poster
+        if not course_id or not resource_url:
+            raise BadInput(f"line {line_number}: course_id and resource_url are required")
+        if not poster:
+            raise BadInput(f"line {line_number}: no poster (pass --poster)")
+        yield course_id, resource_url, poster
+
+# (poster, [course_id, resource_url, ...]) for runs of rows by the same
+# poster, at most `batch_size` rows each
+def batches(rows, batch_size):
+    poster, fields = None, []
+    for course_id, resource_url, row_poster in rows:
+        if fields and (row_poster != poster or len(fields) >= 2 * batch_size):
+            yield poster, fields
+            fields = []
+        poster = row_poster
+        fields += [course_id, resource_url]
+    if fields:
+        yield poster, fields
+
+# Send batches pipelined, retrying those the server was too busy for.
+# Returns (rows added, rows failed).
+def send(pending):
+    added = failed = 0
+    for attempt in range(MAX_ATTEMPTS):
+        calls = [("UPLOAD_RESOURCES_BATCH", (poster,) + tuple(fields)) for poster, fields in pending]
+        retry, wait = [], 0
+        for (poster, fields), (status, reply) in zip(pending, client.call_many(calls)):
+            if status == protocol.STATUS_OK:
+                added += len(fields) // 2
+            elif status == protocol.STATUS_BUSY and attempt + 1 < MAX_ATTEMPTS:
+                retry.append((poster, fields))
+                wait = max(wait, protocol.busy_retry_after(reply[0]) or 0.1)
+            else:
+                failed += len(fields) // 2
+                print(f"Batch of {len(fields) // 2} rows by {poster} failed: {reply[0]}",
+                      file=sys.stderr)
+        if not retry:
+            break
+        time.sleep(wait)
+        pending = retry
+    return added, failed
+
+def run_import(f, file_format, poster, batch_size, in_flight):
+    added = failed = 0
+    pending = []
+    started = time.perf_counter()
+    for batch in batches(read_rows(f, file_format, poster), batch_size):
+        pending.append(batch)
+        if len(pending) == in_flight:
+            counts = send(pending)
+            added, failed = added + counts[0], failed + counts[1]
+            pending = []
+    if pending:
+        counts = send(pending)
+        added, failed = added + counts[0], failed + counts[1]
+    return added, failed, time.perf_counter() - started
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-import course resources from CSV or JSONL")
+    parser.add_argument("path", help="file to import ('-' for standard input)")
+    parser.add_argument("--format", choices=sorted(READERS),
+                        help="file format (default: from the file extension)")
+    parser.add_argument("--poster",
+                        help="session token or username posting rows that name no poster")
+    parser.add_argument("--host", default=client.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=client.SERVER_PORT)
+    parser.add_argument("--batch-size", type=int, default=5000,
+                        help="rows per UPLOAD_RESOURCES_BATCH request "
+                             f"(at most {protocol.MAX_BATCH_ROWS})")
+    parser.add_argument("--in-flight", type=int, default=4,
+                        help="batch requests pipelined at a time")
+    args = parser.parse_args(argv)
+    if not 1 <= args.batch_size <= protocol.MAX_BATCH_ROWS:
+        parser.error(f"--batch-size must be between 1 and {protocol.MAX_BATCH_ROWS}, "
+                     "the most the server takes in one batch")
+    if args.in_flight < 1:
+        parser.error("--in-flight must be at least 1")
+    if args.format is None:
+        extension = os.path.splitext(args.path)[1].lstrip(".").lower()
+        args.format = {"ndjson": "jsonl", "json": "jsonl"}.get(extension, extension)
+        if args.format not in READERS:
+            parser.error("cannot tell the format from the file name; pass --format")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    client.SERVER_HOST, client.SERVER_PORT = args.host, args.port
+    f = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+    try:
+        added, failed, elapsed = run_import(f, args.format, args.poster, args.batch_size,
+                                            args.in_flight)
+    except BadInput as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    print(f"Imported {added} resources in {elapsed:.1f}s ({added / max(elapsed, 1e-9):.0f}/s)"
+          + (f", {failed} failed" if failed else ""))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
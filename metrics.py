@@ -0,0 +1,220 @@
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Process-local metrics: counters, gauges and fixed-bucket histograms,
+# readable as a dict (for the STATS command) or in the Prometheus text
+# exposition format. Recording is one lock and a few integer updates, so it
+# can sit on every request.
+
+# Latency bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge(Counter):
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    # Upper bound of the bucket holding the p-th percentile
+    def percentile(self, p):
+        with self.lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return 0.0
+        rank = total * p / 100
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+        }
+
+
+# A metric name with zero or one label; children are created on first use
+class Family:
+    def __init__(self, name, kind, help_text, factory, label=None):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.factory = factory
+        self.label = label
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, value):
+        child = self.children.get(value)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(value, self.factory())
+        return child
+
+    def unlabelled(self):
+        return self.labels(None)
+
+    def snapshot(self):
+        if self.label is None:
+            return self.unlabelled().snapshot()
+        return {value: child.snapshot() for value, child in sorted(self.children.items())}
+
+
+class Registry:
+    def __init__(self, prefix="lms"):
+        self.prefix = prefix
+        self.families = {}
+        # Callables returning {name: (kind, help, value)} read at collection
+        # time, for numbers other modules already keep (cache hits, ...)
+        self.collectors = []
+
+    def _family(self, name, kind, help_text, factory, label):
+        family = Family(f"{self.prefix}_{name}", kind, help_text, factory, label)
+        self.families[name] = family
+        return family if label is not None else family.unlabelled()
+
+    def counter(self, name, help_text, label=None):
+        return self._family(name, "counter", help_text, Counter, label)
+
+    def gauge(self, name, help_text, label=None):
+        return self._family(name, "gauge", help_text, Gauge, label)
+
+    def histogram(self, name, help_text, label=None, buckets=LATENCY_BUCKETS):
+        return self._family(name, "histogram", help_text, lambda: Histogram(buckets), label)
+
+    def add_collector(self, collect):
+        self.collectors.append(collect)
+
+    def _collected(self):
+        collected = {}
+        for collect in self.collectors:
+            try:
+                collected.update(collect())
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+        return collected
+
+    def snapshot(self):
+        stats = {name: family.snapshot() for name, family in self.families.items()}
+        for name, (kind, help_text, value) in self._collected().items():
+            stats[name] = value
+        return stats
+
+    def render_prometheus(self):
+        lines = []
+        for family in self.families.values():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for value, child in sorted(family.children.items(), key=lambda item: str(item[0])):
+                labels = {} if family.label is None else {family.label: value}
+                if family.kind == "histogram":
+                    lines.extend(render_histogram(family.name, labels, child))
+                else:
+                    lines.append(f"{family.name}{format_labels(labels)} {child.value}")
+        for name, (kind, help_text, value) in self._collected().items():
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            lines.append(f"{full_name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in labels.items()) + "}"
+
+def render_histogram(name, labels, histogram):
+    with histogram.lock:
+        counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+    lines = []
+    cumulative = 0
+    for bound, bucket_count in zip(histogram.buckets, counts):
+        cumulative += bucket_count
+        lines.append(f"{name}_bucket{format_labels(dict(labels, le=bound))} {cumulative}")
+    lines.append(f"{name}_bucket{format_labels(dict(labels, le='+Inf'))} {count}")
+    lines.append(f"{name}_sum{format_labels(labels)} {total}")
+    lines.append(f"{name}_count{format_labels(labels)} {count}")
+    return lines
+
+
+# Rewrite `path` with the current metrics every `interval` seconds, for a
+# node_exporter textfile collector or a sidecar to pick up. Meant to run on
+# a daemon thread.
+def dump_periodically(registry, path, interval=10):
+    while True:
+        try:
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "w") as f:
+                f.write(registry.render_prometheus())
+            # Readers never see a half-written file
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error writing metrics to {path}: {e}")
+        time.sleep(interval)
+
+# Serve GET /metrics over HTTP on a daemon thread
+def serve_http(registry, host, port):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    return httpd
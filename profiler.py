@@ -0,0 +1,78 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Sampling profiler for command handlers. While a session runs, a sampler
+# thread wakes every `interval` seconds, grabs the stack of every thread
+# currently inside a command handler (sys._current_frames) and counts it.
+# The result is written in the collapsed-stack format read by flamegraph.pl
+# and speedscope: one "root;...;leaf count" line per distinct stack, rooted
+# at the command name. When no session is running, handlers only check the
+# `running` flag.
+class Profiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.running = False
+        self.active = {}    # thread id -> command name, only while running
+        self.lock = threading.Lock()
+
+    # Handlers call these around a command while `running` is set
+    def enter(self, command):
+        self.active[threading.get_ident()] = command
+
+    def leave(self):
+        self.active.pop(threading.get_ident(), None)
+
+    # Profile for `duration` seconds, only `command` if given, then write the
+    # collapsed stacks to `path`. Returns False if a session is already running.
+    def start(self, duration, path, command=None):
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+        threading.Thread(target=self._run, args=(duration, path, command),
+                         name="profiler", daemon=True).start()
+        return True
+
+    def _run(self, duration, path, command):
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + duration
+        try:
+            while time.monotonic() < deadline:
+                frames = sys._current_frames()
+                for thread_id, name in list(self.active.items()):
+                    if command is not None and name != command:
+                        continue
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse(name, frame)] += 1
+                samples += 1
+                time.sleep(self.interval)
+        finally:
+            self.running = False
+            self.active.clear()
+        try:
+            write_collapsed(path, stacks)
+            print(f"Profile written to {path}: {samples} samples, "
+                  f"{sum(stacks.values())} handler stacks")
+        except OSError as e:
+            print(f"Error writing profile to {path}: {e}")
+
+
+# "command;outermost;...;innermost" for one thread's stack
+def collapse(command, frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.append(command)
+    return ";".join(reversed(names))
+
+def write_collapsed(path, stacks):
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
@@ -0,0 +1,516 @@
+import asyncio
+import socket
+import struct
+import threading
+import zlib
+from collections import Counter, deque
+
+# Framed wire format shared by client.py and server.py:
+#   1 byte magic | 4 bytes request id | 4 bytes payload length | payload
+# The magic byte is never the first byte of a plain text command, so the
+# server can tell framed connections from legacy one-shot ones.
+FRAME_MAGIC = 0xF0
+FRAME_HEADER = struct.Struct("!BII")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+# Request id 0 is reserved for messages the server sends unprompted
+PUSH_REQUEST_ID = 0
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(request_id, payload):
+    if isinstance(payload, str):
+        payload = payload.encode()
+    return FRAME_HEADER.pack(FRAME_MAGIC, request_id, len(payload)) + payload
+
+
+def parse_header(header):
+    magic, request_id, length = FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC:
+        raise ProtocolError(f"bad frame magic {magic:#x}")
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"frame too large ({length} bytes)")
+    return request_id, length
+
+
+# Read exactly n bytes from a blocking socket, None if the peer closed first
+def recv_exactly(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+
+# Read one frame from a blocking socket, None on a clean EOF
+def read_frame(sock):
+    header = recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    request_id, length = parse_header(header)
+    payload = recv_exactly(sock, length) if length else b""
+    if payload is None:
+        raise ProtocolError("connection closed mid-frame")
+    return request_id, payload
+
+
+# Read one frame from an asyncio StreamReader, None on a clean EOF.
+# `prefix` holds header bytes the caller already consumed.
+async def read_frame_async(reader, prefix=b""):
+    try:
+        header = prefix + await reader.readexactly(FRAME_HEADER.size - len(prefix))
+    except asyncio.IncompleteReadError as e:
+        if not e.partial and not prefix:
+            return None
+        raise ProtocolError("connection closed mid-frame")
+    request_id, length = parse_header(header)
+    try:
+        payload = await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("connection closed mid-frame")
+    return request_id, payload
+
+
+# Sends one connection's frames from a thread of its own, so a peer that
+# stops reading blocks that thread only, never the threads producing the
+# replies. Frames wait in a buffer of at most `max_buffered` payload bytes;
+# a frame that would take it further drops the connection (shutting the
+# socket down, which also ends the reader) rather than holding anyone up.
+# A streamed reply is a generator of chunks pulled on the writer thread as
+# the socket takes them, taking turns with the other replies, and ended
+# by an empty frame.
+#
+# `compress(compressor, payload)` turns a payload into what is sent;
+# `on_sent(nbytes)` is called after each frame. Replies are counted from
+# expect() until the frame that ends them is written, so the owner can
+# tell how far behind the client is.
+MAX_BUFFERED = 8 * 1024 * 1024
+
+
+class FrameWriter:
+    def __init__(self, sock, max_buffered=MAX_BUFFERED, compress=None, on_sent=None):
+        self.sock = sock
+        self.max_buffered = max_buffered
+        self.compress = compress or (
+            lambda compressor, payload: compressor.compress(payload) if compressor else payload)
+        self.on_sent = on_sent
+        self.queue = deque()    # (request_id, payload or chunk generator, compressor, ends_reply)
+        self.streams = deque()  # streamed replies being pulled; writer thread only
+        self.buffered = 0
+        self.unsent = 0
+        self.cond = threading.Condition()
+        self.closing = False
+        self.failed = False
+        self.thread = threading.Thread(target=self._run, name="frame-writer", daemon=True)
+        self.thread.start()
+
+    # Count a reply that is on its way (its request was accepted)
+    def expect(self):
+        with self.cond:
+            self.unsent += 1
+
+    # Queue one frame; `ends_reply` marks the last frame of an expected
+    # reply. Returns False if the connection is gone, or was dropped
+    # because this frame did not fit.
+    def send(self, request_id, payload, compressor=None, ends_reply=False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self.cond:
+            if self.failed:
+                return False
+            overflow = self.buffered and self.buffered + len(payload) > self.max_buffered
+            if not overflow:
+                self.queue.append((request_id, payload, compressor, ends_reply))
+                self.buffered += len(payload)
+                self.cond.notify_all()
+                return True
+        self.fail()
+        return False
+
+    # Queue a streamed reply (an expected one)
+    def send_stream(self, request_id, chunks, compressor=None):
+        with self.cond:
+            if not self.failed:
+                self.queue.append((request_id, chunks, compressor, True))
+                self.cond.notify_all()
+                return True
+        chunks.close()
+        return False
+
+    # Block until the buffer is at most half full; False if the connection
+    # is gone. For producers with a thread of their own, e.g. push loops.
+    def wait_for_room(self, timeout=None):
+        with self.cond:
+            self.cond.wait_for(lambda: self.failed or self.buffered <= self.max_buffered // 2,
+                               timeout)
+            return not self.failed
+
+    # Drop the connection: queued frames are discarded and the socket is
+    # shut down
+    def fail(self):
+        with self.cond:
+            if self.failed:
+                return
+            self.failed = True
+            dropped = [item[1] for item in self.queue if not isinstance(item[1], bytes)]
+            self.queue.clear()
+            self.buffered = 0
+            self.cond.notify_all()
+        for chunks in dropped:
+            chunks.close()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # Send what is still owed (expected replies included) for up to
+    # `timeout` seconds, then stop; the caller closes the socket
+    def close(self, timeout=None):
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            self.fail()
+            self.thread.join()
+
+    def _run(self):
+        try:
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.failed or self.queue or self.streams or
+                                       (self.closing and not self.unsent))
+                    if self.failed or not (self.queue or self.streams):
+                        return
+                    item = self.queue.popleft() if self.queue else None
+                if item is not None:
+                    request_id, payload, compressor, ends_reply = item
+                    if isinstance(payload, bytes):
+                        self._write(request_id, self.compress(compressor, payload))
+                        self._sent(len(payload), ends_reply)
+                    else:
+                        self.streams.append((request_id, payload, compressor))
+                if self.streams:
+                    self._pull_stream()
+        except OSError:
+            self.fail()
+        except Exception as e:
+            print(f"Error sending frames: {e}")
+            self.fail()
+        finally:
+            for request_id, chunks, compressor in self.streams:
+                chunks.close()
+            self.streams.clear()
+
+    # Send the next chunk of the stream whose turn it is
+    def _pull_stream(self):
+        request_id, chunks, compressor = self.streams[0]
+        chunk = next(chunks, None)
+        if chunk is None:
+            self.streams.popleft()
+            chunks.close()
+            self._write(request_id, b"")
+            self._sent(0, True)
+            return
+        self._write(request_id, self.compress(compressor, chunk))
+        self.streams.rotate(-1)
+
+    def _write(self, request_id, payload):
+        frame = encode_frame(request_id, payload)
+        self.sock.sendall(frame)
+        if self.on_sent is not None:
+            self.on_sent(len(frame))
+
+    def _sent(self, nbytes, ends_reply):
+        with self.cond:
+            if self.failed:
+                return
+            self.buffered -= nbytes
+            if ends_reply:
+                self.unsent -= 1
+            self.cond.notify_all()
+
+
+# Binary payloads, negotiated per connection with a "HELLO <versions>" text
+# frame; the server answers "HELLO <version>" with the version it picked.
+# A server that does not know HELLO answers "Invalid request!" and the
+# client keeps using text payloads.
+#   request:  version | opcode | fields
+#   response: version | status | fields
+# where fields are each a 4-byte length followed by UTF-8 bytes. The version
+# byte is never printable, so text and binary frames can share a connection;
+# the server answers each request in the format it was sent in.
+BINARY_VERSION = 1
+SUPPORTED_VERSIONS = (BINARY_VERSION,)
+
+FIELD_LENGTH = struct.Struct("!I")
+BINARY_HEADER = struct.Struct("!BB")
+
+# Command opcodes. Never renumber one; add new commands at the end.
+OPCODES = {
+    "REGISTER": 0x01,
+    "LOGIN": 0x02,
+    "GET_COURSES": 0x03,
+    "GET_RESOURCES": 0x04,
+    "UPLOAD_RESOURCE": 0x05,
+    "SUBSCRIBE": 0x06,
+    "GET_SUBSCRIBED_COURSES": 0x07,
+    "GET_NEW_RESOURCES": 0x08,
+    "GET_DASHBOARD": 0x09,
+    "LISTEN": 0x0A,
+    "GET_RESOURCES_PAGE": 0x0B,
+    "GET_NEW_RESOURCES_PAGE": 0x0C,
+    "STREAM_RESOURCES": 0x0D,
+    "STREAM_NEW_RESOURCES": 0x0E,
+    "CACHE_STATS": 0x0F,
+    "STATS": 0x10,
+    "PROFILE": 0x11,
+    "LOGOUT": 0x12,
+    "REPLAY": 0x13,
+    "UPLOAD_RESOURCES_BATCH": 0x14,
+}
+COMMAND_NAMES = {opcode: name for name, opcode in OPCODES.items()}
+
+# Commands whose OK reply is a list of rows: one field per row in binary,
+# "|"-joined in text
+LIST_COMMANDS = {"GET_COURSES", "GET_RESOURCES", "GET_SUBSCRIBED_COURSES",
+                 "GET_NEW_RESOURCES", "STREAM_RESOURCES", "STREAM_NEW_RESOURCES"}
+
+# Commands answered with a run of chunk frames ended by an empty frame. A
+# refusal (no session, bad arguments, busy) is a single reply frame, and
+# is ended by an empty frame too.
+STREAM_COMMANDS = {"STREAM_RESOURCES", "STREAM_NEW_RESOURCES"}
+
+# Rows one UPLOAD_RESOURCES_BATCH may carry
+MAX_BATCH_ROWS = 10000
+
+# Response status codes
+STATUS_OK = 0
+STATUS_EMPTY = 1          # valid request, nothing to return
+STATUS_NOT_FOUND = 2
+STATUS_CONFLICT = 3
+STATUS_UNAUTHORIZED = 4
+STATUS_BAD_REQUEST = 5
+STATUS_ERROR = 6
+STATUS_BUSY = 7           # shed by admission control; retry after the given delay
+
+# Reply to a text request whose bytes are not UTF-8
+NOT_UTF8 = "Error: Request is not valid UTF-8"
+
+# The text protocol's fixed replies and the status each one stands for.
+# The server uses this to label text handler output in binary replies, and
+# the client to label replies from a server that only speaks text.
+TEXT_STATUSES = {
+    "No courses available": STATUS_EMPTY,
+    "No new resources": STATUS_EMPTY,
+    "No subscribed courses": STATUS_EMPTY,
+    "Error: No resources found for this course!": STATUS_NOT_FOUND,
+    "Error: Course does not exist!": STATUS_NOT_FOUND,
+    "Error: Username already exists!": STATUS_CONFLICT,
+    "Error: Invalid credentials": STATUS_UNAUTHORIZED,
+    "Error: Invalid or expired session": STATUS_UNAUTHORIZED,
+    "Error: Permission denied": STATUS_UNAUTHORIZED,
+    "Invalid request!": STATUS_BAD_REQUEST,
+    "Error: Missing arguments!": STATUS_BAD_REQUEST,
+    "Error: Invalid page request!": STATUS_BAD_REQUEST,
+    "Error: Invalid username": STATUS_BAD_REQUEST,
+    "Error: Invalid role": STATUS_BAD_REQUEST,
+    NOT_UTF8: STATUS_BAD_REQUEST,
+}
+
+# Reply to a request the server shed instead of queueing it
+BUSY_PREFIX = "Error: Server busy"
+
+def busy_text(retry_after):
+    return f"{BUSY_PREFIX}, retry after {max(1, round(retry_after * 1000))} ms"
+
+# Seconds a busy reply asks the client to wait, or None for other replies
+def busy_retry_after(text):
+    if not text.startswith(BUSY_PREFIX):
+        return None
+    try:
+        return int(text.rsplit(" ", 2)[1]) / 1000
+    except (IndexError, ValueError):
+        return None
+
+def text_status(text):
+    status = TEXT_STATUSES.get(text)
+    if status is not None:
+        return status
+    if text.startswith(BUSY_PREFIX):
+        return STATUS_BUSY
+    return STATUS_ERROR if text.startswith("Error") else STATUS_OK
+
+
+def is_binary(payload):
+    return len(payload) > 0 and payload[0] in SUPPORTED_VERSIONS
+
+def encode_fields(fields):
+    parts = []
+    for field in fields:
+        if isinstance(field, str):
+            field = field.encode()
+        parts.append(FIELD_LENGTH.pack(len(field)))
+        parts.append(field)
+    return b"".join(parts)
+
+def decode_fields(data, offset=0):
+    fields = []
+    while offset < len(data):
+        if offset + FIELD_LENGTH.size > len(data):
+            raise ProtocolError("truncated field length")
+        (length,) = FIELD_LENGTH.unpack_from(data, offset)
+        offset += FIELD_LENGTH.size
+        if offset + length > len(data):
+            raise ProtocolError("truncated field")
+        try:
+            fields.append(data[offset:offset + length].decode())
+        except UnicodeDecodeError:
+            raise ProtocolError("field is not valid UTF-8")
+        offset += length
+    return fields
+
+def encode_request(opcode, fields):
+    return BINARY_HEADER.pack(BINARY_VERSION, opcode) + encode_fields(fields)
+
+def encode_response(status, fields):
+    return BINARY_HEADER.pack(BINARY_VERSION, status) + encode_fields(fields)
+
+# Returns (opcode or status, fields)
+def decode_binary(payload):
+    if len(payload) < BINARY_HEADER.size:
+        raise ProtocolError("binary payload too short")
+    version, code = BINARY_HEADER.unpack_from(payload)
+    if version not in SUPPORTED_VERSIONS:
+        raise ProtocolError(f"unsupported binary version {version}")
+    return code, decode_fields(payload, BINARY_HEADER.size)
+
+decode_request = decode_binary
+decode_response = decode_binary
+
+# Pick the highest version both sides support from a HELLO request
+def negotiate_version(request):
+    parts = request.split()
+    offered = {int(v) for v in parts[1:] if v.isdigit()}
+    common = offered.intersection(SUPPORTED_VERSIONS)
+    return max(common) if common else None
+
+
+# Compressed payloads, negotiated per connection in the HELLO: the client
+# adds "zlib" to the versions it offers, and "zlib:<id>" if it holds the
+# shared dictionary with that id; the server's reply ends with the one it
+# accepted, e.g. "HELLO 1 zlib:8f3a2c1d". From then on either side may send
+# a payload as COMPRESSED_MARKER followed by raw deflate data. Each payload
+# is compressed on its own (starting from the dictionary, if one was
+# agreed), so replies can still go out in any order. Payloads under the
+# sender's threshold, or that would not shrink, are sent as they are.
+COMPRESSED_MARKER = 0x1F
+COMPRESSION = "zlib"
+
+
+def is_compressed(payload):
+    return len(payload) > 0 and payload[0] == COMPRESSED_MARKER
+
+# Id of a shared dictionary, as named in the HELLO
+def zdict_id(zdict):
+    return f"{zlib.crc32(zdict):08x}"
+
+
+class Compressor:
+    def __init__(self, zdict=None, level=6, threshold=1024):
+        self.options = {"zdict": zdict} if zdict else {}
+        self.level = level
+        self.threshold = threshold
+        self.token = f"{COMPRESSION}:{zdict_id(zdict)}" if zdict else COMPRESSION
+
+    # The payload to send: compressed if it is at least `threshold` bytes
+    # and gets smaller, otherwise the payload itself (encoded to bytes)
+    def compress(self, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if not payload or len(payload) < self.threshold:
+            return payload
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS, **self.options)
+        data = compressor.compress(payload) + compressor.flush()
+        if len(data) + 1 >= len(payload):
+            return payload
+        return bytes((COMPRESSED_MARKER,)) + data
+
+    # A received payload, decompressed if it was sent compressed
+    def decompress(self, payload):
+        if not is_compressed(payload):
+            return payload
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS, **self.options)
+        try:
+            data = decompressor.decompress(memoryview(payload)[1:], MAX_FRAME_SIZE)
+        except zlib.error as e:
+            raise ProtocolError(f"bad compressed payload: {e}")
+        if not decompressor.eof:
+            raise ProtocolError("compressed payload is truncated or too large")
+        return data
+
+
+# The compressions one side can offer or accept, as token -> Compressor,
+# best first: with the shared dictionary `zdict` if there is one, then
+# plain zlib
+def make_compressors(zdict=None, level=6, threshold=1024):
+    compressors = {}
+    if zdict:
+        compressor = Compressor(zdict, level, threshold)
+        compressors[compressor.token] = compressor
+    compressors[COMPRESSION] = Compressor(None, level, threshold)
+    return compressors
+
+# A received payload, on a connection that negotiated `compressor` (None
+# if it did not)
+def decompress_payload(compressor, payload):
+    if compressor is not None:
+        return compressor.decompress(payload)
+    if is_compressed(payload):
+        raise ProtocolError("compressed payload without negotiating compression")
+    return payload
+
+# The compression a HELLO request offers that `compressors` (token ->
+# Compressor, best first) can do, as (token, Compressor), or (None, None)
+def negotiate_compression(request, compressors):
+    offered = set(request.split()[1:])
+    for token, compressor in compressors.items():
+        if token in offered:
+            return token, compressor
+    return None, None
+
+# Build a shared dictionary from sample resource URLs. The candidates are
+# URL prefixes up to each "/" (scheme, host, course and term directories)
+# and file extensions, scored by the bytes they would save; zlib matches
+# the end of a dictionary most cheaply, so the best come last.
+def train_zdict(urls, size=16 * 1024):
+    counts = Counter()
+    for url in urls:
+        slash = url.find("/")
+        while slash != -1:
+            counts[url[:slash + 1]] += 1
+            slash = url.find("/", slash + 1)
+        dot = url.rfind(".")
+        if dot > url.rfind("/"):
+            counts[url[dot:]] += 1
+    candidates = sorted(((count * len(piece), piece) for piece, count in counts.items()
+                         if count > 1), reverse=True)
+    chosen = []
+    total = 0
+    for score, piece in candidates:
+        if total >= size:
+            break
+        if total + len(piece) > size:
+            continue
+        # Already matchable inside a longer prefix that was chosen
+        if any(piece in other for other in chosen):
+            continue
+        chosen.append(piece)
+        total += len(piece) + 1
+    return "|".join(reversed(chosen)).encode()
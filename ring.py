@@ -0,0 +1,49 @@
+import bisect
+import hashlib
+
+# Consistent hashing of keys (course ids, usernames) onto cluster nodes.
+# Each node is placed at `vnodes` points on a 64-bit ring and a key belongs
+# to the first point at or after its own hash, so adding or removing a node
+# only moves the keys next to that node's points (about 1/N of them) and the
+# points spread each node's share evenly.
+
+
+def hash_key(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes=(), vnodes=100):
+        self.vnodes = vnodes
+        self.nodes = []
+        self.points = []    # sorted hashes
+        self.owners = []    # node at the same index as each point
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.vnodes):
+            point = hash_key(f"{node}#{i}")
+            index = bisect.bisect_left(self.points, point)
+            self.points.insert(index, point)
+            self.owners.insert(index, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        kept = [(p, n) for p, n in zip(self.points, self.owners) if n != node]
+        self.points = [p for p, n in kept]
+        self.owners = [n for p, n in kept]
+
+    def node_for(self, key):
+        if not self.points:
+            raise LookupError("hash ring has no nodes")
+        index = bisect.bisect_left(self.points, hash_key(key))
+        return self.owners[index % len(self.owners)]
+
+    def __len__(self):
+        return len(self.nodes)
@@ -0,0 +1,487 @@
+import argparse
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import client
+import db
+import protocol
+import ring
+
+# Thin router in front of a course-sharded cluster. Every node is an
+# ordinary server with its own database; a course (its resources, catalog
+# entry and subscriptions) lives on the node the hash ring assigns its
+# course_id to, and a user on the node for their username. Clients connect
+# to the router exactly as to a server (framed or one-shot, text or binary)
+# and it forwards each request to the owning node untouched, or sends it to
+# every node and merges the replies. Nodes share --cluster-secret, so a
+# session token issued by one node is accepted by all of them.
+#
+#   python router.py --spawn 3                 # three local nodes on 5001-5003
+#   python router.py --nodes 10.0.0.1:5000,10.0.0.2:5000
+
+# Commands owned by one node: the argument holding the shard key
+ROUTED = {
+    "REGISTER": 1,
+    "LOGIN": 0,
+    "GET_RESOURCES": 0,
+    "UPLOAD_RESOURCE": 0,
+    "SUBSCRIBE": 1,
+    "GET_NEW_RESOURCES": 1,
+    "GET_RESOURCES_PAGE": 0,
+    "GET_NEW_RESOURCES_PAGE": 1,
+    "STREAM_RESOURCES": 0,
+    "STREAM_NEW_RESOURCES": 1,
+    "REPLAY": 1,
+}
+STREAM_COMMANDS = {"STREAM_RESOURCES", "STREAM_NEW_RESOURCES"}
+# Sent to every node; OK rows are concatenated in node order
+MERGED = {"GET_COURSES", "GET_SUBSCRIBED_COURSES", "GET_DASHBOARD"}
+# Sent to every node; the reply is a JSON object of each node's reply
+PER_NODE = {"STATS", "CACHE_STATS", "PROFILE"}
+
+POOL_SIZE = 4
+
+# Reply bytes queued per client connection for a client that is not
+# reading them (set in main); past this the connection is dropped. A
+# closing connection gets REPLY_DRAIN_SECONDS to send what it still owes.
+send_buffer_bytes = protocol.MAX_BUFFERED
+REPLY_DRAIN_SECONDS = 10
+
+# Compression clients may negotiate with the router (set in main). Node
+# replies are forwarded decompressed and compressed again for each client,
+# so the links to the nodes carry them uncompressed.
+compressors = {}
+
+
+class Router:
+    def __init__(self, nodes, vnodes=100, pool_size=POOL_SIZE):
+        self.nodes = list(nodes)
+        self.ring = ring.HashRing(self.nodes, vnodes)
+        self.pools = {node: client.ConnectionPool(*split_address(node), size=pool_size)
+                      for node in self.nodes}
+        self.executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="router")
+
+    # (command name or None, arguments, binary?) of a request payload
+    def parse(self, payload):
+        if protocol.is_binary(payload):
+            opcode, fields = protocol.decode_request(payload)
+            return protocol.COMMAND_NAMES.get(opcode), fields, True
+        parts = payload.decode().split()
+        return (parts[0] if parts else None), parts[1:], False
+
+    def owner(self, name, args):
+        index = ROUTED[name]
+        # Let a node answer "Missing arguments"
+        return self.ring.node_for(args[index]) if len(args) > index else self.nodes[0]
+
+    # The reply to one request: a Future of the reply payload, or for
+    # STREAM_* a generator of chunk payloads
+    def handle(self, payload):
+        try:
+            name, args, binary = self.parse(payload)
+        except protocol.ProtocolError:
+            return completed(b"Invalid request!")
+        except UnicodeDecodeError:
+            return completed(protocol.NOT_UTF8.encode())
+        if name == "HELLO":
+            version = protocol.negotiate_version(payload.decode())
+            return completed((f"HELLO {version}" if version else "Invalid request!").encode())
+        if name in STREAM_COMMANDS:
+            return self.stream(self.owner(name, args), payload, binary, name)
+        if name in ROUTED:
+            return self.forward(self.owner(name, args), payload, binary, name)
+        if name == "UPLOAD_RESOURCES_BATCH":
+            return self.upload_batch(payload, args, binary, name)
+        if name in MERGED:
+            return gather(self.scatter(payload, binary, name),
+                          lambda replies: merge_rows(name, binary, replies))
+        if name in PER_NODE:
+            return gather(self.scatter(payload, binary, name),
+                          lambda replies: per_node(name, binary, self.nodes, replies))
+        if name == "LOGOUT":
+            # The token may be cached by any node
+            return gather(self.scatter(payload, binary, name), first_ok)
+        return self.forward(self.nodes[0], payload, binary, name)
+
+    def submit(self, node, payload):
+        pool = self.pools[node]
+        try:
+            return pool.get().submit(payload)
+        except client.NotSentError:
+            return pool.get().submit(payload)
+
+    # Future of the node's reply; an unreachable node becomes an error reply
+    def forward(self, node, payload, binary, name):
+        try:
+            return settled(node, self.submit(node, payload), binary, name)
+        except Exception as e:
+            return completed(unavailable(node, e, binary, name))
+
+    # A batch is split into one batch per node owning some of its courses.
+    # Each node commits its share on its own, so a failed node does not undo
+    # the others; the reply is the first failure or the total added.
+    def upload_batch(self, payload, args, binary, name):
+        if len(args) < 3 or len(args) % 2 == 0:
+            # Let a node answer "Missing arguments"
+            return self.forward(self.nodes[0], payload, binary, name)
+        shares = {}
+        for course_id, resource_url in zip(args[1::2], args[2::2]):
+            shares.setdefault(self.ring.node_for(course_id), []).extend((course_id, resource_url))
+        futures = []
+        for node, fields in shares.items():
+            fields = [args[0]] + fields
+            if binary:
+                share = protocol.encode_request(protocol.OPCODES[name], fields)
+            else:
+                share = " ".join([name] + fields).encode()
+            futures.append(self.forward(node, share, binary, name))
+        return gather(futures, lambda replies: batch_added(binary, name, replies))
+
+    def scatter(self, payload, binary, name):
+        return [self.forward(node, payload, binary, name) for node in self.nodes]
+
+    def stream(self, node, payload, binary, name):
+        try:
+            pool = self.pools[node]
+            try:
+                chunks = pool.get().stream(payload)
+                first = next(chunks, None)
+            except client.NotSentError:
+                chunks = pool.get().stream(payload)
+                first = next(chunks, None)
+            if first is None:
+                return
+            yield first
+            yield from chunks
+        except Exception as e:
+            yield unavailable(node, e, binary, name)
+
+    # LISTEN on every node (a user's subscriptions are spread over them) and
+    # relay their pushes to `push(message)`. Returns the node connections
+    # and a Future of the reply.
+    def listen(self, payload, push):
+        name, args, binary = self.parse(payload)
+        connections = []
+        futures = []
+        for node in self.nodes:
+            try:
+                conn = client.Connection(*split_address(node), on_push=push)
+                connections.append(conn)
+                futures.append(settled(node, conn.submit(payload), binary, name))
+            except Exception as e:
+                futures.append(completed(unavailable(node, e, binary, name)))
+        return connections, gather(futures, first_error)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for pool in self.pools.values():
+            pool.close()
+
+
+# Future resolving to `future`'s payload, or to an error reply if it failed
+def settled(node, future, binary, name):
+    result = Future()
+
+    def done(future):
+        try:
+            result.set_result(future.result())
+        except Exception as e:
+            result.set_result(unavailable(node, e, binary, name))
+    future.add_done_callback(done)
+    return result
+
+# Future of combine(results of `futures`, in order) once all are done
+def gather(futures, combine):
+    result = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            result.set_result(combine([future.result() for future in futures]))
+        except Exception as e:
+            result.set_exception(e)
+    for future in futures:
+        future.add_done_callback(done)
+    return result
+
+def split_address(node):
+    host, port = node.rsplit(":", 1)
+    return host, int(port)
+
+def completed(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+def encode_reply(binary, name, status, fields):
+    if binary:
+        return protocol.encode_response(status, fields)
+    if status == protocol.STATUS_OK and name in protocol.LIST_COMMANDS:
+        return "|".join(fields).encode()
+    return (fields[0] if fields else "").encode()
+
+def unavailable(node, error, binary, name):
+    return encode_reply(binary, name, protocol.STATUS_ERROR,
+                        [f"Error: Node {node} unavailable: {error}"])
+
+def is_failure(status):
+    return status not in (protocol.STATUS_OK, protocol.STATUS_EMPTY)
+
+# The first reply that is neither OK nor empty, else the first reply
+def first_error(replies):
+    for reply in replies:
+        if is_failure(client.decode_reply(None, reply)[0]):
+            return reply
+    return replies[0]
+
+def first_ok(replies):
+    for reply in replies:
+        if client.decode_reply(None, reply)[0] == protocol.STATUS_OK:
+            return reply
+    return replies[0]
+
+def merge_rows(name, binary, replies):
+    decoded = [client.decode_reply(name, reply) for reply in replies]
+    for reply, (status, fields) in zip(replies, decoded):
+        if is_failure(status):
+            return reply
+    rows = [fields for status, fields in decoded if status == protocol.STATUS_OK]
+    if not rows:
+        return replies[0]
+    if name == "GET_DASHBOARD":
+        courses = [course for fields in rows for course in json.loads(fields[0])["courses"]]
+        return encode_reply(binary, name, protocol.STATUS_OK, [json.dumps({"courses": courses})])
+    return encode_reply(binary, name, protocol.STATUS_OK, [row for fields in rows for row in fields])
+
+def batch_added(binary, name, replies):
+    added = 0
+    for reply in replies:
+        status, fields = client.decode_reply(name, reply)
+        if status != protocol.STATUS_OK:
+            return reply
+        added += int(fields[0].split()[1])
+    return encode_reply(binary, name, protocol.STATUS_OK, [f"Added {added} resources"])
+
+def per_node(name, binary, nodes, replies):
+    combined = {}
+    for node, reply in zip(nodes, replies):
+        text = client.reply_text(name, reply)
+        try:
+            combined[node] = json.loads(text)
+        except ValueError:
+            combined[node] = text
+    return encode_reply(binary, name, protocol.STATUS_OK, [json.dumps(combined)])
+
+
+# Set in main
+router = None
+
+def handle_client(client_socket):
+    try:
+        first = client_socket.recv(1, socket.MSG_PEEK)
+        if first and first[0] == protocol.FRAME_MAGIC:
+            handle_framed_client(client_socket)
+            return
+        request = client_socket.recv(65536)
+        reply = router.handle(request)
+        if isinstance(reply, Future):
+            client_socket.sendall(reply.result())
+        else:
+            # One-shot text streams are chunks joined with "|"
+            client_socket.sendall(b"|".join(reply))
+    except (OSError, protocol.ProtocolError):
+        pass
+    finally:
+        client_socket.close()
+
+def handle_framed_client(client_socket):
+    listeners = []
+    compressor = None
+    # Frames are written by the connection's own thread, so neither this
+    # reader nor the node connections' threads delivering replies and
+    # pushes wait on a client that is slow to read. Streamed replies are
+    # pulled from their node on that thread too, as the client takes them.
+    writer = protocol.FrameWriter(client_socket, send_buffer_bytes)
+
+    def send_reply(request_id, future, compressor):
+        try:
+            reply = future.result()
+        except Exception as e:
+            reply = f"Error: {str(e)}"
+        writer.send(request_id, reply, compressor, ends_reply=True)
+
+    def push(message):
+        writer.send(protocol.PUSH_REQUEST_ID, json.dumps(message), compressor)
+
+    try:
+        while True:
+            frame = protocol.read_frame(client_socket)
+            if frame is None:
+                break
+            request_id, payload = frame
+            payload = protocol.decompress_payload(compressor, payload)
+            writer.expect()
+            name = None
+            try:
+                name = router.parse(payload)[0]
+            except (protocol.ProtocolError, UnicodeDecodeError):
+                pass
+            if name == "HELLO":
+                # Compression is between the client and the router, so the
+                # router adds what it accepted to the reply
+                reply = router.handle(payload).result()
+                token, negotiated = protocol.negotiate_compression(payload.decode(), compressors)
+                if token and reply.startswith(b"HELLO"):
+                    reply += f" {token}".encode()
+                writer.send(request_id, reply, ends_reply=True)
+                compressor = negotiated
+                continue
+            if name == "LISTEN":
+                connections, reply = router.listen(payload, push)
+                listeners.extend(connections)
+                # If a node drops its side, drop the client so it reconnects
+                # and listens on every node again
+                for conn in connections:
+                    threading.Thread(target=close_after, args=(conn, client_socket),
+                                     daemon=True).start()
+            else:
+                reply = router.handle(payload)
+            if isinstance(reply, Future):
+                reply.add_done_callback(
+                    lambda future, request_id=request_id, compressor=compressor:
+                        send_reply(request_id, future, compressor))
+            else:
+                writer.send_stream(request_id, reply, compressor)
+    except (OSError, protocol.ProtocolError):
+        pass
+    finally:
+        for conn in listeners:
+            conn.close()
+        writer.close(REPLY_DRAIN_SECONDS)
+        client_socket.close()
+
+
+def close_after(conn, client_socket):
+    conn.reader.join()
+    try:
+        client_socket.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+# Start `count` local nodes on the ports after the router's, each with its
+# own shard database, for trying the cluster out on one machine
+def spawn_nodes(count, port, db_path, secret, server_args):
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+    root, ext = os.path.splitext(db_path)
+    processes = []
+    nodes = []
+    for i in range(count):
+        node_port = port + 1 + i
+        processes.append(subprocess.Popen(
+            [sys.executable, server, "--port", str(node_port), "--host", "127.0.0.1",
+             "--db", f"{root}-shard{i}{ext}", "--cluster-secret", secret,
+             # The router's links carry many clients' requests each
+             "--max-pipelined", "0"] + server_args))
+        nodes.append(f"127.0.0.1:{node_port}")
+    for node in nodes:
+        wait_for_node(node)
+    return processes, nodes
+
+def wait_for_node(node, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(split_address(node), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Router for a course-sharded LMS cluster")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--backlog", type=int, default=128)
+    parser.add_argument("--nodes", help="comma-separated host:port of the cluster's servers")
+    parser.add_argument("--spawn", type=int, default=0,
+                        help="start this many local nodes on the following ports")
+    parser.add_argument("--db", default=db.DB_PATH,
+                        help="with --spawn: node i uses <db>-shard<i>")
+    parser.add_argument("--cluster-secret",
+                        help="with --spawn: session signing key for the nodes (default: random)")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="with --spawn: extra argument for every node, e.g. "
+                             "--server-arg=--broker=inprocess")
+    parser.add_argument("--send-buffer-kb", type=int, default=protocol.MAX_BUFFERED // 1024,
+                        help="reply data queued per client connection for a client that "
+                             "is not reading it; past this the connection is dropped")
+    parser.add_argument("--vnodes", type=int, default=100,
+                        help="points per node on the hash ring")
+    parser.add_argument("--compress-threshold", type=int, default=1024,
+                        help="compress replies of at least this many bytes to clients "
+                             "that negotiate it (0 turns compression off)")
+    parser.add_argument("--compress-level", type=int, default=6, choices=range(1, 10),
+                        metavar="1-9", help="zlib level for compressed replies")
+    parser.add_argument("--zdict",
+                        help="shared compression dictionary offered to clients (see "
+                             "server.py --train-zdict)")
+    args = parser.parse_args(argv)
+    if bool(args.nodes) == bool(args.spawn):
+        parser.error("give exactly one of --nodes and --spawn")
+    return args
+
+def main(argv=None):
+    global router, compressors, send_buffer_bytes
+    args = parse_args(argv)
+    send_buffer_bytes = args.send_buffer_kb * 1024
+    if args.compress_threshold:
+        zdict = None
+        if args.zdict:
+            with open(args.zdict, "rb") as f:
+                zdict = f.read()
+        compressors = protocol.make_compressors(zdict, args.compress_level,
+                                                args.compress_threshold)
+    client.USE_COMPRESSION = False
+    processes = []
+    if args.spawn:
+        processes, nodes = spawn_nodes(args.spawn, args.port, args.db,
+                                       args.cluster_secret or secrets.token_hex(16),
+                                       args.server_arg)
+    else:
+        nodes = [node.strip() for node in args.nodes.split(",") if node.strip()]
+    router = Router(nodes, args.vnodes)
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((args.host, args.port))
+    server_socket.listen(args.backlog)
+    print(f"Router is running on port {args.port} for {len(nodes)} nodes: {', '.join(nodes)}")
+    try:
+        while True:
+            client_sock, addr = server_socket.accept()
+            threading.Thread(target=handle_client, args=(client_sock,), daemon=True).start()
+    except KeyboardInterrupt:
+        print("Shutting down router...")
+    finally:
+        server_socket.close()
+        router.close()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+if __name__ == "__main__":
+    main()
@@ -2,215 +2,1867 @@ import sqlite3
 import socket
 import threading
 import json
-import redis
-
-# Connect to Redis
-#TODO Understand
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
-
-# Connect to SQLite database
-conn = sqlite3.connect("lms.db", check_same_thread=False)
-cursor = conn.cursor()
-
-# Create tables if they don't exist
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE,
-    password TEXT,
-    role TEXT
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS courses (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    course_id TEXT,
-    resource_url TEXT,
-    poster_username TEXT,
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-)
-""")
-
-# New table for subscriptions
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS subscriptions (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT,
-    course_id TEXT,
-    last_viewed DATETIME DEFAULT CURRENT_TIMESTAMP,
-    UNIQUE(username, course_id)
-)
-""")
-
-conn.commit()
-
-# Function to register users
-def register_user(role, username, password):
-    try:
-        cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-                     (username, password, role))
-        conn.commit()
-        return "Registration Successful"
-    except sqlite3.IntegrityError:
-        return "Error: Username already exists!"
-
-# Function to login users
+import asyncio
+import argparse
+import base64
+import getpass
+import os
+import signal
+import sys
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+from types import GeneratorType
+import admission
+import auth
+import broker
+import cache
+import db
+import eventlog
+import fanout
+import metrics
+import profiler
+import protocol
+
+# Message broker for course notifications (Redis or in-process, set in main)
+# and the background stage committed uploads publish through
+message_broker = None
+publisher = None
+
+# Runtime metrics, read by the STATS command and the Prometheus exporters
+server_metrics = metrics.Registry()
+command_latency = server_metrics.histogram(
+    "command_duration_seconds", "Time to run a command handler", label="command")
+command_errors = server_metrics.counter(
+    "command_errors_total", "Commands answered with an error or bad request status",
+    label="command")
+bytes_received = server_metrics.counter("bytes_received_total", "Request bytes read from clients")
+bytes_sent = server_metrics.counter("bytes_sent_total", "Response and push bytes sent to clients")
+active_connections = server_metrics.gauge("active_connections", "Open client connections")
+requests_in_flight = server_metrics.gauge("requests_in_flight", "Commands being handled")
+db_time = server_metrics.histogram(
+    "db_connection_seconds", "Time a request held a pooled SQLite connection")
+commit_time = server_metrics.histogram(
+    "db_commit_seconds", "Time per group-commit transaction")
+publish_time = server_metrics.histogram(
+    "broker_publish_seconds", "Time to send one pipeline of coalesced notifications")
+requests_shed = server_metrics.counter(
+    "requests_shed_total", "Requests refused by admission control", "reason")
+requests_shed_by_class = server_metrics.counter(
+    "requests_shed_by_class_total", "Requests refused by admission control", "priority")
+compress_time = server_metrics.histogram(
+    "compress_seconds", "CPU time to compress one reply payload")
+compress_input = server_metrics.counter(
+    "compress_input_bytes_total", "Bytes of the reply payloads given to the compressor")
+compress_output = server_metrics.counter(
+    "compress_output_bytes_total", "Bytes of those payloads as sent")
+compress_skipped = server_metrics.counter(
+    "compress_skipped_total", "Replies sent uncompressed on compressing connections",
+    "reason")
+started_at = time.monotonic()
+
+# Sampling profiler started by the PROFILE command; it writes collapsed
+# stacks into profile_dir (set in main, PROFILE is refused while it is None)
+command_profiler = profiler.Profiler()
+profile_dir = None
+MAX_PROFILE_SECONDS = 300
+
+# SQLite connection pool (opened in init_db) and the group-commit writer
+# every INSERT/UPDATE goes through (started in main)
+db_pool = None
+db_writer = None
+
+# Per-course upload logs (opened in init_db); "new resources" for a
+# subscriber are the log records after its subscription's last_offset
+event_log = None
+
+# Open the pool and event logs of this process
+def open_db(path=db.DB_PATH, event_log_dir=None, **pragmas):
+    global db_pool, event_log
+    db_pool = db.ConnectionPool(path, timer=db_time, **pragmas)
+    event_log = eventlog.EventLog(event_log_dir or f"{path}.events")
+
+# Open and bring the database up to date; with --workers only the supervisor
+# runs this, before starting the workers
+def init_db(path=db.DB_PATH, event_log_dir=None, **pragmas):
+    open_db(path, event_log_dir, **pragmas)
+    with db_pool.connection() as conn:
+        db.create_schema(conn)
+        db.migrate(conn)
+        recovered = event_log.recover(conn)
+        if recovered:
+            print(f"Appended {recovered} resources missing from the event logs")
+        init_subscription_offsets(conn)
+
+# Subscriptions from before the event logs have no offset yet: start them
+# after the last record their last_viewed had already covered
+def init_subscription_offsets(conn):
+    rows = conn.execute("""
+        SELECT id, course_id, last_viewed FROM subscriptions WHERE last_offset IS NULL
+    """).fetchall()
+    for subscription_id, course_id, last_viewed in rows:
+        offset = 0
+        while True:
+            records, next_offset = event_log.read(course_id, offset, 1)
+            if not records or records[0]["timestamp"] > last_viewed:
+                break
+            offset = next_offset
+        conn.execute("UPDATE subscriptions SET last_offset = ? WHERE id = ?",
+                     (offset, subscription_id))
+    conn.commit()
+
+# Executor for SQLite calls from async and framed connections (created in main)
+db_executor = None
+
+# Reply bytes a framed connection may have queued for a client that is not
+# reading them (set in main); past this the connection is dropped. A
+# closing connection gets REPLY_DRAIN_SECONDS to send what it still owes.
+send_buffer_bytes = protocol.MAX_BUFFERED
+REPLY_DRAIN_SECONDS = 10
+
+# Compression framed connections may negotiate in their HELLO, as token ->
+# protocol.Compressor, best first (set in main; empty turns it off)
+compressors = {}
+
+# Logins issue a session token; commands acting for a user accept it in
+# place of the username and resolve it here without touching SQLite. With
+# require_auth set, a bare username is refused.
+session_table = auth.SessionTable()
+require_auth = False
+
+# Commands run on the admission control's bounded worker pool (created in
+# serve), behind rate limits per client IP and per user. Connections past
+# max_connections are answered busy and closed.
+admission_control = None
+max_connections = 1024
+# Whose rate limit LOGIN, REGISTER and LISTEN count against; other commands
+# count against their user_arg
+RATE_LIMIT_ARGS = {"LOGIN": 0, "REGISTER": 1, "LISTEN": 0}
+
+# Password hashes run on their own pool (created in main), so a burst of
+# logins does not hold up db_executor workers while it hashes
+hash_executor = None
+password_iterations = auth.HASH_ITERATIONS
+
+# Bare usernames confirmed to exist; users are never deleted, so this only
+# saves lookups
+known_users = set()
+
+# The username a command argument acts as: the user of a live session, or
+# (unless require_auth) an existing user named directly. None for anything
+# else, including token-shaped arguments whose session expired or was
+# revoked.
+def authenticate(user):
+    session = session_table.get(user)
+    if session is not None:
+        return session.username
+    if require_auth or auth.looks_like_token(user):
+        return None
+    return user if user_exists(user) else None
+
+# The session a role-gated argument stands for: only a live token, never a
+# bare username, whether or not require_auth is set
+def privileged_session(token, roles):
+    session = session_table.get(token) if token else None
+    if session is None or session.role not in roles:
+        return None
+    return session
+
+def user_exists(username):
+    if username in known_users:
+        return True
+    with db_pool.connection() as conn:
+        exists = conn.execute(LOGIN_SQL, (username,)).fetchone() is not None
+    if exists:
+        known_users.add(username)
+    return exists
+
+# Who a request counts against for rate limits: resolved without SQLite,
+# since admission runs on the accepting thread or event loop
+def rate_limit_identity(user):
+    session = session_table.get(user)
+    return session.username if session is not None else user
+
+# Run fn(result) once `future` completes and return a Future of its value.
+# fn may itself return a Future, which is waited for in turn; on_error(e)
+# may turn a failure into a value instead of passing it on.
+def chain(future, fn, on_error=None):
+    chained = Future()
+
+    def settle(value=None, error=None):
+        if error is not None and on_error is not None:
+            try:
+                value, error = on_error(error), None
+            except Exception as e:
+                error = e
+        if error is not None:
+            chained.set_exception(error)
+        elif isinstance(value, Future):
+            value.add_done_callback(lambda f: settle(*outcome(f)))
+        else:
+            chained.set_result(value)
+
+    def done(f):
+        value, error = outcome(f)
+        if error is None:
+            try:
+                value = fn(value)
+            except Exception as e:
+                error = e
+        settle(value, error)
+
+    future.add_done_callback(done)
+    return chained
+
+def outcome(future):
+    try:
+        return future.result(), None
+    except Exception as e:
+        return None, e
+
+# Encoded GET_COURSES / GET_RESOURCES responses, invalidated by the same
+# course:{course_id} events that uploads publish. Keys end with the wire
+# format, so a hit is already encoded for the connection that asked.
+response_cache = cache.ResponseCache()
+ALL_COURSES_KEY = ("GET_COURSES",)
+WIRE_FORMATS = ("text", "binary")
+
+def invalidate_course_cache(course_id):
+    for wire_format in WIRE_FORMATS:
+        response_cache.invalidate(("GET_RESOURCES", course_id, wire_format))
+    # The course list only changes when a course gets its first resource
+    courses = response_cache.peek(ALL_COURSES_KEY + ("text",))
+    if courses is None or course_id not in courses.split("|"):
+        for wire_format in WIRE_FORMATS:
+            response_cache.invalidate(ALL_COURSES_KEY + (wire_format,))
+
+def handle_course_event(channel, data):
+    if isinstance(channel, bytes):
+        channel = channel.decode()
+    invalidate_course_cache(channel.split(":", 1)[1])
+
+# Connected LISTEN clients, fed by the course:* notification listener
+fanout_hub = fanout.FanoutHub()
+push_queue_size = 100
+slow_consumer_policy = "coalesce"
+
+# Page size bounds for the *_PAGE commands and rows per chunk for STREAM_*
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_ROWS = 500
+
+# Hot-path queries, kept here so check_query_plans() tests the exact SQL
+# the handlers run. They rely on the indexes and course_catalog table added
+# by the migrations in db.py.
+COURSE_RESOURCES_SQL = "SELECT resource_url FROM courses WHERE course_id = ? ORDER BY id"
+
+SUBSCRIPTION_OFFSET_SQL = """
+    SELECT last_offset FROM subscriptions WHERE username = ? AND course_id = ?
+"""
+
+RESOURCE_PAGE_SQL = """
+    SELECT id, resource_url FROM courses
+    WHERE course_id = ? AND id > ?
+    ORDER BY id LIMIT ?
+"""
+
+ALL_COURSES_SQL = "SELECT course_id FROM course_catalog ORDER BY id"
+
+LOGIN_SQL = "SELECT password, role FROM users WHERE username = ?"
+
+COURSE_EXISTS_SQL = "SELECT 1 FROM course_catalog WHERE course_id = ?"
+
+SUBSCRIBED_COURSES_SQL = "SELECT course_id FROM subscriptions WHERE username = ?"
+
+DASHBOARD_SQL = """
+    SELECT s.course_id, s.last_offset, c.resource_url
+    FROM subscriptions s
+    LEFT JOIN courses c ON c.course_id = s.course_id
+    WHERE s.username = ?
+    ORDER BY s.id, c.id
+"""
+
+# (query, sample parameters, tables it may legitimately scan)
+HOT_QUERIES = [
+    (COURSE_RESOURCES_SQL, ("101",), ()),
+    (SUBSCRIPTION_OFFSET_SQL, ("student", "101"), ()),
+    (RESOURCE_PAGE_SQL, ("101", 0, 50), ()),
+    (ALL_COURSES_SQL, (), ("course_catalog",)),
+    (LOGIN_SQL, ("student",), ()),
+    (COURSE_EXISTS_SQL, ("101",), ()),
+    (SUBSCRIBED_COURSES_SQL, ("student",), ()),
+    (DASHBOARD_SQL, ("student",), ()),
+]
+
+# Run EXPLAIN QUERY PLAN on every hot query; returns the full table scans found
+def check_query_plans():
+    problems = []
+    with db_pool.connection() as conn:
+        for sql, params, allowed in HOT_QUERIES:
+            for detail in db.full_scans(conn, sql, params):
+                if detail.split()[1] not in allowed:
+                    problems.append(f"{detail}: {' '.join(sql.split())}")
+    return problems
+
+# Resource URLs the compression dictionary is trained on: the latest ones
+ZDICT_SAMPLES = 100_000
+
+def read_zdict(path):
+    if not path:
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+# Write a shared compression dictionary built from the resource URLs in the
+# database, for --zdict on the server and client.ZDICT on clients
+def train_zdict(path):
+    with db_pool.connection() as conn:
+        urls = [row[0] for row in conn.execute(
+            "SELECT resource_url FROM courses ORDER BY id DESC LIMIT ?", (ZDICT_SAMPLES,))]
+    zdict = protocol.train_zdict(urls)
+    with open(path, "wb") as f:
+        f.write(zdict)
+    print(f"Wrote a {len(zdict)}-byte dictionary ({protocol.zdict_id(zdict)}) "
+          f"from {len(urls)} resource URLs to {path}")
+
+# Roles an account may have. Anyone may register as a student; other
+# accounts are created by an admin (REGISTER with the admin's session as a
+# fourth argument) or on the server with --add-user.
+ROLES = ("student", "instructor", "admin")
+OPEN_ROLES = ("student",)
+ADMIN_ROLES = ("admin",)
+
+# Function to register users. The password is hashed on hash_executor and
+# the insert goes through the group-commit writer, so the reply is a Future.
+def register_user(role, username, password, session=None):
+    if role not in ROLES:
+        return "Error: Invalid role"
+    if role not in OPEN_ROLES and privileged_session(session, ADMIN_ROLES) is None:
+        return "Error: Permission denied"
+    if auth.looks_like_token(username):
+        return "Error: Invalid username"
+
+    def write(hashed):
+        def insert(cursor):
+            cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                         (username, hashed, role))
+        return db_writer.submit(insert)
+
+    def on_error(e):
+        if isinstance(e, sqlite3.IntegrityError):
+            return "Error: Username already exists!"
+        raise e
+
+    hashed = hash_executor.submit(auth.hash_password, password, password_iterations)
+    return chain(chain(hashed, write), lambda _: "Registration Successful", on_error)
+
+# Create an account from the command line (--add-user), where REGISTER
+# would refuse the role. Runs before the server starts, so it writes
+# through the pool directly.
+def add_user(role, username):
+    if role not in ROLES:
+        return f"Error: Invalid role (one of {', '.join(ROLES)})"
+    if sys.stdin.isatty():
+        password = getpass.getpass(f"Password for {username}: ")
+    else:
+        password = sys.stdin.readline().rstrip("\n")
+    if not password:
+        return "Error: Empty password"
+    hashed = auth.hash_password(password, password_iterations)
+    with db_pool.connection() as conn:
+        try:
+            conn.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                         (username, hashed, role))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            return "Error: Username already exists!"
+    return f"Added {role} {username}"
+
+# Function to login users. Replies "Login successful <role> <token>" (as a
+# Future, once the password has been checked on hash_executor).
 def login_user(username, password):
-    cursor.execute("SELECT role FROM users WHERE username=? AND password=?",
-                 (username, password))
-    result = cursor.fetchone()
-    if result:
-        return f"Login successful {result[0]}"  # Returns role (student/instructor)
-    return "Error: Invalid credentials"
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(LOGIN_SQL, (username,))
+        result = cursor.fetchone()
+    stored, role = result if result else (auth.dummy_hash(password_iterations), None)
+
+    def finish(valid):
+        if not valid or role is None:
+            return "Error: Invalid credentials"
+        if auth.needs_rehash(stored, password_iterations):
+            rehash_password(username, password)
+        token = session_table.create(username, role)
+        return f"Login successful {role} {token}"  # role is student/instructor
+
+    return chain(hash_executor.submit(auth.verify_password, password, stored), finish)
+
+# Upgrade a plain-text or outdated password hash after a successful login;
+# nothing waits for it
+def rehash_password(username, password):
+    def write(hashed):
+        return db_writer.submit(lambda cursor: cursor.execute(
+            "UPDATE users SET password = ? WHERE username = ?", (hashed, username)))
+    chain(hash_executor.submit(auth.hash_password, password, password_iterations), write)
+
+def logout_user(token):
+    if not session_table.revoke(token):
+        return "Error: Invalid or expired session"
+    # Other processes accept signed tokens too; tell them to drop it
+    if session_table.secret is not None:
+        try:
+            message_broker.publish(SESSION_REVOKED_TOPIC, token)
+        except Exception as e:
+            print(f"Error publishing session revocation: {e}")
+    return "Logged out"
+
+SESSION_REVOKED_TOPIC = "session:revoked"
+
+def handle_session_event(channel, data):
+    session_table.revoke(data.decode() if isinstance(data, bytes) else data)
+
+# With --workers, a user's LISTEN connection is usually held by another
+# worker than the one that took their SUBSCRIBE, so new subscriptions are
+# announced to every worker's fanout hub (set in serve)
+SUBSCRIPTION_TOPIC = "subscription:added"
+broadcast_subscriptions = False
+
+def handle_subscription_event(channel, data):
+    try:
+        event = json.loads(data)
+    except ValueError:
+        return
+    fanout_hub.add_course(event["username"], event["course_id"])
 
 # Function to upload course resources
 def upload_course_resources(course_id, resource_url, poster_username):
-    try:
+    def write(cursor):
         cursor.execute("INSERT INTO courses (course_id, resource_url, poster_username) VALUES (?, ?, ?)",
                      (course_id, resource_url, poster_username))
-        conn.commit()
-        
-        # Publish notification to Redis channel
-        notification = {
-            "course_id": course_id,
-            "resource_url": resource_url,
-            "poster_username": poster_username
-        }
-        redis_client.publish(f"course:{course_id}", json.dumps(notification))
-        
+        cursor.execute("SELECT timestamp FROM courses WHERE id = ?", (cursor.lastrowid,))
+        return cursor.lastrowid, cursor.fetchone()[0]
+
+    # Once committed, append to the course's event log (on the writer
+    # thread, so log order is commit order) and publish the notification
+    # for the course channel with the rest of the batch
+    def on_commit(result):
+        row_id, timestamp = result
+        record = eventlog.make_record(row_id, resource_url, poster_username, timestamp)
+        record["offset"], head = event_log.append(course_id, record)
+        return [course_notification(course_id, record)]
+
+    try:
+        db_writer.execute(write, on_commit=on_commit)
+        # The broker event invalidates every server's cache; doing it here
+        # as well means the uploader never reads its own stale listing
+        invalidate_course_cache(course_id)
         return "Resource Added Successfully"
     except Exception as e:
         return f"Error: {str(e)}"
 
-# Function to get all course resources
-def get_course_resource(course_id):
+# UPLOAD_RESOURCES_BATCH <poster> <course_id> <resource_url> [<course_id>
+# <resource_url> ...]: many uploads in one write job. The rows go in with one
+# executemany, and each course gets one notification with all of its new
+# resources instead of one per row.
+def upload_resources_batch(poster_username, *fields):
+    if len(fields) % 2:
+        return "Error: Missing arguments!"
+    rows = [(course_id, resource_url, poster_username)
+            for course_id, resource_url in zip(fields[0::2], fields[1::2])]
+    if len(rows) > protocol.MAX_BATCH_ROWS:
+        return f"Error: At most {protocol.MAX_BATCH_ROWS} resources per batch"
+
+    # The writer runs one job at a time, so the ids after the current
+    # maximum are exactly this job's rows
+    def write(cursor):
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM courses")
+        last_id = cursor.fetchone()[0]
+        cursor.executemany("INSERT INTO courses (course_id, resource_url, poster_username) VALUES (?, ?, ?)",
+                           rows)
+        cursor.execute("SELECT id, course_id, resource_url, timestamp FROM courses WHERE id > ? ORDER BY id",
+                       (last_id,))
+        return cursor.fetchall()
+
+    def on_commit(inserted):
+        by_course = {}
+        for row_id, course_id, resource_url, timestamp in inserted:
+            by_course.setdefault(course_id, []).append(
+                eventlog.make_record(row_id, resource_url, poster_username, timestamp))
+        notifications = []
+        for course_id, records in by_course.items():
+            offsets, head = event_log.append_many(course_id, records)
+            notifications.append(batch_notification(course_id, records, offsets[0]))
+        return notifications
+
     try:
-        cursor.execute("SELECT resource_url FROM courses WHERE course_id=?", (course_id,))
-        result = cursor.fetchall()
+        db_writer.execute(write, on_commit=on_commit, alone=True)
+        for course_id in {row[0] for row in rows}:
+            invalidate_course_cache(course_id)
+        return f"Added {len(rows)} resources"
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+# Handlers for list commands return a list of rows, or one of the text
+# protocol's fixed messages when there is nothing to list; encode_result()
+# turns that into the reply for the connection's wire format.
+
+# Serve a list command from the response cache, filling it on a miss.
+# Errors from the database are returned but never cached.
+def cached_result(key, wire_format, produce):
+    key = key + (wire_format,)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = response_cache.generation
+    try:
+        response = encode_result(produce(), wire_format)
+    except Exception as e:
+        return encode_result(f"Error: {str(e)}", wire_format)
+    response_cache.put(key, response, generation)
+    return response
+
+# Function to get all course resources
+def get_course_resource(course_id, wire_format="text"):
+    def produce():
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(COURSE_RESOURCES_SQL, (course_id,))
+            result = cursor.fetchall()
         if not result:
             return "Error: No resources found for this course!"
-        resource_urls = "|".join([row[0] for row in result])
-        return resource_urls
+        return [row[0] for row in result]
+
+    return cached_result(("GET_RESOURCES", course_id), wire_format, produce)
+
+# (topic, notification) announcing one log record on the course channel;
+# the notification is JSON-encoded when it is sent
+def course_notification(course_id, record):
+    notification = {
+        "course_id": course_id,
+        "resource_url": record["resource_url"],
+        "poster_username": record["poster_username"],
+        "offset": record["offset"]
+    }
+    return f"course:{course_id}", notification
+
+# (topic, notification) announcing a batch's records for one course, the
+# first of which is at `offset`
+def batch_notification(course_id, records, offset):
+    notification = {
+        "course_id": course_id,
+        "resource_urls": [record["resource_url"] for record in records],
+        "poster_username": records[0]["poster_username"],
+        "offset": offset
+    }
+    return f"course:{course_id}", notification
+
+# The publisher's merge for a course channel: the notifications published
+# within one window go out as one message listing all of their resources,
+# like a batch upload's. Log records are appended and published in the same
+# order, so the first notification has the lowest offset.
+def merge_course_notifications(topic, notifications):
+    if len(notifications) == 1:
+        return [json.dumps(notifications[0])]
+    merged = {
+        "course_id": notifications[0]["course_id"],
+        "resource_urls": [],
+        "poster_username": notifications[-1]["poster_username"],
+        "offset": notifications[0]["offset"]
+    }
+    for notification in notifications:
+        merged["resource_urls"].extend(notification.get("resource_urls")
+                                       or [notification["resource_url"]])
+    return [json.dumps(merged)]
+
+# REPLAY <session> <course_id> [offset]: republish the course's notifications from its
+# event log, e.g. to catch listeners up after the broker was down
+def replay_course_events(username, course_id, offset="0"):
+    try:
+        records, head = event_log.read(course_id, int(offset))
+    except ValueError:
+        return "Error: Invalid offset!"
+    try:
+        pipe = message_broker.pipeline()
+        for record in records:
+            topic, notification = course_notification(course_id, record)
+            pipe.publish(topic, json.dumps(notification))
+        pipe.execute()
+        return f"Replayed {len(records)} notifications"
     except Exception as e:
         return f"Error: {str(e)}"
 
-# Function to get new resources since last view
+# Function to get new resources since last view: the course's log records
+# after the subscription's committed offset
 def get_new_resources(username, course_id):
     try:
-        cursor.execute("""
-            SELECT resource_url FROM courses c
-            WHERE c.course_id = ? 
-            AND c.timestamp > (
-                SELECT last_viewed FROM subscriptions 
-                WHERE username = ? AND course_id = ?
-            )
-        """, (course_id, username, course_id))
-        
-        result = cursor.fetchall()
-        if not result:
+        offset = subscription_offset(username, course_id)
+        if offset is None:
             return "No new resources"
-        
-        # Update last viewed timestamp
-        cursor.execute("""
-            UPDATE subscriptions 
-            SET last_viewed = CURRENT_TIMESTAMP 
-            WHERE username = ? AND course_id = ?
-        """, (username, course_id))
-        conn.commit()
-        
-        return "|".join([row[0] for row in result])
+        records, head = event_log.read(course_id, offset)
+        if not records:
+            return "No new resources"
+
+        # Commit the offset so these are not new next time
+        commit_offsets(username, [(course_id, head)])
+
+        return [record["resource_url"] for record in records]
     except Exception as e:
         return f"Error: {str(e)}"
 
-# Function to get all courses
-def get_all_courses():
+# Committed log offset of a subscription, None if there is none
+def subscription_offset(username, course_id):
+    with db_pool.connection() as conn:
+        row = conn.execute(SUBSCRIPTION_OFFSET_SQL, (username, course_id)).fetchone()
+    if row is None:
+        return None
+    # Never past the head, e.g. if the log was rebuilt shorter
+    return min(row[0] or 0, event_log.head(course_id))
+
+# Offsets only move forward, so a slow reader cannot undo a faster one
+def commit_offsets(username, offsets):
+    db_writer.execute(lambda cursor: cursor.executemany("""
+        UPDATE subscriptions
+        SET last_offset = MAX(COALESCE(last_offset, 0), ?), last_viewed = CURRENT_TIMESTAMP
+        WHERE username = ? AND course_id = ?
+    """, [(offset, username, course_id) for course_id, offset in offsets]))
+
+# Page cursors are opaque to clients; they wrap the last courses.id returned
+def encode_page_cursor(row_id):
+    return base64.urlsafe_b64encode(str(row_id).encode()).decode().rstrip("=")
+
+def decode_page_cursor(page_cursor):
+    if page_cursor is None:
+        return 0
+    padded = page_cursor + "=" * (-len(page_cursor) % 4)
+    return int(base64.urlsafe_b64decode(padded.encode()).decode())
+
+def page_limit(limit):
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+# Rows were fetched with limit + 1 so we know whether another page exists
+def encode_page(rows, limit):
+    next_cursor = encode_page_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+    return json.dumps({"resources": [row[1] for row in rows[:limit]],
+                       "next_cursor": next_cursor})
+
+# Function to get one page of a course's resources, in upload order
+def get_course_resource_page(course_id, limit, page_cursor=None):
     try:
-        cursor.execute("SELECT DISTINCT course_id FROM courses")
-        courses = cursor.fetchall()
-        if not courses:
-            return "No courses available"
-        return "|".join([c[0] for c in courses])
+        limit = page_limit(limit)
+        after_id = decode_page_cursor(page_cursor)
+    except ValueError:
+        return "Error: Invalid page request!"
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(RESOURCE_PAGE_SQL, (course_id, after_id, limit + 1))
+            return encode_page(cursor.fetchall(), limit)
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+# Function to get one page of new resources. Its cursor wraps the log offset
+# to continue from; the subscription's offset is only committed once the
+# final page has been read.
+def get_new_resources_page(username, course_id, limit, page_cursor=None):
+    try:
+        limit = page_limit(limit)
+        offset = decode_page_cursor(page_cursor) if page_cursor is not None else None
+    except ValueError:
+        return "Error: Invalid page request!"
+    try:
+        if offset is None:
+            offset = subscription_offset(username, course_id)
+            if offset is None:
+                return json.dumps({"resources": [], "next_cursor": None})
+        try:
+            records, next_offset = event_log.read(course_id, offset, limit)
+        except ValueError:
+            return "Error: Invalid page request!"
+        more = next_offset < event_log.head(course_id)
+        if not more and (records or page_cursor is not None):
+            commit_offsets(username, [(course_id, next_offset)])
+        return json.dumps({"resources": [record["resource_url"] for record in records],
+                           "next_cursor": encode_page_cursor(next_offset) if more else None})
     except Exception as e:
         return f"Error: {str(e)}"
 
+# Streamed variants: generators yielding chunks of rows straight from the
+# SQLite cursor or the event log, so a large course is never held in memory
+# whole. The serving loop encodes and sends each chunk as it is produced.
+def stream_course_resources(course_id):
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.execute(COURSE_RESOURCES_SQL, (course_id,))
+            sent = False
+            while True:
+                rows = cursor.fetchmany(STREAM_CHUNK_ROWS)
+                if not rows:
+                    break
+                sent = True
+                yield [row[0] for row in rows]
+        if not sent:
+            yield "Error: No resources found for this course!"
+    except Exception as e:
+        yield f"Error: {str(e)}"
+
+def stream_new_resources(username, course_id):
+    try:
+        offset = subscription_offset(username, course_id)
+        sent = False
+        while offset is not None:
+            records, next_offset = event_log.read(course_id, offset, STREAM_CHUNK_ROWS)
+            if not records:
+                break
+            sent = True
+            yield [record["resource_url"] for record in records]
+            offset = next_offset
+        if sent:
+            commit_offsets(username, [(course_id, offset)])
+        else:
+            yield "No new resources"
+    except Exception as e:
+        yield f"Error: {str(e)}"
+
+# Function to get all courses
+def get_all_courses(wire_format="text"):
+    def produce():
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(ALL_COURSES_SQL)
+            courses = cursor.fetchall()
+        if not courses:
+            return "No courses available"
+        return [c[0] for c in courses]
+
+    return cached_result(ALL_COURSES_KEY, wire_format, produce)
+
 # Function to subscribe to a course
 def subscribe_to_course(username, course_id):
-    try:
+    def write(cursor):
         # Check if course exists
-        cursor.execute("SELECT 1 FROM courses WHERE course_id = ?", (course_id,))
+        cursor.execute(COURSE_EXISTS_SQL, (course_id,))
         if not cursor.fetchone():
-            return "Error: Course does not exist!"
-            
+            return False
+
+        # Log appends also happen on the writer thread, so the head read
+        # here is exactly what has been committed before this subscription
         cursor.execute("""
-            INSERT OR REPLACE INTO subscriptions (username, course_id, last_viewed) 
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-        """, (username, course_id))
-        conn.commit()
+            INSERT OR REPLACE INTO subscriptions (username, course_id, last_viewed, last_offset) 
+            VALUES (?, ?, CURRENT_TIMESTAMP, ?)
+        """, (username, course_id, event_log.head(course_id)))
+        return True
+
+    try:
+        if not db_writer.execute(write):
+            return "Error: Course does not exist!"
+        fanout_hub.add_course(username, course_id)
+        if broadcast_subscriptions:
+            try:
+                message_broker.publish(SUBSCRIPTION_TOPIC, json.dumps(
+                    {"username": username, "course_id": course_id}))
+            except Exception as e:
+                print(f"Error publishing subscription: {e}")
         return f"Successfully subscribed to course {course_id}"
     except Exception as e:
         return f"Error: {str(e)}"
 
 # Function to get subscribed courses
 def get_subscribed_courses(username):
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(SUBSCRIBED_COURSES_SQL, (username,))
+
+            courses = cursor.fetchall()
+            if not courses:
+                return "No subscribed courses"
+
+            return [course[0] for course in courses]
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+# Function to get everything the subscriptions window shows in one call:
+# each subscribed course with its new resources (log records after its
+# offset) and all of its resources; the offsets of courses that had
+# something new are then committed together
+def get_subscription_dashboard(username):
     try:
-        cursor.execute("""
-            SELECT course_id FROM subscriptions
-            WHERE username = ?
-        """, (username,))
-        
-        courses = cursor.fetchall()
-        if not courses:
+        with db_pool.connection() as conn:
+            rows = conn.execute(DASHBOARD_SQL, (username,)).fetchall()
+        if not rows:
             return "No subscribed courses"
-        
-        return "|".join([course[0] for course in courses])
+
+        dashboard = {}
+        seen = []
+        for course_id, offset, resource_url in rows:
+            course = dashboard.get(course_id)
+            if course is None:
+                offset = min(offset or 0, event_log.head(course_id))
+                records, head = event_log.read(course_id, offset)
+                course = dashboard[course_id] = {
+                    "course_id": course_id,
+                    "new_resources": [record["resource_url"] for record in records],
+                    "resources": []}
+                if records:
+                    seen.append((course_id, head))
+            if resource_url is not None:
+                course["resources"].append(resource_url)
+        if seen:
+            commit_offsets(username, seen)
+        return json.dumps({"courses": list(dashboard.values())})
     except Exception as e:
         return f"Error: {str(e)}"
 
-# Handle client requests
-def handle_client(client_socket):
-    request = client_socket.recv(1024).decode()
+def get_cache_stats():
+    return json.dumps(response_cache.stats())
+
+def get_stats():
+    return json.dumps(server_metrics.snapshot())
+
+# PROFILE <session> <seconds> [command]: sample handler stacks, of one command type or
+# all of them, for a fixed window
+def start_profile(username, seconds, command=None):
+    if profile_dir is None:
+        return "Error: Profiling is disabled (start the server with --profile-dir)"
+    try:
+        duration = float(seconds)
+    except ValueError:
+        return "Error: Invalid profile duration!"
+    if not 0 < duration <= MAX_PROFILE_SECONDS:
+        return f"Error: Profile duration must be at most {MAX_PROFILE_SECONDS} seconds"
+    if command is not None and command not in protocol.OPCODES:
+        return f"Error: Unknown command {command}"
+    suffix = f"-{command.lower()}" if command else ""
+    path = os.path.join(profile_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}{suffix}.folded")
+    if not command_profiler.start(duration, path, command):
+        return "Error: A profile is already running"
+    return f"Profiling {command or 'all commands'} for {duration:g}s into {path}"
+
+# Numbers other components already keep, read when metrics are collected
+def collect_server_stats():
+    cache_stats = response_cache.stats()
+    return {
+        "cache_hits_total": ("counter", "Response cache hits", cache_stats["hits"]),
+        "cache_misses_total": ("counter", "Response cache misses", cache_stats["misses"]),
+        "cache_bytes": ("gauge", "Bytes held by the response cache", cache_stats["bytes"]),
+        "db_connections_opened_total": ("counter", "SQLite connections opened",
+                                        db_pool.opened),
+        "db_commit_batches_total": ("counter", "Group-commit transactions", db_writer.batches),
+        "db_committed_writes_total": ("counter", "Writes committed", db_writer.committed),
+        "notifications_published_total": ("counter", "Messages sent to the broker",
+                                           publisher.published),
+        "notifications_merged_total": ("counter", "Notifications merged into another's message",
+                                       publisher.merged),
+        "notifications_dropped_total": ("counter", "Notifications dropped while the broker "
+                                        "was unavailable", publisher.dropped),
+        "publish_failures_total": ("counter", "Broker pipelines that failed",
+                                   publisher.failures),
+        "publish_buffered": ("gauge", "Notifications waiting to be sent", len(publisher)),
+        "push_listeners": ("gauge", "Connections in LISTEN mode",
+                           fanout_hub.listener_count()),
+        "sessions": ("gauge", "Live login sessions", len(session_table)),
+        "request_queue_depth": ("gauge", "Commands waiting for an admission worker",
+                                admission_control.queued),
+        "compression_ratio": ("gauge", "Reply bytes given to the compressor per byte sent",
+                              round(compress_input.value / compress_output.value, 2)
+                              if compress_output.value else 0),
+        "uptime_seconds": ("gauge", "Seconds since the server started",
+                           round(time.monotonic() - started_at, 1)),
+    }
+
+def listen_unsupported(*args):
+    return "Error: LISTEN needs a persistent (framed) connection"
+
+# LISTEN <token or username> turns a framed connection into a push channel
+# for the user's subscribed courses; returns the argument, or None for other
+# commands
+def parse_listen_request(payload):
+    if protocol.is_binary(payload):
+        try:
+            opcode, fields = protocol.decode_request(payload)
+        except protocol.ProtocolError:
+            return None
+        if opcode == protocol.OPCODES["LISTEN"] and len(fields) == 1:
+            return fields[0]
+        return None
+    try:
+        parts = payload.decode().split()
+    except UnicodeDecodeError:
+        return None
+    if len(parts) == 2 and parts[0] == "LISTEN":
+        return parts[1]
+    return None
+
+# Register a long-lived connection to receive pushes for the user's courses
+def register_listener(user, wakeup=None, on_disconnect=None):
+    username = authenticate(user)
+    if username is None:
+        raise PermissionError("Invalid or expired session")
+    # Registered before reading the subscriptions, so one committed in
+    # between still reaches it through add_course
+    subscriber = fanout.PushSubscriber(username, push_queue_size, slow_consumer_policy,
+                                       wakeup=wakeup, on_disconnect=on_disconnect)
+    fanout_hub.add_listener(subscriber, ())
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(SUBSCRIBED_COURSES_SQL, (username,))
+            course_ids = [row[0] for row in cursor.fetchall()]
+    except Exception:
+        fanout_hub.remove_listener(subscriber)
+        raise
+    for course_id in course_ids:
+        fanout_hub.add_course(username, course_id)
+    return subscriber
+
+# Command table keyed by protocol opcode; text requests are looked up by
+# verb through protocol.OPCODES. Extra arguments are ignored. Handlers with
+# `wire_format` set encode their own reply (they serve it from the cache).
+# `user_arg` is the position of the acting user, given as a session token
+# or (unless require_auth) an existing user's name; the handler receives
+# the username. With `roles` set, the argument must be the live session of
+# a user with one of those roles; a bare username is never enough.
+# `priority` is the admission class: logins, writes and LISTEN go ahead of
+# reads, and reads ahead of repeated polling for new resources.
+Command = namedtuple("Command", ["handler", "min_args", "max_args", "wire_format", "user_arg",
+                                 "priority", "roles"],
+                     defaults=(False, None, admission.NORMAL, None))
+CRITICAL, POLL = admission.CRITICAL, admission.POLL
+# Roles allowed to run the operator commands (PROFILE, REPLAY)
+OPERATOR_ROLES = ("instructor", "admin")
+
+COMMANDS = {
+    protocol.OPCODES["REGISTER"]: Command(register_user, 3, 4, priority=CRITICAL),
+    protocol.OPCODES["LOGIN"]: Command(login_user, 2, 2, priority=CRITICAL),
+    protocol.OPCODES["GET_COURSES"]: Command(get_all_courses, 0, 0, True),
+    protocol.OPCODES["GET_RESOURCES"]: Command(get_course_resource, 1, 1, True),
+    protocol.OPCODES["UPLOAD_RESOURCE"]: Command(upload_course_resources, 3, 3, user_arg=2,
+                                                 priority=CRITICAL),
+    protocol.OPCODES["SUBSCRIBE"]: Command(subscribe_to_course, 2, 2, user_arg=0,
+                                           priority=CRITICAL),
+    protocol.OPCODES["GET_SUBSCRIBED_COURSES"]: Command(get_subscribed_courses, 1, 1, user_arg=0),
+    protocol.OPCODES["GET_NEW_RESOURCES"]: Command(get_new_resources, 2, 2, user_arg=0,
+                                                   priority=POLL),
+    protocol.OPCODES["GET_DASHBOARD"]: Command(get_subscription_dashboard, 1, 1, user_arg=0),
+    protocol.OPCODES["LISTEN"]: Command(listen_unsupported, 0, 1, priority=CRITICAL),
+    protocol.OPCODES["GET_RESOURCES_PAGE"]: Command(get_course_resource_page, 2, 3),
+    protocol.OPCODES["GET_NEW_RESOURCES_PAGE"]: Command(get_new_resources_page, 3, 4, user_arg=0,
+                                                        priority=POLL),
+    protocol.OPCODES["STREAM_RESOURCES"]: Command(stream_course_resources, 1, 1),
+    protocol.OPCODES["STREAM_NEW_RESOURCES"]: Command(stream_new_resources, 2, 2, user_arg=0,
+                                                      priority=POLL),
+    protocol.OPCODES["CACHE_STATS"]: Command(get_cache_stats, 0, 0, priority=POLL),
+    protocol.OPCODES["STATS"]: Command(get_stats, 0, 0, priority=POLL),
+    protocol.OPCODES["PROFILE"]: Command(start_profile, 2, 3, user_arg=0, roles=OPERATOR_ROLES),
+    protocol.OPCODES["LOGOUT"]: Command(logout_user, 1, 1, priority=CRITICAL),
+    protocol.OPCODES["REPLAY"]: Command(replay_course_events, 2, 3, user_arg=0,
+                                        roles=OPERATOR_ROLES),
+    protocol.OPCODES["UPLOAD_RESOURCES_BATCH"]: Command(upload_resources_batch, 3, None, user_arg=0),
+}
+
+def run_command(opcode, args, wire_format):
+    command = COMMANDS.get(opcode)
+    if command is None:
+        command_errors.labels("INVALID").inc()
+        return "Invalid request!"
+    name = protocol.COMMAND_NAMES[opcode]
+    if len(args) < command.min_args:
+        command_errors.labels(name).inc()
+        return "Error: Missing arguments!"
+    args = list(args[:command.max_args])
+    if command.roles is not None:
+        session = privileged_session(args[command.user_arg], command.roles)
+        if session is None:
+            command_errors.labels(name).inc()
+            return "Error: Permission denied"
+        args[command.user_arg] = session.username
+    elif command.user_arg is not None:
+        username = authenticate(args[command.user_arg])
+        if username is None:
+            command_errors.labels(name).inc()
+            return "Error: Invalid or expired session"
+        args[command.user_arg] = username
+    requests_in_flight.inc()
+    start = time.perf_counter()
+    failed = True
+    profiling = command_profiler.running
+    if profiling:
+        command_profiler.enter(name)
+    try:
+        if command.wire_format:
+            result = command.handler(*args, wire_format=wire_format)
+        else:
+            result = command.handler(*args)
+        failed = False
+    finally:
+        if profiling:
+            command_profiler.leave()
+        if failed:
+            record_command(name, start, True)
+    if isinstance(result, GeneratorType):
+        return timed_stream(name, start, result)
+    if isinstance(result, Future):
+        return chain(result, lambda value: timed_reply(name, start, value),
+                     lambda e: timed_reply(name, start, f"Error: {str(e)}"))
+    record_command(name, start, is_error(result))
+    return result
+
+# A deferred reply (a Future) is timed until its value is ready
+def timed_reply(name, start, value):
+    record_command(name, start, is_error(value))
+    return value
+
+def record_command(name, start, error):
+    command_latency.labels(name).observe(time.perf_counter() - start)
+    if error:
+        command_errors.labels(name).inc()
+    requests_in_flight.dec()
+
+def is_error(result):
+    if isinstance(result, bytes):
+        status = result[1]
+    elif isinstance(result, str):
+        status = protocol.text_status(result)
+    else:
+        return False
+    return status in (protocol.STATUS_BAD_REQUEST, protocol.STATUS_ERROR)
+
+# A stream is timed from the command starting to its last chunk being sent.
+# Chunks are produced on whichever thread pulls them, so each one is
+# registered with the profiler separately.
+def timed_stream(name, start, chunks):
+    error = False
+    try:
+        with closing(chunks):
+            while True:
+                profiling = command_profiler.running
+                if profiling:
+                    command_profiler.enter(name)
+                try:
+                    chunk = next(chunks, None)
+                finally:
+                    if profiling:
+                        command_profiler.leave()
+                if chunk is None:
+                    break
+                error = error or is_error(chunk)
+                yield chunk
+    finally:
+        record_command(name, start, error)
+
+# Turn a handler result into a reply: text joins list rows with "|", binary
+# sends one field per row with a status code instead of a message to sniff.
+# Streams become generators of encoded chunks.
+def encode_result(result, wire_format):
+    if isinstance(result, GeneratorType):
+        return encode_stream(result, wire_format)
+    if isinstance(result, Future):
+        return chain(result, lambda value: encode_result(value, wire_format))
+    if wire_format == "binary":
+        if isinstance(result, bytes):
+            return result
+        if isinstance(result, list):
+            return protocol.encode_response(protocol.STATUS_OK, result)
+        return protocol.encode_response(protocol.text_status(result), [result])
+    return "|".join(result) if isinstance(result, list) else result
+
+def encode_stream(chunks, wire_format):
+    with closing(chunks):
+        for chunk in chunks:
+            yield encode_result(chunk, wire_format)
+
+# Parse a request line and run the matching command handler. The response
+# is a string, for STREAM_* commands a generator of string chunks, or for
+# commands that wait on another pool (LOGIN, REGISTER) a Future of a string.
+def dispatch_request(request):
     parts = request.split()
-    
-    if parts[0] == "REGISTER":
-        role, username, password = parts[1], parts[2], parts[3]
-        response = register_user(role, username, password)
-    elif parts[0] == "LOGIN":
-        username, password = parts[1], parts[2]
-        response = login_user(username, password)
-    elif parts[0] == "GET_COURSES":
-        response = get_all_courses()
-    elif parts[0] == "GET_RESOURCES":
-        course_id = parts[1]
-        response = get_course_resource(course_id)
-    elif parts[0] == "UPLOAD_RESOURCE":
-        course_id, resource_url, poster_username = parts[1], parts[2], parts[3]
-        response = upload_course_resources(course_id, resource_url, poster_username)
-    elif parts[0] == "SUBSCRIBE":
-        username, course_id = parts[1], parts[2]
-        response = subscribe_to_course(username, course_id)
-    elif parts[0] == "GET_SUBSCRIBED_COURSES":
-        username = parts[1]
-        response = get_subscribed_courses(username)
-    elif parts[0] == "GET_NEW_RESOURCES":
-        username, course_id = parts[1], parts[2]
-        response = get_new_resources(username, course_id)
+    if not parts:
+        return "Invalid request!"
+    opcode = protocol.OPCODES.get(parts[0])
+    return encode_result(run_command(opcode, parts[1:], "text"), "text")
+
+# Run one request, turning malformed commands into an error response
+def safe_dispatch(request):
+    try:
+        return dispatch_request(request)
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+# Binary counterpart of safe_dispatch: returns an encoded response, a
+# generator of them for STREAM_* commands, or a Future of one
+def dispatch_binary(payload):
+    try:
+        opcode, fields = protocol.decode_request(payload)
+        result = run_command(opcode, fields, "binary")
+    except protocol.ProtocolError:
+        result = "Invalid request!"
+    except Exception as e:
+        result = f"Error: {str(e)}"
+    return encode_result(result, "binary")
+
+# Run one framed request and return the reply in the request's own format
+def dispatch_payload(payload):
+    if protocol.is_binary(payload):
+        return dispatch_binary(payload)
+    try:
+        request = payload.decode()
+    except UnicodeDecodeError:
+        return protocol.NOT_UTF8
+    return safe_dispatch(request)
+
+# The text of a HELLO request, None for other payloads
+def parse_hello_request(payload):
+    if payload[:5] != b"HELLO" or payload.split(None, 1)[0] != b"HELLO":
+        return None
+    try:
+        return payload.decode()
+    except UnicodeDecodeError:
+        return None
+
+# HELLO lets a client check that binary payloads are understood here and
+# pick a compression. Returns the reply and the connection's Compressor
+# (None if it did not ask for one we have).
+def answer_hello(request):
+    version = protocol.negotiate_version(request)
+    if not version:
+        return "Error: No common protocol version", None
+    token, compressor = protocol.negotiate_compression(request, compressors)
+    return (f"HELLO {version} {token}" if token else f"HELLO {version}"), compressor
+
+# A reply payload as sent on a connection that negotiated `compressor`
+# (None if it did not), recording the bytes saved and the CPU time spent
+# so the threshold can be tuned
+def compress_payload(compressor, payload):
+    if compressor is None or not payload:
+        return payload
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if len(payload) < compressor.threshold:
+        compress_skipped.labels("small").inc()
+        return payload
+    start = time.perf_counter()
+    compressed = compressor.compress(payload)
+    compress_time.observe(time.perf_counter() - start)
+    compress_input.inc(len(payload))
+    compress_output.inc(len(compressed))
+    if compressed is payload:
+        compress_skipped.labels("no_gain").inc()
+    return compressed
+
+# Whether a framed request asks for a streamed reply, which ends with an
+# empty frame whatever it turns out to be
+def is_stream_request(payload):
+    if protocol.is_binary(payload):
+        name = protocol.COMMAND_NAMES.get(payload[1]) if len(payload) > 1 else None
     else:
-        response = "Invalid request!"
-    
-    client_socket.send(response.encode())
-    client_socket.close()
+        parts = payload.split(None, 1)
+        name = parts[0].decode(errors="replace") if parts else None
+    return name in protocol.STREAM_COMMANDS
 
-# Start Server
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server_socket.bind(("0.0.0.0", 5000))
-server_socket.listen(5)
-print("Server is running on port 5000...")
+def payload_format(payload):
+    return "binary" if protocol.is_binary(payload) else "text"
 
-while True:
+# Admission class and acting user of a request (a framed payload or a
+# one-shot text line). A session token counts as its user, so a user's
+# sessions share one rate limit.
+def request_identity(request):
     try:
-        client_sock, addr = server_socket.accept()
-        threading.Thread(target=handle_client, args=(client_sock,)).start()
+        if isinstance(request, bytes) and protocol.is_binary(request):
+            opcode, fields = protocol.decode_request(request)
+        else:
+            parts = (request.decode() if isinstance(request, bytes) else request).split()
+            if parts[:1] == ["HELLO"]:
+                return admission.CRITICAL, None
+            opcode, fields = (protocol.OPCODES.get(parts[0]), parts[1:]) if parts else (None, [])
+    except (protocol.ProtocolError, UnicodeDecodeError):
+        return admission.NORMAL, None
+    command = COMMANDS.get(opcode)
+    if command is None:
+        return admission.NORMAL, None
+    index = command.user_arg
+    if index is None:
+        index = RATE_LIMIT_ARGS.get(protocol.COMMAND_NAMES[opcode])
+    if index is None or index >= len(fields):
+        return command.priority, None
+    return command.priority, rate_limit_identity(fields[index])
+
+# Run fn(*args) for `request` on the admission control's workers. Returns a
+# Future of fn's result (waiting for it in turn if it is a Future), or of a
+# busy reply in the request's format if the request is shed. `backlog` is
+# the number of replies the connection has not written yet.
+def admit(request, client_ip, fn, *args, backlog=0):
+    wire_format = payload_format(request) if isinstance(request, bytes) else "text"
+
+    def busy(e):
+        if not isinstance(e, admission.Shed):
+            raise e
+        return encode_result(protocol.busy_text(e.retry_after), wire_format)
+
+    priority, username = request_identity(request)
+    try:
+        future = admission_control.submit(priority, client_ip, username, fn, *args,
+                                          backlog=backlog)
+    except admission.Shed as e:
+        future = Future()
+        future.set_result(busy(e))
+        return future
+    return chain(future, lambda value: value, busy)
+
+def record_shed(reason, priority):
+    requests_shed.labels(reason).inc()
+    requests_shed_by_class.labels(priority).inc()
+
+def peer_ip(client_socket):
+    try:
+        return client_socket.getpeername()[0]
+    except (OSError, IndexError):
+        return None
+
+# A connection over max_connections gets a busy reply and is closed at once
+def refuse_connection(client_socket):
+    record_shed("connections", "critical")
+    try:
+        client_socket.setblocking(False)
+        send_text(client_socket, protocol.busy_text(1))
+    except OSError:
+        pass
+    finally:
+        client_socket.close()
+
+# Handle client requests (threaded mode, one thread per connection).
+# A connection whose first byte is the frame magic stays open and may carry
+# many pipelined requests; anything else is a legacy one-shot text command.
+def handle_client(client_socket):
+    active_connections.inc()
+    try:
+        first = client_socket.recv(1, socket.MSG_PEEK)
+        if first and first[0] == protocol.FRAME_MAGIC:
+            handle_framed_client(client_socket)
+            return
+        request = client_socket.recv(1024)
+        bytes_received.inc(len(request))
+        try:
+            request = request.decode()
+        except UnicodeDecodeError:
+            send_text(client_socket, protocol.NOT_UTF8)
+            return
+        response = admit(request, peer_ip(client_socket), safe_dispatch, request).result()
+        if isinstance(response, str):
+            send_text(client_socket, response)
+        else:
+            # Streamed over a one-shot connection: chunks joined with "|"
+            # as they come, the end of the response is the socket closing
+            with closing(response):
+                for i, chunk in enumerate(response):
+                    send_text(client_socket, chunk if i == 0 else "|" + chunk)
+    except (ConnectionError, protocol.ProtocolError):
+        pass
+    finally:
+        active_connections.dec()
+        client_socket.close()
+
+def send_text(client_socket, text):
+    data = text.encode()
+    client_socket.sendall(data)
+    bytes_sent.inc(len(data))
+
+def handle_framed_client(client_socket):
+    client_ip = peer_ip(client_socket)
+    subscribers = []
+    compressor = None
+    # Replies are queued here and written by the connection's own thread,
+    # so a client that stops reading holds up that thread only
+    writer = protocol.FrameWriter(client_socket, send_buffer_bytes, compress_payload,
+                                  bytes_sent.inc)
+
+    # Drains the connection's push queue; a client that stops reading fills
+    # the writer's buffer, this waits, the push queue fills and the
+    # slow-consumer policy kicks in
+    def push_loop(subscriber):
+        while not subscriber.closed and writer.wait_for_room():
+            subscriber.wait()
+            for notification in subscriber.drain():
+                writer.send(protocol.PUSH_REQUEST_ID, json.dumps(notification), compressor)
+
+    # A streamed response is a run of frames with the same request id, ended
+    # by an empty frame; so is a single reply to a STREAM_* request
+    def send_response(request_id, response, stream=False):
+        if isinstance(response, (str, bytes)):
+            writer.send(request_id, response, compressor, ends_reply=not stream)
+            if stream:
+                writer.send(request_id, b"", ends_reply=True)
+        else:
+            writer.send_stream(request_id, response, compressor)
+
+    def run(request_id, payload):
+        nonlocal compressor
+        hello = parse_hello_request(payload)
+        if hello is not None:
+            # Set before the reply goes out, so a request the client pipelines
+            # behind the HELLO cannot be answered under the old setting; the
+            # reply itself goes out uncompressed
+            response, negotiated = answer_hello(hello)
+            compressor = negotiated
+            writer.send(request_id, response, ends_reply=True)
+            return
+        username = parse_listen_request(payload)
+        if username is None:
+            response = dispatch_payload(payload)
+        else:
+            try:
+                subscriber = register_listener(username, on_disconnect=writer.fail)
+                subscribers.append(subscriber)
+                threading.Thread(target=push_loop, args=(subscriber,), daemon=True).start()
+                response = "Listening for notifications"
+            except Exception as e:
+                response = f"Error: {str(e)}"
+            response = encode_result(response, payload_format(payload))
+        stream = is_stream_request(payload)
+        if isinstance(response, Future):
+            # Queuing never blocks, so the thread completing the Future (a
+            # hash worker or the commit writer) can hand the reply over
+            response.add_done_callback(
+                lambda f: send_response(request_id, f.result(), stream))
+        else:
+            send_response(request_id, response, stream)
+
+    # run() sends its own reply; a request shed before it ran gets a busy one
+    def reply_if_shed(request_id, payload, future):
+        value, error = outcome(future)
+        if value is not None:
+            send_response(request_id, value, is_stream_request(payload))
+
+    # Requests run concurrently, so responses may go out of order; the
+    # request id in each frame lets the client match them up
+    try:
+        while True:
+            frame = protocol.read_frame(client_socket)
+            if frame is None:
+                break
+            bytes_received.inc(protocol.FRAME_HEADER.size + len(frame[1]))
+            frame = frame[0], protocol.decompress_payload(compressor, frame[1])
+            backlog = writer.unsent
+            writer.expect()
+            future = admit(frame[1], client_ip, run, *frame, backlog=backlog)
+            future.add_done_callback(
+                lambda f, request_id=frame[0], payload=frame[1]: reply_if_shed(request_id, payload, f))
+    finally:
+        for subscriber in subscribers:
+            fanout_hub.remove_listener(subscriber)
+        # Whatever the client is still owed goes out before the socket closes
+        writer.close(REPLY_DRAIN_SECONDS)
+
+# Handle client requests (async mode, all connections on one event loop)
+async def handle_client_async(reader, writer):
+    if active_connections.value >= max_connections:
+        record_shed("connections", "critical")
+        writer.write(protocol.busy_text(1).encode())
+        writer.close()
+        return
+    client_ip = (writer.get_extra_info("peername") or (None,))[0]
+    active_connections.inc()
+    try:
+        first = await reader.read(1)
+        if first and first[0] == protocol.FRAME_MAGIC:
+            await handle_framed_client_async(reader, writer, first, client_ip)
+            return
+        request = first + await reader.read(1023)
+        bytes_received.inc(len(request))
+        try:
+            request = request.decode()
+        except UnicodeDecodeError:
+            write_counted(writer, protocol.NOT_UTF8.encode())
+            await writer.drain()
+            return
+        # SQLite calls block, so the handler runs on an admission worker
+        response = await asyncio.wrap_future(
+            admit(request, client_ip, safe_dispatch, request))
+        if isinstance(response, str):
+            write_counted(writer, response.encode())
+        else:
+            first_chunk = True
+            async for chunk in iterate_in_executor(response):
+                write_counted(writer, (chunk if first_chunk else "|" + chunk).encode())
+                first_chunk = False
+                await writer.drain()
+        await writer.drain()
+    except (ConnectionError, protocol.ProtocolError):
+        pass
+    finally:
+        active_connections.dec()
+        writer.close()
+
+def write_counted(writer, data):
+    writer.write(data)
+    bytes_sent.inc(len(data))
+
+# Pull chunks from a streamed response; each next() may hit SQLite, so it
+# runs on the db executor rather than the event loop
+async def iterate_in_executor(response):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(db_executor, next, response, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        response.close()
+
+async def handle_framed_client_async(reader, writer, prefix, client_ip):
+    loop = asyncio.get_running_loop()
+    in_flight = set()
+    subscribers = []
+    compressor = None
+    pending = 0     # replies not written yet
+
+    # Compressing a large reply takes a while, so it runs off the event loop
+    async def compressed(payload):
+        if compressor is not None and len(payload) >= compressor.threshold:
+            return await loop.run_in_executor(db_executor, compress_payload, compressor, payload)
+        return compress_payload(compressor, payload)
+
+    # Notifications arrive on the listener thread, so hand them to the loop
+    async def push_loop(subscriber, ready):
+        try:
+            while not subscriber.closed:
+                await ready.wait()
+                ready.clear()
+                for notification in subscriber.drain():
+                    payload = compress_payload(compressor, json.dumps(notification))
+                    write_counted(writer, protocol.encode_frame(protocol.PUSH_REQUEST_ID, payload))
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    def listen(username):
+        ready = asyncio.Event()
+        subscriber = register_listener(
+            username,
+            wakeup=lambda: loop.call_soon_threadsafe(ready.set),
+            on_disconnect=lambda: loop.call_soon_threadsafe(writer.transport.abort))
+        subscribers.append(subscriber)
+        return subscriber, ready
+
+    async def run(request_id, payload, backlog):
+        nonlocal pending
+        try:
+            await reply(request_id, payload, backlog)
+        finally:
+            pending -= 1
+
+    async def reply(request_id, payload, backlog):
+        nonlocal compressor
+        hello = parse_hello_request(payload)
+        if hello is not None:
+            response, negotiated = answer_hello(hello)
+            compressor = negotiated
+            write_counted(writer, protocol.encode_frame(request_id, response))
+            await writer.drain()
+            return
+        username = parse_listen_request(payload)
+        if username is None:
+            response = admit(payload, client_ip, dispatch_payload, payload, backlog=backlog)
+        else:
+            try:
+                subscriber, ready = await loop.run_in_executor(db_executor, listen, username)
+                task = asyncio.ensure_future(push_loop(subscriber, ready))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                response = "Listening for notifications"
+            except Exception as e:
+                response = f"Error: {str(e)}"
+            response = encode_result(response, payload_format(payload))
+        if isinstance(response, Future):
+            response = await asyncio.wrap_future(response)
+        if isinstance(response, (str, bytes)):
+            write_counted(writer, protocol.encode_frame(request_id, await compressed(response)))
+            if is_stream_request(payload):
+                write_counted(writer, protocol.encode_frame(request_id, b""))
+        else:
+            async for chunk in iterate_in_executor(response):
+                write_counted(writer, protocol.encode_frame(request_id, await compressed(chunk)))
+                await writer.drain()
+            write_counted(writer, protocol.encode_frame(request_id, b""))
+        await writer.drain()
+
+    try:
+        while True:
+            frame = await protocol.read_frame_async(reader, prefix)
+            prefix = b""
+            if frame is None:
+                break
+            bytes_received.inc(protocol.FRAME_HEADER.size + len(frame[1]))
+            # Replies (busy ones included) pile up in the transport for a
+            # client that does not read them; past the limit it is dropped
+            if writer.transport.get_write_buffer_size() > send_buffer_bytes:
+                writer.transport.abort()
+                break
+            frame = frame[0], protocol.decompress_payload(compressor, frame[1])
+            task = asyncio.ensure_future(run(*frame, pending))
+            pending += 1
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+    finally:
+        # Closing the subscribers wakes their push loops so they finish
+        for subscriber in subscribers:
+            fanout_hub.remove_listener(subscriber)
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+# Legacy serving mode: accept loop that starts a thread per connection
+def serve_threaded(host, port, backlog, reuse_port=False):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind((host, port))
+    server_socket.listen(backlog)
+    print(f"Server is running on port {port} (threaded mode)...")
+
+    while True:
+        try:
+            client_sock, addr = server_socket.accept()
+            if active_connections.value >= max_connections:
+                refuse_connection(client_sock)
+                continue
+            threading.Thread(target=handle_client, args=(client_sock,), daemon=True).start()
+        except KeyboardInterrupt:
+            print("Shutting down server...")
+            break
+    server_socket.close()
+
+# Async serving mode: one event loop handles every connection. A worker
+# stops on SIGTERM: it closes the listening socket, then lets the requests
+# in flight finish.
+async def serve_async(host, port, backlog, reuse_port=False, drain_timeout=None):
+    server = await asyncio.start_server(handle_client_async, host, port, backlog=backlog,
+                                        reuse_address=True, reuse_port=reuse_port or None)
+    print(f"Server is running on port {port} (async mode)...")
+    async with server:
+        if not reuse_port:
+            await server.serve_forever()
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        await stop.wait()
+    print("Shutting down server...")
+    await asyncio.to_thread(wait_for_requests, drain_timeout)
+
+# Wait up to `timeout` seconds for the commands being handled to finish
+def wait_for_requests(timeout):
+    deadline = time.monotonic() + timeout
+    while requests_in_flight.value > 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if requests_in_flight.value > 0:
+        print(f"Gave up waiting for {requests_in_flight.value} requests")
+
+# Start `args.workers` server processes sharing the port through
+# SO_REUSEPORT, so the kernel spreads connections over them and each runs on
+# its own core. Each worker has its own SQLite pool, event log handles,
+# broker connection and caches. A worker that dies is restarted; on SIGTERM
+# or Ctrl-C the workers are told to drain and given --drain-timeout to exit.
+def supervise(args):
+    workers = {}    # pid -> (index, start time)
+
+    def spawn(index):
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(args, index)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        workers[pid] = (index, time.monotonic())
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for index in range(args.workers):
+            spawn(index)
+        print(f"Supervisor {os.getpid()} started {args.workers} workers")
+        while True:
+            pid, status = os.wait()
+            index, started = workers.pop(pid)
+            print(f"Worker {index} (pid {pid}) exited with status "
+                  f"{os.waitstatus_to_exitcode(status)}, restarting")
+            # Do not spin on a worker that dies as soon as it starts
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+            spawn(index)
+    except KeyboardInterrupt:
+        print("Shutting down workers...")
+
+    for pid in workers:
+        os.kill(pid, signal.SIGTERM)
+    deadline = time.monotonic() + args.drain_timeout + 5
+    while workers and time.monotonic() < deadline:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            time.sleep(0.1)
+        else:
+            workers.pop(pid, None)
+    for pid in workers:
+        print(f"Killing worker pid {pid}")
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+def run_worker(args, index):
+    global started_at
+    # Ctrl-C reaches the whole process group; only the supervisor acts on it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    started_at = time.monotonic()
+    open_db(args.db, args.event_log_dir, synchronous=args.db_synchronous,
+            cache_size_mb=args.db_cache_mb, mmap_size_mb=args.db_mmap_mb)
+    serve(args, index)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="LMS pub/sub server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--mode", choices=["threaded", "async"], default="threaded",
+                        help="threaded: one thread per connection (legacy), "
+                             "async: asyncio event loop")
+    parser.add_argument("--backlog", type=int, default=128,
+                        help="listen() backlog for the server socket")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="server processes sharing the port via SO_REUSEPORT, "
+                             "restarted by a supervisor if they die")
+    parser.add_argument("--drain-timeout", type=float, default=10,
+                        help="seconds to let requests in flight finish on shutdown")
+    parser.add_argument("--db", default=db.DB_PATH, help="SQLite database file")
+    parser.add_argument("--event-log-dir",
+                        help="directory of the per-course event logs (default: <db>.events)")
+    parser.add_argument("--db-synchronous", choices=["OFF", "NORMAL", "FULL"], default="FULL",
+                        help="SQLite synchronous pragma. FULL syncs each group commit before "
+                             "acknowledging it; NORMAL is faster, but a power loss may undo "
+                             "the last acknowledged writes")
+    parser.add_argument("--db-cache-mb", type=int, default=16,
+                        help="SQLite page cache per connection")
+    parser.add_argument("--db-mmap-mb", type=int, default=256,
+                        help="SQLite memory-mapped I/O size per connection")
+    parser.add_argument("--commit-window-ms", type=float, default=2,
+                        help="how long the writer waits to group more writes into one commit")
+    parser.add_argument("--commit-batch-size", type=int, default=256,
+                        help="most writes committed in one transaction")
+    parser.add_argument("--db-workers", type=int, default=8,
+                        help="size of the executor pulling streamed responses and "
+                             "sending deferred replies")
+    parser.add_argument("--request-workers", type=int, default=8,
+                        help="threads running admitted commands")
+    parser.add_argument("--request-queue", type=int, default=256,
+                        help="commands that may wait for a worker; past this, less "
+                             "important ones are shed with a busy reply")
+    parser.add_argument("--queue-timeout", type=float, default=5,
+                        help="shed commands that waited this many seconds for a worker "
+                             "(0 to wait indefinitely)")
+    parser.add_argument("--max-pipelined", type=int, default=64,
+                        help="replies a framed connection may have outstanding (queued, "
+                             "running or unsent); past this its requests are shed "
+                             "(0 for no limit)")
+    parser.add_argument("--send-buffer-kb", type=int, default=protocol.MAX_BUFFERED // 1024,
+                        help="reply data queued per framed connection for a client that "
+                             "is not reading it; past this the connection is dropped")
+    parser.add_argument("--max-connections", type=int, default=1024,
+                        help="open client connections; more are answered busy and closed")
+    parser.add_argument("--ip-rate", type=float, default=0,
+                        help="commands per second allowed per client IP (0 for no limit; "
+                             "leave off behind the router, which is one client)")
+    parser.add_argument("--ip-burst", type=int, default=20,
+                        help="commands a client IP may send at once above --ip-rate")
+    parser.add_argument("--user-rate", type=float, default=0,
+                        help="commands per second allowed per user (0 for no limit)")
+    parser.add_argument("--user-burst", type=int, default=10,
+                        help="commands a user may send at once above --user-rate")
+    parser.add_argument("--broker", choices=broker.BROKERS, default="redis",
+                        help="redis: publish through a Redis server, "
+                             "inprocess: in-memory broker for single-box deployments")
+    parser.add_argument("--redis-host", default="localhost")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--publish-window-ms", type=float, default=5,
+                        help="merge a course's notifications published within this "
+                             "many ms of its first into one message (0 to merge only "
+                             "those that queue up while the broker is busy)")
+    parser.add_argument("--publish-buffer", type=int, default=10000,
+                        help="notifications held while the broker is unavailable; "
+                             "past this the oldest are dropped")
+    parser.add_argument("--push-queue-size", type=int, default=100,
+                        help="notifications buffered per listening connection")
+    parser.add_argument("--slow-consumer-policy", choices=fanout.SLOW_CONSUMER_POLICIES,
+                        default="coalesce",
+                        help="what to do when a listening client's queue is full")
+    parser.add_argument("--compress-threshold", type=int, default=1024,
+                        help="compress replies of at least this many bytes on connections "
+                             "that negotiate it (0 turns compression off)")
+    parser.add_argument("--compress-level", type=int, default=6, choices=range(1, 10),
+                        metavar="1-9", help="zlib level for compressed replies")
+    parser.add_argument("--zdict",
+                        help="shared compression dictionary offered to clients that have "
+                             "the same file (see --train-zdict)")
+    parser.add_argument("--train-zdict", metavar="PATH",
+                        help="write a compression dictionary built from the database's "
+                             "resource URLs to PATH, and exit")
+    parser.add_argument("--add-user", nargs=2, metavar=("ROLE", "USERNAME"),
+                        help="create an account with any role (e.g. the first admin), "
+                             "reading its password from the terminal or stdin, and exit")
+    parser.add_argument("--check-query-plans", action="store_true",
+                        help="migrate the database, report hot queries that scan "
+                             "whole tables, and exit")
+    parser.add_argument("--cache-mb", type=float, default=64,
+                        help="size of the GET_COURSES/GET_RESOURCES response cache (0 disables)")
+    parser.add_argument("--cache-ttl", type=float, default=300,
+                        help="seconds a cached response may live without an invalidation")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="serve Prometheus metrics over HTTP at /metrics on this port")
+    parser.add_argument("--metrics-file",
+                        help="periodically write Prometheus metrics to this file")
+    parser.add_argument("--metrics-interval", type=float, default=10,
+                        help="seconds between --metrics-file writes")
+    parser.add_argument("--session-ttl", type=float, default=3600,
+                        help="seconds an idle login session stays valid")
+    parser.add_argument("--cluster-secret",
+                        help="sign session tokens with this key, shared by the nodes of "
+                             "a sharded cluster (router.py) so any of them accepts them")
+    parser.add_argument("--require-auth", action="store_true",
+                        help="only accept session tokens, not bare usernames, for "
+                             "commands acting as a user")
+    parser.add_argument("--hash-workers", type=int, default=os.cpu_count() or 2,
+                        help="threads hashing passwords for LOGIN and REGISTER")
+    parser.add_argument("--password-iterations", type=int, default=auth.HASH_ITERATIONS,
+                        help="PBKDF2 iterations for new password hashes")
+    parser.add_argument("--profile-dir",
+                        help="enable the PROFILE command, writing collapsed-stack "
+                             "files into this directory")
+    parser.add_argument("--profile-interval-ms", type=float, default=5,
+                        help="sampling interval of PROFILE")
+    args = parser.parse_args(argv)
+    if args.workers > 1 and args.broker == "inprocess":
+        parser.error("--workers needs a broker shared by the processes (--broker redis)")
+    if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("--workers needs SO_REUSEPORT, which this platform lacks")
+    return args
+
+def main(argv=None):
+    global push_queue_size, slow_consumer_policy, compressors
+    global profile_dir, require_auth, password_iterations, max_connections, send_buffer_bytes
+    args = parse_args(argv)
+    response_cache.max_bytes = int(args.cache_mb * 1024 * 1024)
+    response_cache.ttl = args.cache_ttl
+    push_queue_size = args.push_queue_size
+    slow_consumer_policy = args.slow_consumer_policy
+    profile_dir = args.profile_dir
+    session_table.ttl = args.session_ttl
+    if args.cluster_secret:
+        session_table.secret = args.cluster_secret.encode()
+    require_auth = args.require_auth
+    password_iterations = args.password_iterations
+    command_profiler.interval = args.profile_interval_ms / 1000
+    max_connections = args.max_connections
+    send_buffer_bytes = args.send_buffer_kb * 1024
+    if args.compress_threshold:
+        compressors = protocol.make_compressors(read_zdict(args.zdict), args.compress_level,
+                                                args.compress_threshold)
+
+    init_db(args.db, args.event_log_dir, synchronous=args.db_synchronous,
+            cache_size_mb=args.db_cache_mb, mmap_size_mb=args.db_mmap_mb)
+    if args.train_zdict:
+        train_zdict(args.train_zdict)
+        sys.exit(0)
+    if args.add_user:
+        result = add_user(*args.add_user)
+        print(result)
+        sys.exit(1 if result.startswith("Error") else 0)
+    if args.check_query_plans:
+        problems = check_query_plans()
+        for problem in problems:
+            print(problem)
+        print("Query plans OK" if not problems else f"{len(problems)} full table scans")
+        sys.exit(1 if problems else 0)
+
+    if args.workers > 1:
+        # Workers sign session tokens with a key they share, so a login on
+        # one is accepted by the others
+        if session_table.secret is None:
+            session_table.secret = os.urandom(32)
+        # Each worker opens its own; nothing is shared across the fork
+        event_log.close()
+        db_pool.close_all()
+        supervise(args)
+    else:
+        serve(args)
+
+# Run the server in this process until interrupted; `worker` is the index
+# of a --workers process
+def serve(args, worker=None):
+    global db_executor, db_writer, message_broker, publisher, hash_executor, admission_control
+    global broadcast_subscriptions
+    message_broker = broker.create_broker(args.broker, args.redis_host, args.redis_port)
+    publisher = broker.CoalescingPublisher(message_broker, args.publish_window_ms,
+                                           args.publish_buffer, merge_course_notifications,
+                                           publish_timer=publish_time)
+    db_writer = db.GroupCommitWriter(db_pool, publisher, args.commit_window_ms,
+                                     args.commit_batch_size, commit_timer=commit_time)
+    server_metrics.add_collector(collect_server_stats)
+    # Workers export on consecutive ports / into one file each
+    if args.metrics_port:
+        metrics.serve_http(server_metrics, args.host, args.metrics_port + (worker or 0))
+    if args.metrics_file:
+        metrics_file = args.metrics_file
+        if worker is not None:
+            root, ext = os.path.splitext(metrics_file)
+            metrics_file = f"{root}-{worker}{ext}"
+        threading.Thread(target=metrics.dump_periodically,
+                         args=(server_metrics, metrics_file, args.metrics_interval),
+                         daemon=True).start()
+    db_executor = ThreadPoolExecutor(max_workers=args.db_workers,
+                                     thread_name_prefix="db")
+    hash_executor = ThreadPoolExecutor(max_workers=args.hash_workers,
+                                       thread_name_prefix="hash")
+    admission_control = admission.AdmissionControl(
+        args.request_workers, args.request_queue, args.queue_timeout,
+        args.ip_rate, args.ip_burst, args.user_rate, args.user_burst,
+        max_pipelined=args.max_pipelined, on_shed=record_shed)
+    # One PSUBSCRIBE course:* for the whole server, fanned out to LISTEN clients
+    threading.Thread(target=fanout.run_listener, args=(message_broker, fanout_hub),
+                     daemon=True).start()
+    threading.Thread(target=broker.consume,
+                     args=(message_broker, "course:*", handle_course_event, "Cache invalidator"),
+                     daemon=True).start()
+    if session_table.secret is not None:
+        threading.Thread(target=broker.consume,
+                         args=(message_broker, SESSION_REVOKED_TOPIC, handle_session_event,
+                               "Session revoker"),
+                         daemon=True).start()
+    if worker is not None:
+        broadcast_subscriptions = True
+        threading.Thread(target=broker.consume,
+                         args=(message_broker, SUBSCRIPTION_TOPIC, handle_subscription_event,
+                               "Subscription listener"),
+                         daemon=True).start()
+
+    reuse_port = worker is not None
+    try:
+        if args.mode == "async":
+            asyncio.run(serve_async(args.host, args.port, args.backlog, reuse_port,
+                                    args.drain_timeout))
+        else:
+            serve_threaded(args.host, args.port, args.backlog, reuse_port)
     except KeyboardInterrupt:
         print("Shutting down server...")
-        break
\ No newline at end of file
+    finally:
+        wait_for_requests(args.drain_timeout)
+        admission_control.shutdown()
+        db_executor.shutdown(wait=False)
+        hash_executor.shutdown(wait=False)
+        db_writer.close()
+        publisher.close()
+        event_log.close()
+        db_pool.close_all()
+
+if __name__ == "__main__":
+    main()
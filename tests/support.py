@@ -0,0 +1,62 @@
+import os
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import auth
+import broker
+import cache
+import db
+import server
+
+PASSWORD_ITERATIONS = 1000
+
+
+# server.py's module state (database, writer, broker, executors, sessions,
+# response cache)
+# on a temporary database, for tests that run commands without a socket
+class ServerState:
+    def __init__(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        server.init_db(os.path.join(self.tmp.name, "lms.db"))
+        server.message_broker = broker.create_broker("inprocess")
+        server.publisher = broker.CoalescingPublisher(server.message_broker, 0,
+                                                      merge=server.merge_course_notifications)
+        server.db_writer = db.GroupCommitWriter(server.db_pool, server.publisher)
+        server.hash_executor = ThreadPoolExecutor(max_workers=2)
+        server.password_iterations = PASSWORD_ITERATIONS
+        server.session_table = auth.SessionTable()
+        server.known_users.clear()
+        server.response_cache = cache.ResponseCache()
+        server.require_auth = False
+        server.profile_dir = None
+
+    # The text reply to one request line, waiting for deferred replies
+    def run(self, request):
+        reply = server.dispatch_request(request)
+        if isinstance(reply, Future):
+            reply = reply.result(10)
+        return reply
+
+    # Register (through --add-user for roles REGISTER refuses) and log in;
+    # returns the session token
+    def login(self, role, username, password="pw"):
+        if role == "student":
+            assert self.run(f"REGISTER student {username} {password}") == "Registration Successful"
+        else:
+            hashed = auth.hash_password(password, PASSWORD_ITERATIONS)
+            with server.db_pool.connection() as conn:
+                conn.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                             (username, hashed, role))
+                conn.commit()
+        reply = self.run(f"LOGIN {username} {password}")
+        assert reply.startswith("Login successful"), reply
+        return reply.split()[3]
+
+    def close(self):
+        server.hash_executor.shutdown()
+        server.db_writer.close()
+        server.publisher.close()
+        server.event_log.close()
+        server.db_pool.close_all()
+        server.db_pool = server.event_log = server.db_writer = None
+        self.tmp.cleanup()
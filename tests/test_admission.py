@@ -0,0 +1,96 @@
+import socket
+import threading
+import unittest
+
+import admission
+import protocol
+import server
+from admission import TokenBuckets
+from support import ServerState
+
+
+class TokenBucketsTest(unittest.TestCase):
+    def test_disabled_without_a_rate_or_key(self):
+        buckets = TokenBuckets(rate=0, burst=1)
+        self.assertEqual([buckets.take("a") for _ in range(5)], [0] * 5)
+        self.assertEqual(TokenBuckets(rate=1, burst=1).take(None), 0)
+
+    def test_burst_then_wait(self):
+        buckets = TokenBuckets(rate=2, burst=3)
+        self.assertEqual([buckets.take("a") for _ in range(3)], [0, 0, 0])
+        wait = buckets.take("a")
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.5)
+        # Other keys have buckets of their own
+        self.assertEqual(buckets.take("b"), 0)
+
+    def test_refills_over_time(self):
+        buckets = TokenBuckets(rate=2, burst=3)
+        for _ in range(3):
+            buckets.take("a")
+        self.assertGreater(buckets.take("a"), 0)
+        # A second later two tokens are back, not more than the burst
+        buckets.buckets["a"][1] -= 1.0
+        self.assertEqual([buckets.take("a") for _ in range(2)], [0, 0])
+        self.assertGreater(buckets.take("a"), 0)
+        buckets.buckets["a"][1] -= 60.0
+        self.assertEqual([buckets.take("a") for _ in range(3)], [0, 0, 0])
+        self.assertGreater(buckets.take("a"), 0)
+
+    def test_key_count_is_bounded(self):
+        buckets = TokenBuckets(rate=1, burst=5, max_keys=100)
+        for i in range(1000):
+            buckets.take(f"ip{i}")
+        self.assertLessEqual(len(buckets), 100)
+
+
+class ConnectionBacklogTest(unittest.TestCase):
+    def setUp(self):
+        self.sheds = []
+        self.control = admission.AdmissionControl(
+            workers=1, max_pipelined=4, on_shed=lambda *shed: self.sheds.append(shed))
+        self.addCleanup(self.control.shutdown)
+        # The only worker is busy until release is set
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.control.submit(admission.CRITICAL, None, None, self.release.wait)
+
+    def test_shed_past_max_pipelined(self):
+        future = self.control.submit(admission.NORMAL, None, None, lambda: "ok", backlog=3)
+        with self.assertRaises(admission.Shed) as shed:
+            self.control.submit(admission.CRITICAL, None, None, lambda: "ok", backlog=4)
+        self.assertEqual(shed.exception.reason, "connection_backlog")
+        self.assertEqual(self.sheds, [("connection_backlog", "critical")])
+        self.release.set()
+        self.assertEqual(future.result(5), "ok")
+
+    # A client that pipelines requests gets busy replies for those past the
+    # limit at once, though the workers are all busy
+    def test_server_sheds_a_pipelining_connection(self):
+        state = ServerState()
+        self.addCleanup(state.close)
+        server.admission_control = self.control
+        self.addCleanup(setattr, server, "admission_control", None)
+        ours, peer = socket.socketpair()
+        self.addCleanup(peer.close)
+
+        def serve():
+            with ours:
+                server.handle_framed_client(ours)
+        threading.Thread(target=serve, daemon=True).start()
+        for request_id in range(1, 11):
+            peer.sendall(protocol.encode_frame(request_id, b"GET_COURSES"))
+        peer.settimeout(5)
+        busy = [protocol.read_frame(peer) for _ in range(6)]
+        self.assertEqual(sorted(request_id for request_id, _ in busy), list(range(5, 11)))
+        self.assertTrue(all(protocol.busy_retry_after(reply.decode()) for _, reply in busy))
+        self.release.set()
+        replies = [protocol.read_frame(peer) for _ in range(4)]
+        self.assertEqual(sorted(request_id for request_id, _ in replies), [1, 2, 3, 4])
+        self.assertEqual({reply for _, reply in replies}, {b"No courses available"})
+        peer.shutdown(socket.SHUT_WR)
+        self.assertIsNone(protocol.read_frame(peer))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import threading
+import unittest
+
+from broker import RingBuffer
+
+
+class RingBufferTest(unittest.TestCase):
+    def test_items_come_out_in_order(self):
+        ring = RingBuffer(capacity=8)
+        for i in range(5):
+            ring.put(i)
+        self.assertEqual([ring.get(timeout=0) for _ in range(5)], [0, 1, 2, 3, 4])
+        self.assertIsNone(ring.get(timeout=0))
+
+    def test_lapped_reader_skips_to_the_oldest_surviving_item(self):
+        ring = RingBuffer(capacity=4)
+        for i in range(10):
+            ring.put(i)
+        self.assertEqual([ring.get(timeout=0) for _ in range(4)], [6, 7, 8, 9])
+        self.assertEqual(ring.overruns, 6)
+        self.assertIsNone(ring.get(timeout=0))
+
+    def test_get_waits_for_a_put(self):
+        ring = RingBuffer(capacity=4)
+        timer = threading.Timer(0.05, ring.put, args=("late",))
+        timer.start()
+        try:
+            self.assertEqual(ring.get(timeout=5), "late")
+        finally:
+            timer.cancel()
+
+
+if __name__ == "__main__":
+    unittest.main()
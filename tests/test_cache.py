@@ -0,0 +1,136 @@
+import threading
+import time
+import unittest
+
+import server
+from cache import ResponseCache
+from support import ServerState
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = ResponseCache()
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", "x|y", cache.generation)
+        self.assertEqual(cache.get("a"), "x|y")
+        self.assertEqual(cache.peek("a"), "x|y")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_ratio"]), (1, 1, 0.5))
+        self.assertEqual((stats["entries"], stats["bytes"]), (1, 3))
+
+    def test_least_recently_used_entries_go_first(self):
+        cache = ResponseCache(max_bytes=10)
+        for key in "abc":
+            cache.put(key, b"123", cache.generation)
+        cache.get("a")
+        cache.put("d", b"123", cache.generation)
+        self.assertEqual(list(cache.entries), ["c", "a", "d"])
+        self.assertEqual(cache.size, 9)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        # Replacing an entry does not count its old size twice
+        cache.put("d", b"1234", cache.generation)
+        self.assertEqual(cache.size, 10)
+        # Nor is a value larger than the whole cache stored
+        cache.put("e", b"x" * 11, cache.generation)
+        self.assertIsNone(cache.peek("e"))
+
+    def test_entries_expire(self):
+        cache = ResponseCache(ttl=60)
+        cache.put("a", "x", cache.generation)
+        value, size, expires_at = cache.entries["a"]
+        cache.entries["a"] = (value, size, time.monotonic() - 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.size, 0)
+
+    def test_invalidate_and_clear(self):
+        cache = ResponseCache()
+        cache.put("a", "x", cache.generation)
+        cache.put("b", "y", cache.generation)
+        cache.invalidate("a")
+        cache.invalidate("missing")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), "y")
+        self.assertEqual(cache.stats()["invalidations"], 1)
+        cache.clear()
+        self.assertEqual((len(cache.entries), cache.size), (0, 0))
+
+    def test_fill_from_before_an_invalidation_is_not_stored(self):
+        cache = ResponseCache()
+        generation = cache.generation
+        cache.invalidate("a")
+        cache.put("a", "old", generation)
+        self.assertIsNone(cache.peek("a"))
+        cache.put("a", "new", cache.generation)
+        self.assertEqual(cache.peek("a"), "new")
+
+
+class ServerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.state = ServerState()
+        self.addCleanup(self.state.close)
+        self.instructor = self.state.login("instructor", "i")
+
+    def upload(self, course_id, url):
+        reply = self.state.run(f"UPLOAD_RESOURCE {course_id} {url} {self.instructor}")
+        self.assertEqual(reply, "Resource Added Successfully")
+
+    def test_listings_are_cached_per_wire_format(self):
+        self.upload("c1", "u1")
+        self.assertEqual(self.state.run("GET_RESOURCES c1"), "u1")
+        self.assertEqual(self.state.run("GET_RESOURCES c1"), "u1")
+        self.assertEqual(server.response_cache.peek(("GET_RESOURCES", "c1", "text")), "u1")
+        self.assertIsNone(server.response_cache.peek(("GET_RESOURCES", "c1", "binary")))
+        self.assertEqual(server.response_cache.stats()["hits"], 1)
+
+    def test_uploads_invalidate_their_course(self):
+        self.upload("c1", "u1")
+        self.upload("c2", "v1")
+        self.assertEqual(self.state.run("GET_COURSES"), "c1|c2")
+        self.assertEqual(self.state.run("GET_RESOURCES c1"), "u1")
+        self.assertEqual(self.state.run("GET_RESOURCES c2"), "v1")
+        self.upload("c1", "u2")
+        self.assertEqual(self.state.run("GET_RESOURCES c1"), "u1|u2")
+        self.assertEqual(server.response_cache.peek(("GET_RESOURCES", "c2", "text")), "v1")
+        # The course list only changes for a new course
+        self.assertEqual(server.response_cache.peek(("GET_COURSES", "text")), "c1|c2")
+        self.upload("c3", "w1")
+        self.assertEqual(self.state.run("GET_COURSES"), "c1|c2|c3")
+
+    # The broker event is what reaches other servers' caches
+    def test_course_events_invalidate(self):
+        self.upload("c1", "u1")
+        self.assertEqual(self.state.run("GET_RESOURCES c1"), "u1")
+        server.handle_course_event(b"course:c1", b"{}")
+        self.assertIsNone(server.response_cache.peek(("GET_RESOURCES", "c1", "text")))
+
+    # A listing read before an upload, but finished after the upload's
+    # invalidation, must not be put back in the cache
+    def test_stale_fill_racing_an_invalidation_is_not_cached(self):
+        self.upload("c1", "u1")
+        read = threading.Event()
+        resume = threading.Event()
+
+        def produce():
+            with server.db_pool.connection() as conn:
+                rows = [row[0] for row in conn.execute(server.COURSE_RESOURCES_SQL, ("c1",))]
+            read.set()
+            resume.wait(5)
+            return rows
+
+        replies = []
+        fill = threading.Thread(target=lambda: replies.append(
+            server.cached_result(("GET_RESOURCES", "c1"), "text", produce)))
+        fill.start()
+        self.assertTrue(read.wait(5))
+        self.upload("c1", "u2")
+        resume.set()
+        fill.join(5)
+        # The slow reader gets what it read, but nobody after it does
+        self.assertEqual(replies, ["u1"])
+        self.assertIsNone(server.response_cache.peek(("GET_RESOURCES", "c1", "text")))
+        self.assertEqual(self.state.run("GET_RESOURCES c1"), "u1|u2")
+        self.assertEqual(server.response_cache.peek(("GET_RESOURCES", "c1", "text")), "u1|u2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import socket
+import threading
+import unittest
+
+import admission
+import protocol
+import server
+from support import ServerState
+
+URLS = [f"https://example.org/course/cs101/week-{i // 10}/resource-{i:04d}.pdf"
+        for i in range(200)]
+PAYLOAD = "|".join(URLS).encode()
+ZDICT = protocol.train_zdict(URLS)
+
+
+class CompressorTest(unittest.TestCase):
+    def test_round_trip(self):
+        compressor = protocol.Compressor()
+        compressed = compressor.compress(PAYLOAD)
+        self.assertEqual(compressed[0], protocol.COMPRESSED_MARKER)
+        self.assertTrue(protocol.is_compressed(compressed))
+        self.assertLess(len(compressed), len(PAYLOAD) // 5)
+        self.assertEqual(compressor.decompress(compressed), PAYLOAD)
+        self.assertEqual(compressor.compress(PAYLOAD.decode()), compressed)
+
+    def test_small_and_incompressible_payloads_are_sent_as_they_are(self):
+        compressor = protocol.Compressor(threshold=1024)
+        small = PAYLOAD[:1023]
+        self.assertIs(compressor.compress(small), small)
+        self.assertEqual(compressor.compress(small.decode()), small)
+        self.assertEqual(compressor.compress(b""), b"")
+        noise = os.urandom(4096)
+        self.assertIs(compressor.compress(noise), noise)
+        # Uncompressed payloads pass through decompress untouched
+        binary = protocol.encode_response(protocol.STATUS_OK, ["a"])
+        self.assertIs(compressor.decompress(binary), binary)
+        self.assertIs(compressor.decompress(small), small)
+
+    def test_shared_dictionary(self):
+        payload = "|".join(URLS[:20]).encode()
+        plain = protocol.Compressor(threshold=0)
+        shared = protocol.Compressor(ZDICT, threshold=0)
+        self.assertEqual(shared.token, f"zlib:{protocol.zdict_id(ZDICT)}")
+        compressed = shared.compress(payload)
+        self.assertLess(len(compressed), len(plain.compress(payload)))
+        self.assertEqual(shared.decompress(compressed), payload)
+        # Without the dictionary the payload cannot be read
+        with self.assertRaises(protocol.ProtocolError):
+            plain.decompress(compressed)
+
+    def test_bad_compressed_payloads(self):
+        compressor = protocol.Compressor()
+        compressed = compressor.compress(PAYLOAD)
+        for bad in (compressed[:len(compressed) // 2], bytes((protocol.COMPRESSED_MARKER,)) + b"junk"):
+            with self.assertRaises(protocol.ProtocolError):
+                compressor.decompress(bad)
+
+    def test_peer_that_did_not_negotiate(self):
+        compressed = protocol.Compressor().compress(PAYLOAD)
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.decompress_payload(None, compressed)
+        self.assertIs(protocol.decompress_payload(None, PAYLOAD), PAYLOAD)
+
+    def test_negotiation(self):
+        compressors = protocol.make_compressors(ZDICT)
+        shared_token, plain_token = list(compressors)
+        self.assertEqual(plain_token, "zlib")
+        self.assertEqual(protocol.negotiate_compression(f"HELLO 1 zlib {shared_token}", compressors),
+                         (shared_token, compressors[shared_token]))
+        self.assertEqual(protocol.negotiate_compression("HELLO 1 zlib zlib:00000000", compressors),
+                         ("zlib", compressors["zlib"]))
+        self.assertEqual(protocol.negotiate_compression("HELLO 1", compressors), (None, None))
+        self.assertEqual(protocol.negotiate_compression("HELLO 1 zlib", {}), (None, None))
+
+
+# The HELLO exchange and compressed frames on a threaded server connection
+class CompressedConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.state = ServerState()
+        self.addCleanup(self.state.close)
+        server.admission_control = admission.AdmissionControl(workers=2)
+        self.addCleanup(server.admission_control.shutdown)
+        self.addCleanup(setattr, server, "admission_control", None)
+        server.compressors = protocol.make_compressors(threshold=1024)
+        self.addCleanup(setattr, server, "compressors", {})
+        instructor = self.state.login("instructor", "i")
+        reply = self.state.run(f"UPLOAD_RESOURCES_BATCH {instructor} "
+                               + " ".join(f"c1 {url}" for url in URLS))
+        self.assertEqual(reply, f"Added {len(URLS)} resources")
+
+    def connect(self):
+        ours, peer = socket.socketpair()
+        self.addCleanup(peer.close)
+        threading.Thread(target=server.handle_client, args=(ours,), daemon=True).start()
+        peer.settimeout(5)
+        return peer
+
+    def request(self, peer, request_id, payload):
+        peer.sendall(protocol.encode_frame(request_id, payload))
+        frame = protocol.read_frame(peer)
+        self.assertEqual(frame[0], request_id)
+        return frame[1]
+
+    def test_negotiated_connection(self):
+        peer = self.connect()
+        self.assertEqual(self.request(peer, 1, b"HELLO 1 zlib"), b"HELLO 1 zlib")
+        compressor = protocol.Compressor()
+        reply = self.request(peer, 2, b"GET_RESOURCES c1")
+        self.assertTrue(protocol.is_compressed(reply))
+        self.assertEqual(compressor.decompress(reply), PAYLOAD)
+        # Short replies go out as they are; compressed requests are read
+        self.assertEqual(self.request(peer, 3, b"GET_RESOURCES nope"),
+                         b"Error: No resources found for this course!")
+        request = compressor.compress(b"GET_RESOURCES c1" + b" " * 2000)
+        self.assertTrue(protocol.is_compressed(request))
+        self.assertEqual(compressor.decompress(self.request(peer, 4, request)), PAYLOAD)
+
+    def test_connection_that_did_not_negotiate(self):
+        peer = self.connect()
+        self.assertEqual(self.request(peer, 1, b"HELLO 1"), b"HELLO 1")
+        self.assertEqual(self.request(peer, 2, b"GET_RESOURCES c1"), PAYLOAD)
+        # A compressed request it was never offered ends the connection
+        peer.sendall(protocol.encode_frame(3, protocol.Compressor().compress(PAYLOAD)))
+        self.assertIsNone(protocol.read_frame(peer))
+
+    def test_server_without_compression(self):
+        server.compressors = {}
+        peer = self.connect()
+        self.assertEqual(self.request(peer, 1, b"HELLO 1 zlib"), b"HELLO 1")
+        self.assertEqual(self.request(peer, 2, b"GET_RESOURCES c1"), PAYLOAD)
+
+
+if __name__ == "__main__":
+    unittest.main()
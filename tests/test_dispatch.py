@@ -0,0 +1,72 @@
+import socket
+import threading
+import unittest
+from concurrent.futures import Future
+
+import admission
+import protocol
+import server
+from support import ServerState
+
+OPCODES = protocol.OPCODES
+
+
+class DispatchTest(unittest.TestCase):
+    def setUp(self):
+        self.state = ServerState()
+        self.addCleanup(self.state.close)
+
+    def binary(self, name, *fields):
+        reply = server.dispatch_payload(protocol.encode_request(OPCODES[name], fields))
+        if isinstance(reply, Future):
+            reply = reply.result(10)
+        return protocol.decode_response(reply)
+
+    def test_binary_requests(self):
+        self.assertEqual(self.binary("REGISTER", "student", "a b", "p|w"),
+                         (protocol.STATUS_OK, ["Registration Successful"]))
+        self.assertEqual(self.binary("REGISTER", "student", "a b", "p|w"),
+                         (protocol.STATUS_CONFLICT, ["Error: Username already exists!"]))
+        self.assertEqual(self.binary("GET_COURSES"),
+                         (protocol.STATUS_EMPTY, ["No courses available"]))
+        self.assertEqual(self.binary("GET_RESOURCES")[0], protocol.STATUS_BAD_REQUEST)
+
+    def test_malformed_binary_requests(self):
+        for payload in (bytes([protocol.BINARY_VERSION]),
+                        protocol.encode_request(OPCODES["GET_RESOURCES"], ["c1"])[:-1],
+                        protocol.encode_request(OPCODES["GET_RESOURCES"], [b"\xff\xfe"]),
+                        protocol.encode_request(250, [])):
+            status, fields = protocol.decode_response(server.dispatch_payload(payload))
+            self.assertEqual(status, protocol.STATUS_BAD_REQUEST, payload)
+
+    def test_text_that_is_not_utf8(self):
+        self.assertEqual(server.dispatch_payload(b"GET_RESOURCES \xff\xfe"), protocol.NOT_UTF8)
+        self.assertIsNone(server.parse_listen_request(b"LISTEN \xff"))
+        self.assertIsNone(server.parse_listen_request(
+            protocol.encode_request(OPCODES["LISTEN"], [b"\xff"])))
+        self.assertIsNone(server.parse_hello_request(b"HELLO \xff"))
+        self.assertEqual(protocol.text_status(protocol.NOT_UTF8), protocol.STATUS_BAD_REQUEST)
+
+    # A framed connection answers such a request and carries on
+    def test_framed_connection_replies_to_bad_text(self):
+        server.admission_control = admission.AdmissionControl(workers=2)
+        self.addCleanup(server.admission_control.shutdown)
+        self.addCleanup(setattr, server, "admission_control", None)
+        ours, peer = socket.socketpair()
+        self.addCleanup(peer.close)
+
+        def serve():
+            with ours:
+                server.handle_framed_client(ours)
+        threading.Thread(target=serve, daemon=True).start()
+        peer.settimeout(5)
+        for request_id, payload in ((1, b"LISTEN \xff"), (2, b"HELLO \xff"),
+                                    (3, b"\xff\xfe"), (4, b"GET_COURSES")):
+            peer.sendall(protocol.encode_frame(request_id, payload))
+            self.assertEqual(protocol.read_frame(peer)[0], request_id)
+        peer.sendall(protocol.encode_frame(5, b"GET_RESOURCES \xc3"))
+        self.assertEqual(protocol.read_frame(peer), (5, protocol.NOT_UTF8.encode()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import db
+import eventlog
+
+
+class RecoverTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(os.path.join(self.tmp.name, "lms.db"))
+        db.create_schema(self.conn)
+        db.migrate(self.conn)
+        self.log_dir = os.path.join(self.tmp.name, "events")
+        self.log = eventlog.EventLog(self.log_dir)
+
+    def tearDown(self):
+        self.log.close()
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def upload(self, course_id, resource_url):
+        cursor = self.conn.execute(
+            "INSERT INTO courses (course_id, resource_url, poster_username) VALUES (?, ?, ?)",
+            (course_id, resource_url, "instructor"))
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def reopen(self):
+        self.log.close()
+        self.log = eventlog.EventLog(self.log_dir)
+
+    def urls(self, course_id):
+        records, head = self.log.read(course_id)
+        return [record["resource_url"] for record in records]
+
+    def test_appends_rows_missing_from_the_logs(self):
+        for url in ("a", "b"):
+            self.upload("c1", url)
+        self.upload("c2", "x")
+        self.assertEqual(self.log.recover(self.conn), 3)
+        self.assertEqual(self.urls("c1"), ["a", "b"])
+        self.assertEqual(self.urls("c2"), ["x"])
+        # Nothing is appended twice
+        self.assertEqual(self.log.recover(self.conn), 0)
+
+    def test_appends_only_the_lost_tail(self):
+        row_id = self.upload("c1", "a")
+        self.log.append("c1", eventlog.make_record(row_id, "a", "instructor", None))
+        self.upload("c1", "b")
+        self.upload("c1", "c")
+        self.reopen()
+        self.assertEqual(self.log.recover(self.conn), 2)
+        self.assertEqual(self.urls("c1"), ["a", "b", "c"])
+
+    def test_torn_record_is_dropped_and_recovered(self):
+        for url in ("a", "b"):
+            self.upload("c1", url)
+        self.log.recover(self.conn)
+        head = self.log.head("c1")
+        self.log.close()
+        # A record header whose payload never made it to disk
+        with open(self.log._path("c1"), "r+b") as f:
+            f.seek(head)
+            f.write(eventlog.RECORD_HEADER.pack(100, 0) + b'{"id":')
+        self.upload("c1", "c")
+        self.log = eventlog.EventLog(self.log_dir)
+        self.assertEqual(self.log.head("c1"), head)
+        self.assertEqual(self.log.recover(self.conn), 1)
+        self.assertEqual(self.urls("c1"), ["a", "b", "c"])
+
+    def test_read_rejects_offsets_inside_a_record(self):
+        self.upload("c1", "a")
+        self.log.recover(self.conn)
+        with self.assertRaises(ValueError):
+            self.log.read("c1", 1)
+        with self.assertRaises(ValueError):
+            self.log.read("c1", self.log.head("c1") + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import socket
+import threading
+import unittest
+
+import protocol
+
+
+class FrameWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.ours, self.peer = socket.socketpair()
+        self.peer.settimeout(5)
+
+    def tearDown(self):
+        self.ours.close()
+        self.peer.close()
+
+    def frames(self, n):
+        return [protocol.read_frame(self.peer) for _ in range(n)]
+
+    def test_frames_and_streams_are_sent(self):
+        writer = protocol.FrameWriter(self.ours)
+        writer.expect()
+        writer.expect()
+        writer.send_stream(1, (chunk for chunk in [b"a1", b"a2", b"a3"]))
+        writer.send(2, "reply", ends_reply=True)
+        got = self.frames(5)
+        self.assertEqual(sorted(got, key=lambda frame: frame[0]),
+                         [(1, b"a1"), (1, b"a2"), (1, b"a3"), (1, b""), (2, b"reply")])
+        writer.close(5)
+        self.assertEqual(writer.unsent, 0)
+
+    def test_overflow_drops_the_connection(self):
+        # The peer never reads; the socket buffers fill and the writer
+        # thread blocks, then the frames queued behind it hit the limit
+        writer = protocol.FrameWriter(self.ours, max_buffered=64 * 1024)
+        chunk = b"x" * 16 * 1024
+        sent = 0
+        while writer.send(1, chunk) and sent < 10000:
+            sent += 1
+        self.assertLess(sent, 10000)
+        self.assertTrue(writer.failed)
+        self.assertFalse(writer.send(2, b"late"))
+        self.assertFalse(writer.wait_for_room(1))
+        writer.close(5)
+        self.assertFalse(writer.thread.is_alive())
+
+    def test_close_waits_for_expected_replies(self):
+        writer = protocol.FrameWriter(self.ours)
+        writer.expect()
+        closer = threading.Thread(target=writer.close, args=(5,))
+        closer.start()
+        closer.join(0.2)
+        self.assertTrue(closer.is_alive())
+        writer.send(7, b"late reply", ends_reply=True)
+        closer.join(5)
+        self.assertFalse(closer.is_alive())
+        self.assertEqual(self.frames(1), [(7, b"late reply")])
+
+    def test_close_gives_up_on_a_peer_that_does_not_read(self):
+        writer = protocol.FrameWriter(self.ours)
+        writer.send(1, b"x" * 4 * 1024 * 1024)
+        writer.close(0.2)
+        self.assertTrue(writer.failed)
+        self.assertFalse(writer.thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
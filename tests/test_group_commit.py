@@ -0,0 +1,121 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import db
+
+
+# Connections whose commit() fails while `failing` is set, like a full disk
+class FlakyConnection(sqlite3.Connection):
+    failing = False
+
+    def commit(self):
+        if FlakyConnection.failing:
+            raise sqlite3.OperationalError("disk I/O error")
+        super().commit()
+
+
+class FlakyPool(db.ConnectionPool):
+    def open(self):
+        return sqlite3.connect(self.path, check_same_thread=False, factory=FlakyConnection)
+
+
+class RecordingPublisher:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, message):
+        self.published.append((topic, message))
+
+
+def insert(value, fail=False):
+    def write(cursor):
+        cursor.execute("INSERT INTO items (value) VALUES (?)", (value,))
+        if fail:
+            raise ValueError(f"{value} failed")
+        return value
+    return write
+
+
+class GroupCommitWriterTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.pool = FlakyPool(os.path.join(tmp.name, "test.db"))
+        self.addCleanup(self.pool.close_all)
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TABLE items (value TEXT)")
+            conn.commit()
+        self.publisher = RecordingPublisher()
+        # A long window, so everything submitted at once shares a batch
+        self.writer = db.GroupCommitWriter(self.pool, self.publisher, window_ms=200)
+        self.addCleanup(self.writer.close)
+        self.addCleanup(setattr, FlakyConnection, "failing", False)
+
+    def stored(self):
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute("SELECT value FROM items ORDER BY rowid")]
+
+    def test_a_failing_job_rolls_back_only_its_own_writes(self):
+        futures = [self.writer.submit(insert("a"), [("t", "a")]),
+                   self.writer.submit(insert("b", fail=True), [("t", "b")]),
+                   self.writer.submit(insert("c"), [("t", "c")])]
+        self.assertEqual(futures[0].result(5), "a")
+        with self.assertRaisesRegex(ValueError, "b failed"):
+            futures[1].result(5)
+        self.assertEqual(futures[2].result(5), "c")
+        self.assertEqual(self.writer.batches, 1)
+        self.assertEqual(self.stored(), ["a", "c"])
+        self.assertEqual(self.publisher.published, [("t", "a"), ("t", "c")])
+
+    def test_a_failing_job_alone_rolls_back_its_transaction(self):
+        failed = self.writer.submit(insert("a", fail=True), alone=True)
+        with self.assertRaises(ValueError):
+            failed.result(5)
+        self.assertEqual(self.writer.execute(insert("b")), "b")
+        self.assertEqual(self.stored(), ["b"])
+
+    def test_hooks_run_in_commit_order_before_callers_are_answered(self):
+        ran = []
+
+        def hook(name):
+            def on_commit(result):
+                ran.append((name, result, self.stored()))
+                return [("hook", name)]
+            return on_commit
+
+        futures = [self.writer.submit(insert(name, fail=name == "y"), [("t", name)],
+                                      on_commit=hook(name))
+                   for name in ("x", "y", "z")]
+        futures[0].result(5)
+        # The whole batch is committed before the first hook runs
+        self.assertEqual(ran, [("x", "x", ["x", "z"]), ("z", "z", ["x", "z"])])
+        self.assertEqual(self.publisher.published,
+                         [("t", "x"), ("hook", "x"), ("t", "z"), ("hook", "z")])
+
+    def test_a_failing_hook_does_not_fail_the_write(self):
+        def broken(result):
+            raise RuntimeError("hook failed")
+        self.assertEqual(self.writer.execute(insert("a"), [("t", "a")], on_commit=broken), "a")
+        self.assertEqual(self.publisher.published, [("t", "a")])
+
+    def test_a_failed_commit_fails_the_whole_batch(self):
+        ran = []
+        FlakyConnection.failing = True
+        futures = [self.writer.submit(insert(name), [("t", name)], on_commit=ran.append)
+                   for name in ("a", "b")]
+        for future in futures:
+            with self.assertRaisesRegex(sqlite3.OperationalError, "disk I/O error"):
+                future.result(5)
+        FlakyConnection.failing = False
+        # Nothing was acknowledged, announced or kept, and the writer goes on
+        self.assertEqual(ran, [])
+        self.assertEqual(self.publisher.published, [])
+        self.assertEqual(self.stored(), [])
+        self.assertEqual(self.writer.execute(insert("c")), "c")
+        self.assertEqual(self.stored(), ["c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
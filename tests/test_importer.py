@@ -0,0 +1,52 @@
+import contextlib
+import io
+import unittest
+
+import importer
+import protocol
+
+
+class ImporterArgsTest(unittest.TestCase):
+    def refused(self, *argv):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr), self.assertRaises(SystemExit):
+            importer.parse_args(list(argv))
+        return stderr.getvalue()
+
+    def test_batch_size_is_bounded_by_the_server_limit(self):
+        self.assertEqual(importer.parse_args(["rows.csv"]).batch_size, 5000)
+        args = importer.parse_args(["rows.csv", "--batch-size", str(protocol.MAX_BATCH_ROWS)])
+        self.assertEqual(args.batch_size, protocol.MAX_BATCH_ROWS)
+        for size in (protocol.MAX_BATCH_ROWS + 1, 0, -5):
+            self.assertIn("--batch-size must be between 1 and",
+                          self.refused("rows.csv", "--batch-size", str(size)))
+        self.assertIn("--in-flight must be at least 1",
+                      self.refused("rows.csv", "--in-flight", "0"))
+
+    def test_format_from_the_file_name(self):
+        self.assertEqual(importer.parse_args(["rows.csv"]).format, "csv")
+        self.assertEqual(importer.parse_args(["rows.ndjson"]).format, "jsonl")
+        self.assertIn("pass --format", self.refused("rows.txt"))
+
+
+class BatchesTest(unittest.TestCase):
+    def test_batches_hold_one_poster_and_at_most_batch_size_rows(self):
+        rows = [("c1", f"u{i}", "a") for i in range(5)] + [("c2", "v", "b"), ("c3", "w", "a")]
+        self.assertEqual(list(importer.batches(rows, 2)), [
+            ("a", ["c1", "u0", "c1", "u1"]),
+            ("a", ["c1", "u2", "c1", "u3"]),
+            ("a", ["c1", "u4"]),
+            ("b", ["c2", "v"]),
+            ("a", ["c3", "w"]),
+        ])
+
+    def test_rows(self):
+        f = io.StringIO("course_id,resource_url,poster\nc1,u1,\nc2,u2,b\n\n")
+        self.assertEqual(list(importer.read_rows(f, "csv", "a")),
+                         [("c1", "u1", "a"), ("c2", "u2", "b")])
+        with self.assertRaisesRegex(importer.BadInput, "line 2: no poster"):
+            list(importer.read_rows(io.StringIO("c1,u1,a\nc1,u2\n"), "csv", None))
+
+
+if __name__ == "__main__":
+    unittest.main()
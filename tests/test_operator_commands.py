@@ -0,0 +1,77 @@
+import os
+import time
+import unittest
+
+import server
+from support import ServerState
+
+
+# PROFILE and REPLAY are for instructors and admins, proven by a live
+# session; a bare username never counts, even without --require-auth
+class OperatorCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.state = ServerState()
+        self.student = self.state.login("student", "s")
+        self.instructor = self.state.login("instructor", "i")
+        self.admin = self.state.login("admin", "a")
+
+    def tearDown(self):
+        while server.command_profiler.running:
+            time.sleep(0.01)
+        self.state.close()
+
+    def test_profile_needs_an_operator_session(self):
+        run = self.state.run
+        self.assertEqual(run("PROFILE i 1"), "Error: Permission denied")
+        self.assertEqual(run("PROFILE a 1"), "Error: Permission denied")
+        self.assertEqual(run(f"PROFILE {self.student} 1"), "Error: Permission denied")
+        self.assertEqual(run("PROFILE 1"), "Error: Missing arguments!")
+        # Past the check, the server's own settings decide
+        self.assertTrue(run(f"PROFILE {self.instructor} 1").startswith("Error: Profiling is disabled"))
+
+    def test_profile_runs_for_operators(self):
+        server.profile_dir = self.state.tmp.name
+        reply = self.state.run(f"PROFILE {self.admin} 0.05")
+        self.assertTrue(reply.startswith("Profiling all commands"), reply)
+        path = reply.rsplit(" ", 1)[1]
+        deadline = time.monotonic() + 5
+        while not os.path.exists(path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(os.path.exists(path))
+
+    def test_logged_out_session_loses_its_rights(self):
+        self.assertEqual(self.state.run(f"LOGOUT {self.instructor}"), "Logged out")
+        self.assertEqual(self.state.run(f"PROFILE {self.instructor} 1"), "Error: Permission denied")
+
+    def test_replay_needs_an_operator_session(self):
+        run = self.state.run
+        subscription = server.message_broker.psubscribe("course:*")
+        self.assertEqual(run(f"UPLOAD_RESOURCE c1 https://a/1 {self.instructor}"),
+                         "Resource Added Successfully")
+        self.assertEqual(run("REPLAY i c1"), "Error: Permission denied")
+        self.assertEqual(run(f"REPLAY {self.student} c1"), "Error: Permission denied")
+        self.assertEqual(run(f"REPLAY {self.instructor} c1"), "Replayed 1 notifications")
+        self.assertEqual(run(f"REPLAY {self.admin} c1 0"), "Replayed 1 notifications")
+        replayed = []
+        while True:
+            message = subscription.get_message(timeout=1)
+            if message is None:
+                break
+            replayed.append(message)
+        # The upload's own notification plus the two replays, none for the refused ones
+        self.assertEqual(len(replayed), 3)
+
+    def test_register_only_opens_student_accounts(self):
+        run = self.state.run
+        self.assertEqual(run("REGISTER instructor i2 pw"), "Error: Permission denied")
+        self.assertEqual(run("REGISTER admin a2 pw"), "Error: Permission denied")
+        self.assertEqual(run("REGISTER instructor i2 pw a"), "Error: Permission denied")
+        self.assertEqual(run(f"REGISTER instructor i2 pw {self.instructor}"),
+                         "Error: Permission denied")
+        self.assertEqual(run("REGISTER teacher t pw"), "Error: Invalid role")
+        self.assertEqual(run(f"REGISTER instructor i2 pw {self.admin}"), "Registration Successful")
+        self.assertEqual(run("LOGIN i2 pw").split()[:3], ["Login", "successful", "instructor"])
+
+
+if __name__ == "__main__":
+    unittest.main()
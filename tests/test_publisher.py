@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+import unittest
+
+import server
+from broker import CoalescingPublisher
+
+
+# A broker whose pipelines fail while `failures_left` is above zero
+class FakeBroker:
+    def __init__(self, failures=0):
+        self.failures_left = failures
+        self.published = []
+        self.lock = threading.Lock()
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, broker):
+        self.broker = broker
+        self.queued = []
+
+    def publish(self, topic, message):
+        self.queued.append((topic, message))
+
+    def execute(self):
+        with self.broker.lock:
+            if self.broker.failures_left > 0:
+                self.broker.failures_left -= 1
+                raise ConnectionError("broker down")
+            self.broker.published.extend(self.queued)
+
+
+def notification(course_id, url, offset):
+    return {"course_id": course_id, "resource_url": url,
+            "poster_username": "i", "offset": offset}
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class CoalescingPublisherTest(unittest.TestCase):
+    def publisher(self, broker, **kwargs):
+        publisher = CoalescingPublisher(broker, **kwargs)
+        self.addCleanup(publisher.close)
+        return publisher
+
+    def test_a_window_of_course_notifications_is_merged(self):
+        broker = FakeBroker()
+        # A long window, so close() is what sends
+        publisher = self.publisher(broker, window_ms=10000,
+                                   merge=server.merge_course_notifications)
+        for i in range(3):
+            publisher.publish("course:c1", notification("c1", f"u{i}", i))
+        publisher.publish("course:c2", notification("c2", "v0", 0))
+        self.assertEqual(len(publisher), 4)
+        publisher.close()
+        self.assertEqual([topic for topic, message in broker.published],
+                         ["course:c1", "course:c2"])
+        merged = json.loads(broker.published[0][1])
+        self.assertEqual((merged["resource_urls"], merged["offset"]), (["u0", "u1", "u2"], 0))
+        self.assertEqual(json.loads(broker.published[1][1]), notification("c2", "v0", 0))
+        self.assertEqual((publisher.published, publisher.merged, len(publisher)), (2, 2, 0))
+
+    def test_the_oldest_messages_are_dropped_past_max_buffered(self):
+        broker = FakeBroker()
+        publisher = self.publisher(broker, window_ms=10000, max_buffered=3)
+        for i in range(5):
+            publisher.publish("t", f"m{i}")
+        self.assertEqual((len(publisher), publisher.dropped), (3, 2))
+        publisher.close()
+        self.assertEqual(broker.published, [("t", "m2"), ("t", "m3"), ("t", "m4")])
+
+    def test_a_failed_batch_is_retried_ahead_of_newer_messages(self):
+        broker = FakeBroker(failures=1)
+        publisher = self.publisher(broker, window_ms=0)
+        publisher.publish("t", "a")
+        wait_for(lambda: publisher.failures == 1)
+        publisher.publish("t", "b")
+        wait_for(lambda: publisher.published == 2)
+        self.assertEqual(broker.published, [("t", "a"), ("t", "b")])
+        self.assertEqual((publisher.dropped, len(publisher)), (0, 0))
+
+    def test_close_gives_a_failing_broker_one_last_try(self):
+        broker = FakeBroker(failures=100)
+        publisher = self.publisher(broker, window_ms=10000)
+        publisher.publish("t", "a")
+        publisher.close()
+        self.assertEqual(broker.published, [])
+        self.assertEqual((publisher.failures, publisher.dropped), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+
+import server
+
+
+# The hot queries must stay on indexes once a fresh database is migrated
+class QueryPlanTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        server.init_db(os.path.join(self.tmp.name, "lms.db"))
+
+    def tearDown(self):
+        server.db_pool.close_all()
+        server.event_log.close()
+        server.db_pool = server.event_log = None
+        self.tmp.cleanup()
+
+    def test_no_full_scans(self):
+        self.assertEqual(server.check_query_plans(), [])
+
+    def test_reports_missing_index(self):
+        with server.db_pool.connection() as conn:
+            conn.execute("DROP INDEX idx_courses_course_id")
+            conn.commit()
+        problems = server.check_query_plans()
+        self.assertTrue(problems)
+        self.assertTrue(any(problem.startswith("SCAN courses") for problem in problems))
+
+
+if __name__ == "__main__":
+    unittest.main()
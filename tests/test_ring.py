@@ -0,0 +1,48 @@
+import unittest
+
+from ring import HashRing
+
+KEYS = [f"course{i}" for i in range(10000)]
+
+
+class HashRingTest(unittest.TestCase):
+    def owners(self, ring):
+        return {key: ring.node_for(key) for key in KEYS}
+
+    def test_empty_ring(self):
+        with self.assertRaises(LookupError):
+            HashRing().node_for("course1")
+
+    def test_placement_is_stable_and_even(self):
+        nodes = ["n1", "n2", "n3", "n4"]
+        owners = self.owners(HashRing(nodes))
+        self.assertEqual(owners, self.owners(HashRing(reversed(nodes))))
+        for node in nodes:
+            share = sum(owner == node for owner in owners.values()) / len(KEYS)
+            self.assertGreater(share, 0.15)
+            self.assertLess(share, 0.35)
+
+    def test_adding_a_node_only_moves_keys_to_it(self):
+        ring = HashRing(["n1", "n2", "n3"])
+        before = self.owners(ring)
+        ring.add("n4")
+        ring.add("n4")
+        self.assertEqual(len(ring), 4)
+        after = self.owners(ring)
+        moved = [key for key in KEYS if before[key] != after[key]]
+        self.assertTrue(all(after[key] == "n4" for key in moved))
+        self.assertLess(len(moved) / len(KEYS), 0.4)
+
+    def test_removing_a_node_only_moves_its_keys(self):
+        ring = HashRing(["n1", "n2", "n3", "n4"])
+        before = self.owners(ring)
+        ring.remove("n2")
+        after = self.owners(ring)
+        for key in KEYS:
+            if before[key] != "n2":
+                self.assertEqual(after[key], before[key])
+            self.assertNotEqual(after[key], "n2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import time
+import unittest
+
+import auth
+import server
+from support import ServerState
+
+SECRET = b"cluster secret"
+
+
+class SessionTableTest(unittest.TestCase):
+    def test_create_and_get(self):
+        table = auth.SessionTable()
+        token = table.create("s", "student")
+        session = table.get(token)
+        self.assertEqual((session.username, session.role), ("s", "student"))
+        self.assertIsNone(table.get("nonsense"))
+        self.assertNotEqual(table.create("s", "student"), token)
+
+    def test_idle_sessions_expire(self):
+        table = auth.SessionTable(ttl=60)
+        token = table.create("s", "student")
+        # Each use pushes the expiry out again
+        table.sessions[token].expires_at = time.monotonic() + 1
+        self.assertIsNotNone(table.get(token))
+        self.assertGreater(table.sessions[token].expires_at, time.monotonic() + 30)
+        table.sessions[token].expires_at = time.monotonic() - 1
+        self.assertIsNone(table.get(token))
+        self.assertEqual(len(table), 0)
+
+    def test_expired_sessions_are_evicted(self):
+        table = auth.SessionTable(ttl=60)
+        old = table.create("a", "student")
+        table.sessions[old].expires_at = time.monotonic() - 1
+        table.create("b", "student")
+        self.assertNotIn(old, table.sessions)
+
+    def test_session_count_is_bounded(self):
+        table = auth.SessionTable(max_sessions=10)
+        tokens = [table.create(f"u{i}", "student") for i in range(25)]
+        self.assertEqual(len(table), 10)
+        self.assertIsNone(table.get(tokens[0]))
+        self.assertIsNotNone(table.get(tokens[-1]))
+
+    def test_revoke(self):
+        table = auth.SessionTable()
+        token = table.create("s", "student")
+        self.assertTrue(table.revoke(token))
+        self.assertIsNone(table.get(token))
+        self.assertFalse(table.revoke(token))
+
+
+class SignedTokenTest(unittest.TestCase):
+    def test_other_tables_with_the_secret_accept_it(self):
+        token = auth.SessionTable(secret=SECRET).create("s.o", "instructor")
+        session = auth.SessionTable(secret=SECRET).get(token)
+        self.assertEqual((session.username, session.role), ("s.o", "instructor"))
+        self.assertIsNone(auth.SessionTable(secret=b"other").get(token))
+        self.assertIsNone(auth.SessionTable().get(token))
+
+    def test_tampered_tokens_are_refused(self):
+        token = auth.SessionTable(secret=SECRET).create("s", "student")
+        nonce, username, role, expires, mac = token.split(".")
+        table = auth.SessionTable(secret=SECRET)
+        for forged in (".".join((nonce, username, "admin", expires, mac)),
+                       ".".join((nonce, username, role, str(int(expires) + 3600), mac)),
+                       ".".join((nonce, auth.b64url(b"a"), role, expires, mac)),
+                       token[:-2] + ("AA" if token[-2:] != "AA" else "BB"),
+                       token + ".x"):
+            self.assertIsNone(table.get(forged), forged)
+        self.assertIsNotNone(table.get(token))
+
+    def test_signed_tokens_expire_from_login(self):
+        issuer = auth.SessionTable(ttl=-1, secret=SECRET)
+        token = issuer.create("s", "student")
+        self.assertIsNone(auth.SessionTable(secret=SECRET).get(token))
+
+    def test_revocation_reaches_tables_that_never_saw_the_token(self):
+        token = auth.SessionTable(secret=SECRET).create("s", "student")
+        table = auth.SessionTable(secret=SECRET)
+        self.assertTrue(table.revoke(token))
+        self.assertIsNone(table.get(token))
+        self.assertFalse(table.revoke(token))
+
+
+class LooksLikeTokenTest(unittest.TestCase):
+    def test_tokens(self):
+        self.assertTrue(auth.looks_like_token(auth.SessionTable().create("s", "student")))
+        self.assertTrue(auth.looks_like_token(
+            auth.SessionTable(secret=SECRET).create("s", "student")))
+
+    def test_usernames(self):
+        for name in ("s", "alice", "a.b", "x" * 31, "x" * 33, "é" * 32):
+            self.assertFalse(auth.looks_like_token(name), name)
+
+
+class LoginTest(unittest.TestCase):
+    def setUp(self):
+        self.state = ServerState()
+        self.addCleanup(self.state.close)
+        self.token = self.state.login("student", "s")
+
+    def test_login_and_logout(self):
+        run = self.state.run
+        self.assertEqual(run("LOGIN s wrong"), "Error: Invalid credentials")
+        self.assertEqual(run("LOGIN nobody pw"), "Error: Invalid credentials")
+        self.assertEqual(server.authenticate(self.token), "s")
+        self.assertEqual(run(f"LOGOUT {self.token}"), "Logged out")
+        self.assertEqual(run(f"LOGOUT {self.token}"), "Error: Invalid or expired session")
+        self.assertIsNone(server.authenticate(self.token))
+        self.assertEqual(run(f"GET_SUBSCRIBED_COURSES {self.token}"),
+                         "Error: Invalid or expired session")
+
+    def test_plain_text_passwords_are_rehashed(self):
+        with server.db_pool.connection() as conn:
+            conn.execute("INSERT INTO users (username, password, role) VALUES ('old', 'pw', 'student')")
+            conn.commit()
+        self.assertTrue(self.state.run("LOGIN old pw").startswith("Login successful student "))
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            with server.db_pool.connection() as conn:
+                stored = conn.execute("SELECT password FROM users WHERE username = 'old'").fetchone()[0]
+            if auth.is_hashed(stored):
+                break
+            time.sleep(0.01)
+        self.assertTrue(auth.verify_password("pw", stored))
+        self.assertTrue(auth.is_hashed(stored))
+
+    def test_bare_usernames(self):
+        self.assertEqual(server.authenticate("s"), "s")
+        self.assertIsNone(server.authenticate("nobody"))
+        server.require_auth = True
+        self.assertIsNone(server.authenticate("s"))
+        self.assertEqual(server.authenticate(self.token), "s")
+
+    # Role-gated commands take a live session only, even without
+    # --require-auth and for a user who has the role
+    def test_bare_username_cannot_run_role_gated_commands(self):
+        self.state.login("admin", "a")
+        for require_auth in (False, True):
+            server.require_auth = require_auth
+            self.assertEqual(self.state.run("PROFILE a 1"), "Error: Permission denied")
+            self.assertEqual(self.state.run("REPLAY a c1"), "Error: Permission denied")
+            self.assertIsNone(server.privileged_session("a", server.ADMIN_ROLES))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import socket
+import threading
+import unittest
+
+import client
+import protocol
+import server
+
+
+# A peer that answers every framed request with `reply` and nothing more,
+# like a server from before refusals were ended with an empty frame
+def serve_single_replies(listener, reply):
+    conn, _ = listener.accept()
+    with conn:
+        while True:
+            frame = protocol.read_frame(conn)
+            if frame is None:
+                return
+            conn.sendall(protocol.encode_frame(frame[0], reply))
+
+
+class StreamRefusalTest(unittest.TestCase):
+    def connect(self, reply):
+        listener = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(listener.close)
+        threading.Thread(target=serve_single_replies, args=(listener, reply),
+                         daemon=True).start()
+        conn = client.Connection(*listener.getsockname(), binary=False)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_refusal_ends_the_stream(self):
+        conn = self.connect(b"Error: Invalid or expired session")
+        self.assertEqual(list(conn.stream("STREAM_NEW_RESOURCES nobody c1")),
+                         [b"Error: Invalid or expired session"])
+        # The connection is still usable afterwards
+        self.assertEqual(conn.submit("GET_COURSES").result(5),
+                         b"Error: Invalid or expired session")
+
+    def test_binary_busy_reply_ends_the_stream(self):
+        busy = protocol.encode_response(protocol.STATUS_BUSY, [protocol.busy_text(0.1)])
+        conn = self.connect(busy)
+        self.assertEqual(list(conn.stream("STREAM_RESOURCES c1")), [busy])
+
+    def test_stream_requests_are_recognised(self):
+        opcode = protocol.OPCODES["STREAM_RESOURCES"]
+        self.assertTrue(server.is_stream_request(b"STREAM_RESOURCES c1"))
+        self.assertTrue(server.is_stream_request(protocol.encode_request(opcode, ["c1"])))
+        self.assertFalse(server.is_stream_request(b"GET_RESOURCES c1"))
+        self.assertFalse(server.is_stream_request(b"\xff\xfe"))
+        self.assertFalse(server.is_stream_request(b""))
+
+
+if __name__ == "__main__":
+    unittest.main()